@@ -0,0 +1,6 @@
+# Benchmarks of the thzsoftware hot paths. They need no network access: traces are synthesised from
+# helper.create_mock_thz_pulse (see generators) or read from the bundled example data.
+#
+# run the suite from the repository root:  python -m benchmarks [--quick] [--output results.json]
+#                                                               [--compare baseline.json] [--select pattern]
+# The bench_* modules are standalone comparisons of one optimisation each, e.g. python -m benchmarks.bench_fft
@@ -0,0 +1,41 @@
+# Loading time of DataSet for a synthetic tree of pulse files, serial versus thread and process pools, and with the
+# dedicated pulse reader (file_format="pulse").
+# run from the repository root:  python -m benchmarks.bench_data_load
+import os
+import tempfile
+import time
+
+from benchmarks.generators import make_tree
+from thzsoftware.data import DataSet
+
+N_DIRECTORIES = 10
+N_FILES_PER_DIRECTORY = 300
+N_SAMPLES = 500
+WORKERS = os.cpu_count()
+
+
+def time_load(root, **kwargs):
+    start = time.perf_counter()
+    DataSet(root, "time", **kwargs)
+    return time.perf_counter() - start
+
+
+def main():
+    with tempfile.TemporaryDirectory() as root:
+        make_tree(root, N_DIRECTORIES, N_FILES_PER_DIRECTORY, N_SAMPLES)
+        n_files = N_DIRECTORIES * N_FILES_PER_DIRECTORY
+        print(f"{n_files} files of {N_SAMPLES} samples, {WORKERS} workers")
+
+        t_serial = time_load(root)
+        print(f"{'serial':>10}: {t_serial:8.3f} s  {n_files / t_serial:8.0f} files/s")
+        for label, kwargs in (("threads", dict(workers=WORKERS)),
+                              ("processes", dict(workers=WORKERS, processes=True)),
+                              ("pulse", dict(file_format="pulse")),
+                              ("pulse+proc", dict(workers=WORKERS, processes=True, file_format="pulse"))):
+            t_parallel = time_load(root, **kwargs)
+            print(f"{label:>10}: {t_parallel:8.3f} s  {n_files / t_parallel:8.0f} files/s  "
+                  f"speed-up {t_serial / t_parallel:5.1f}")
+
+
+if __name__ == "__main__":
+    main()
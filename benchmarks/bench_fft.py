@@ -0,0 +1,60 @@
+# phase.fft against the previous implementation (complex fft of the padded trace, half of it discarded) for stacks
+# of traces, including fast-length padding, float32 and multithreaded transforms.
+# run from the repository root:  python -m benchmarks.bench_fft
+import os
+import time
+
+import numpy as np
+import scipy.fft as ft
+
+from benchmarks.generators import make_traces
+from thzsoftware.tds import phase as ph
+
+SAMPLE_RATE = 2e13
+PAD = 500
+TRACE_COUNTS = (1, 100, 1000)
+
+
+# the implementation before the rfft path, applied trace by trace as it only took single traces
+def legacy_fft(amplitude_array, sample_rate, pad=None):
+    n = len(amplitude_array)
+    if pad:
+        amplitude_array = np.pad(amplitude_array, (0, pad), mode="constant")
+    amplitude_transform = ft.fft(amplitude_array)[:n // 2]
+    argument_transform = ft.fftfreq(n, sample_rate ** -1)[:n // 2]
+    return argument_transform, amplitude_transform
+
+
+def best_of(func, repeat=5):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    workers = os.cpu_count()
+    variants = (
+        ("legacy (loop)", lambda traces: [legacy_fft(trace, SAMPLE_RATE, pad=PAD) for trace in traces]),
+        ("rfft", lambda traces: ph.fft(traces, SAMPLE_RATE, pad=PAD)),
+        ("rfft fast length", lambda traces: ph.fft(traces, SAMPLE_RATE, pad=PAD, fast_length=True)),
+        ("rfft float32", lambda traces: ph.fft(traces, SAMPLE_RATE, pad=PAD, single_precision=True)),
+        (f"rfft {workers} workers", lambda traces: ph.fft(traces, SAMPLE_RATE, pad=PAD, workers=workers)),
+    )
+
+    stacks = [make_traces(n_traces) for n_traces in TRACE_COUNTS]
+    print(f"{'variant':>20} " + " ".join(f"{n_traces:>10} tr" for n_traces in TRACE_COUNTS) + "   [ms]")
+    for label, func in variants:
+        timings = [best_of(lambda: func(traces)) for traces in stacks]
+        print(f"{label:>20} " + " ".join(f"{1e3 * timing:>13.2f}" for timing in timings))
+
+    traces = stacks[-1]
+    for label, kwargs in (("complex128", {}), ("complex64", dict(single_precision=True))):
+        print(f"spectrum of {len(traces)} traces as {label}: "
+              f"{ph.fft(traces, SAMPLE_RATE, pad=PAD, **kwargs)[1].nbytes / 2 ** 20:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
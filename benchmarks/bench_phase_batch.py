@@ -0,0 +1,59 @@
+# Throughput of the tds.phase pipeline (fft -> compute_phase -> extrapolate_phase -> compute_n_by_phase) for a
+# python loop over single traces versus one batched call on a (n_traces, n_samples) stack.
+# run from the repository root:  python -m benchmarks.bench_phase_batch
+import time
+
+import numpy as np
+
+from benchmarks.generators import make_traces
+from thzsoftware.tds import phase as ph
+
+N_SAMPLES = 2000
+SAMPLE_RATE = 2e13  # 50 fs steps
+PAD = 500
+DISTANCE = 525e-6
+TRACE_COUNTS = (1, 10, 100, 1000)
+
+
+def run_single(traces, reference, f_limits):
+    out = []
+    for trace in traces:
+        fs, spectrum = ph.fft(trace, SAMPLE_RATE, pad=PAD)
+        _, phase = ph.compute_phase(spectrum)
+        phase = ph.extrapolate_phase(fs, phase, f_limits)
+        out.append(ph.compute_n_by_phase(fs, reference, phase, DISTANCE))
+    return np.stack(out)
+
+
+def run_batched(traces, reference, f_limits):
+    fs, spectra = ph.fft(traces, SAMPLE_RATE, pad=PAD)
+    _, phases = ph.compute_phase(spectra)
+    phases = ph.extrapolate_phase(fs, phases, f_limits)
+    return ph.compute_n_by_phase(fs, reference, phases, DISTANCE)
+
+
+def best_of(func, *args, repeat=3):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    fs, spectrum = ph.fft(make_traces(1, seed=1)[0], SAMPLE_RATE, pad=PAD)
+    f_limits = (fs[len(fs) // 40], fs[len(fs) // 8])
+    reference = ph.extrapolate_phase(fs, ph.compute_phase(spectrum)[1], f_limits)
+
+    print(f"{'traces':>8} {'loop [s]':>10} {'batched [s]':>12} {'loop [tr/s]':>12} {'batched [tr/s]':>15} {'speed-up':>9}")
+    for n_traces in TRACE_COUNTS:
+        traces = make_traces(n_traces)
+        t_single = best_of(run_single, traces, reference, f_limits)
+        t_batched = best_of(run_batched, traces, reference, f_limits)
+        print(f"{n_traces:>8} {t_single:>10.4f} {t_batched:>12.4f} {n_traces / t_single:>12.0f} "
+              f"{n_traces / t_batched:>15.0f} {t_single / t_batched:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+# Load time and peak resident memory of a DataSet read from the CSV tree versus reopened from the binary store.
+# Every measurement runs in a fresh interpreter so the peak RSS of one path does not hide the other.
+# run from the repository root:  python -m benchmarks.bench_storage
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.generators import make_tree
+from thzsoftware.data import DataSet
+
+N_DIRECTORIES = 10
+N_FILES_PER_DIRECTORY = 100
+N_SAMPLES = 2000
+
+
+def touch(data_set, fraction):
+    for dir_key in data_set.data:
+        measurements = list(data_set.data[dir_key])
+        for meas_key in measurements[:max(1, int(fraction * len(measurements)))]:
+            data_set.data[dir_key][meas_key]["time"].iloc[:, 1].sum()
+
+
+# executed in the child interpreter
+def measure(mode, path, fraction):
+    start = time.perf_counter()
+    if mode == "csv":
+        data_set = DataSet(path, "time")
+    else:
+        data_set = DataSet.from_binary(path)
+    t_open = time.perf_counter() - start
+    touch(data_set, fraction)
+    t_total = time.perf_counter() - start
+    print(f"{t_open} {t_total} {peak_rss()}")
+
+
+# peak resident set size in MB. ru_maxrss is inherited from the parent on linux, VmHWM is not.
+def peak_rss():
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_child(mode, path, fraction):
+    output = subprocess.run([sys.executable, "-m", "benchmarks.bench_storage", mode, path, str(fraction)],
+                            check=True, capture_output=True, text=True).stdout
+    return [float(value) for value in output.split()]
+
+
+def main():
+    with tempfile.TemporaryDirectory() as root:
+        csv_path, binary_path = root + "/csv", root + "/binary"
+        make_tree(csv_path, N_DIRECTORIES, N_FILES_PER_DIRECTORY, N_SAMPLES)
+        DataSet(csv_path, "time", lazy=True).save_to_binary(binary_path)
+
+        print(f"{N_DIRECTORIES * N_FILES_PER_DIRECTORY} files of {N_SAMPLES} samples")
+        print(f"{'source':>8} {'touched':>8} {'open [s]':>10} {'total [s]':>10} {'peak RSS [MB]':>14}")
+        for mode, path in (("csv", csv_path), ("binary", binary_path)):
+            for fraction in (.1, 1.):
+                t_open, t_total, max_rss = run_child(mode, path, fraction)
+                print(f"{mode:>8} {fraction:>8.0%} {t_open:>10.3f} {t_total:>10.3f} {max_rss:>14.1f}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4:
+        measure(sys.argv[1], sys.argv[2], float(sys.argv[3]))
+    else:
+        main()
@@ -0,0 +1,63 @@
+# Synthetic inputs for the benchmarks. create_mock_thz_pulse stretches its pulse over the whole base, so realistic
+# traces embed a pulse of fixed width into a longer, noisy trace.
+import os
+
+import numpy as np
+
+from thzsoftware import helper as h
+
+EXAMPLE_DATA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "examples", "example data")
+SAMPLE_RATE = 2e13  # 50 fs steps, as in the example data
+TIME_OFFSET = 1878.  # ps, first sample of the example transmission data
+
+
+# single trace of n_samples with a pulse of pulse_samples centred at 'position' (default: a fifth into the trace).
+# echoes are (delay in samples, relative amplitude) pairs of delayed copies, as in reflection measurements.
+def mock_trace(n_samples=2000, pulse_samples=200, position=None, echoes=(), noise=0., rng=None):
+    assert pulse_samples <= n_samples, ValueError("The pulse must fit into the trace.")
+    pulse, _ = h.create_mock_thz_pulse(pulse_samples)
+    position = n_samples // 5 if position is None else position
+    trace = np.zeros(n_samples)
+    for delay, amplitude in ((0, 1.), *echoes):
+        start = position + delay - pulse_samples // 2
+        lower, upper = max(start, 0), min(start + pulse_samples, n_samples)
+        trace[lower:upper] += amplitude * pulse[lower - start:upper - start]
+    if noise:
+        trace += (np.random.default_rng() if rng is None else rng).normal(0, noise, n_samples)
+    return trace
+
+
+# (n_traces, n_samples) stack of traces whose pulse positions jitter by up to n_samples / 20 samples.
+def make_traces(n_traces, n_samples=2000, pulse_samples=None, echoes=(), noise=.05, seed=0):
+    rng = np.random.default_rng(seed)
+    pulse_samples = n_samples if pulse_samples is None else pulse_samples
+    trace = mock_trace(n_samples, pulse_samples, n_samples // 2 if pulse_samples == n_samples else None, echoes)
+    shifts = rng.integers(-n_samples // 20, n_samples // 20, n_traces)
+    traces = np.stack([np.roll(trace, shift) for shift in shifts])
+    return traces + rng.normal(0, noise, traces.shape)
+
+
+# time axis in ps matching the traces.
+def time_axis(n_samples, sample_rate=SAMPLE_RATE):
+    return TIME_OFFSET + 1e12 / sample_rate * np.arange(n_samples)
+
+
+# write a tree in the instrument's pulse format: header line followed by fixed-width float columns.
+def make_tree(root, n_directories=10, n_files=300, n_samples=500, seed=0):
+    rng = np.random.default_rng(seed)
+    pulse, _ = h.create_mock_thz_pulse(n_samples)
+    ts = time_axis(n_samples)
+    for directory in range(n_directories):
+        dir_path = os.path.join(root, f"day_{directory:03d}")
+        os.makedirs(dir_path)
+        for file in range(n_files):
+            signal = np.roll(pulse, rng.integers(-20, 20)) * .01 + rng.normal(0, 1e-3, (2, n_samples))
+            np.savetxt(os.path.join(dir_path, f"meas_{file:04d}.pulse.csv"), np.column_stack((ts, *signal)),
+                       fmt=("%10.3f", "%12.6f", "%12.6f"), delimiter=",",
+                       header="Time_abs/ps, Signal 1/nA, Signal 2/nA", comments="")
+
+
+# path of the bundled example measurements, kind is "transmission" or "reflection".
+def example_data(kind):
+    assert kind in ("transmission", "reflection"), ValueError("'kind' must be 'transmission' or 'reflection'.")
+    return os.path.join(EXAMPLE_DATA, kind)
@@ -0,0 +1,117 @@
+# Timing, memory and reporting helpers of the benchmark suite. Results are plain dicts so they can be written to
+# JSON and compared between commits.
+import datetime
+import json
+import os
+import platform
+import subprocess
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import scipy
+
+RESULT_FORMAT_VERSION = 1
+
+
+# time func(*args) over 'repeat' rounds of 'number' calls, number chosen so a round takes at least min_time
+# seconds. The peak of memory allocated during one further call is traced separately, as tracing slows the calls.
+def measure(func, *args, repeat=5, min_time=.05, trace_memory=True):
+    number, elapsed = 1, 0.
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            func(*args)
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time or number >= 2 ** 20:
+            break
+        number = max(2 * number, int(1.2 * number * min_time / max(elapsed, 1e-9)))
+
+    timings = [elapsed / number]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            func(*args)
+        timings.append((time.perf_counter() - start) / number)
+
+    result = {"best": min(timings), "median": float(np.median(timings)), "mean": float(np.mean(timings)),
+              "stdev": float(np.std(timings)), "number": number, "repeat": repeat}
+    if trace_memory:
+        result["peak_bytes"] = peak_memory(func, *args)
+    return result
+
+
+# peak of memory allocated (python objects and numpy buffers) during func(*args), in bytes. Before Python 3.9 only
+# peaks above the earlier peak of a running trace are seen.
+def peak_memory(func, *args):
+    was_tracing = tracemalloc.is_tracing()
+    if not was_tracing:
+        tracemalloc.start()
+    reset_peak = hasattr(tracemalloc, "reset_peak")  # Python 3.9+
+    if reset_peak:
+        tracemalloc.reset_peak()
+    baseline, baseline_peak = tracemalloc.get_traced_memory()
+    try:
+        func(*args)
+        current, peak = tracemalloc.get_traced_memory()
+        # without reset_peak an earlier, higher peak hides the one of func, then its memory at the end is the bound
+        return (peak if reset_peak or peak > baseline_peak else max(current, baseline)) - baseline
+    finally:
+        if not was_tracing:
+            tracemalloc.stop()
+
+
+# machine and code version the results were taken on.
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {"commit": commit, "date": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count(),
+            "numpy": np.__version__, "scipy": scipy.__version__, "pandas": pd.__version__}
+
+
+def save_results(results, path):
+    with open(path, "w") as result_file:
+        json.dump({"version": RESULT_FORMAT_VERSION, "environment": environment(), "results": results},
+                  result_file, indent=1)
+
+
+def load_results(path):
+    with open(path) as result_file:
+        report = json.load(result_file)
+    assert report["version"] == RESULT_FORMAT_VERSION, ValueError(f"Unsupported result version {report['version']}.")
+    return report["results"]
+
+
+# one line per case: best time, throughput and memory peak, and the ratio to a baseline run if given. Cases more
+# than 'threshold' slower than the baseline are flagged.
+def format_results(results, baseline=None, threshold=.1):
+    lines = [f"{'case':<42} {'best':>11} {'items/s':>11} {'peak':>10}" + (f" {'vs base':>9}" if baseline else "")]
+    for name, result in results.items():
+        line = (f"{name:<42} {_format_time(result['best']):>11} "
+                f"{result.get('items', 1) / result['best']:>11.4g} {_format_bytes(result.get('peak_bytes')):>10}")
+        if baseline and name in baseline:
+            ratio = result["best"] / baseline[name]["best"]
+            line += f" {ratio:>8.2f}x" + (" SLOWER" if ratio > 1 + threshold else "")
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def _format_time(seconds):
+    for unit, scale in (("s", 1), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:.3f} {unit}"
+    return f"{seconds * 1e9:.1f} ns"
+
+
+def _format_bytes(n_bytes):
+    if n_bytes is None:
+        return "-"
+    for unit, scale in (("GB", 2 ** 30), ("MB", 2 ** 20), ("kB", 2 ** 10)):
+        if n_bytes >= scale:
+            return f"{n_bytes / scale:.1f} {unit}"
+    return f"{n_bytes} B"
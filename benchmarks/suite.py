@@ -0,0 +1,238 @@
+# The benchmark suite: per-function timings of the math, pulse, phase and data hot paths and end-to-end runs of the
+# transmission (load -> window -> fft -> phase -> n) and reflection (load -> pulse limits -> echoes) workflows, on
+# synthetic traces and on the bundled example data.
+# Each case is a setup(size, workdir) returning (func, args, items), where items is what one call processes
+# (traces, files, ...) and 'size' is 1 for the full suite and smaller for --quick.
+import argparse
+import fnmatch
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+from benchmarks import generators as gen
+from benchmarks import harness
+from thzsoftware import data
+from thzsoftware import math as mt
+from thzsoftware.tds import phase as ph
+from thzsoftware.tds import pulse as pl
+
+N_SAMPLES = 2000
+PAD = 500
+DISTANCE = 525e-6  # m, the Si wafer of the example data
+F_LIMITS = (.5e12, 3e12)  # Hz, fit range of the phase extrapolation
+
+
+def _n_traces(size):
+    return max(1, int(1000 * size))
+
+
+def _spectra(size):
+    return ph.fft(gen.make_traces(_n_traces(size), N_SAMPLES), gen.SAMPLE_RATE, pad=PAD)
+
+
+def unwrap_angles(size, workdir):
+    rng = np.random.default_rng(0)
+    angles = np.angle(np.exp(1j * np.cumsum(rng.normal(0, 1, (_n_traces(size), N_SAMPLES)), axis=-1)))
+    return mt.unwrap_angles, (angles,), len(angles)
+
+
+def cross_correlate(size, workdir):
+    traces = gen.make_traces(_n_traces(size), N_SAMPLES)
+    return mt.cross_correlate, (traces, traces[0]), len(traces)
+
+
+def convolve(size, workdir):
+    traces = gen.make_traces(_n_traces(size), N_SAMPLES)
+    return pl.convolve, (traces, traces[0]), len(traces)
+
+
+def define_thz_pulses(size, workdir):
+    trace = gen.mock_trace(N_SAMPLES, 200, noise=.05, rng=np.random.default_rng(0))
+    return pl.define_thz_pulses, (trace,), 1
+
+
+def define_thz_pulses_batch(size, workdir):
+    traces = gen.make_traces(_n_traces(size), N_SAMPLES, pulse_samples=200)
+    return pl.define_thz_pulses_batch, (traces,), len(traces)
+
+
+def find_delayed_pulse(size, workdir):
+    trace = gen.mock_trace(2 * N_SAMPLES, 200, echoes=((600, -.4), (1200, .15)), noise=.02,
+                           rng=np.random.default_rng(0))
+    reference = gen.mock_trace(2 * N_SAMPLES, 200)
+    return pl.find_delayed_pulse, (reference, trace, 200, 3), 1
+
+
+def find_delayed_pulse_batch(size, workdir):
+    rng = np.random.default_rng(0)
+    traces = np.stack([gen.mock_trace(N_SAMPLES, 200, echoes=((delay, -.4), (2 * delay, .15)), noise=.02, rng=rng)
+                       for delay in rng.integers(300, 600, _n_traces(size))])
+    reference = gen.mock_trace(N_SAMPLES, 200)
+    return pl.find_delayed_pulse, (reference, traces, 200, 3), len(traces)
+
+
+def window(size, workdir):
+    traces = gen.make_traces(_n_traces(size), N_SAMPLES)
+    rng = np.random.default_rng(0)
+    starts = rng.integers(200, 400, len(traces))
+    limits = np.column_stack((starts, starts + rng.integers(900, 1100, len(traces))))
+    return pl.window, (traces, limits), len(traces)
+
+
+def fft(size, workdir):
+    traces = gen.make_traces(_n_traces(size), N_SAMPLES)
+    return (lambda: ph.fft(traces, gen.SAMPLE_RATE, pad=PAD)), (), len(traces)
+
+
+def compute_phase(size, workdir):
+    _, spectra = _spectra(size)
+    return ph.compute_phase, (spectra,), len(spectra)
+
+
+def extrapolate_phase(size, workdir):
+    fs, spectra = _spectra(size)
+    phases = ph.compute_phase(spectra)[1]
+    return ph.extrapolate_phase, (fs, phases, F_LIMITS), len(phases)
+
+
+def compute_n_by_phase(size, workdir):
+    fs, spectra = _spectra(size)
+    phases = ph.extrapolate_phase(fs, ph.compute_phase(spectra)[1], F_LIMITS)
+    return ph.compute_n_by_phase, (fs, phases[0], phases, DISTANCE), len(phases)
+
+
+def _synthetic_tree(size, workdir):
+    root = os.path.join(workdir, f"tree_{size}")
+    n_files = max(1, int(100 * size))
+    if not os.path.exists(root):
+        gen.make_tree(root, n_directories=10, n_files=n_files, n_samples=N_SAMPLES)
+    return root, 10 * n_files
+
+
+def load(size, workdir):
+    root, n_files = _synthetic_tree(size, workdir)
+    return data._load, (root, "time"), n_files
+
+
+def load_pulse_format(size, workdir):
+    root, n_files = _synthetic_tree(size, workdir)
+    return (lambda: data._load(root, "time", file_format="pulse")), (), n_files
+
+
+def load_lazy(size, workdir):
+    root, n_files = _synthetic_tree(size, workdir)
+    return (lambda: data.DataSet(root, "time", lazy=True)), (), n_files
+
+
+# the transmission notebook without plots: window both traces around their pulse, transform, unwrap and
+# extrapolate the phase and compute the refractive index of the sample.
+def transmission_example(size, workdir):
+    def run():
+        data_set = data.DataSet(gen.example_data("transmission"), "time", file_format="pulse")
+        directory = next(iter(data_set.data))
+        phases = []
+        for file_key in ("air.pulse", "Si.pulse"):
+            time_axis, signal = data_set.measurement(directory, file_key, "time").values[:2]
+            windowed = pl.window(signal, pl.define_thz_pulses(signal), window_func="tukey")
+            fs, spectrum = ph.fft(windowed, 1e12 / (time_axis[1] - time_axis[0]), pad=PAD)
+            phases.append(ph.extrapolate_phase(fs, ph.compute_phase(spectrum)[1], F_LIMITS))
+        return ph.compute_n_by_phase(fs, phases[0], phases[1], DISTANCE)
+    return run, (), 2
+
+
+# the reflection notebook: pulse limits of the bare reference and the echoes of the coated sample.
+def reflection_example(size, workdir):
+    def run():
+        data_set = data.DataSet(gen.example_data("reflection"), "time", file_format="pulse")
+        directory = next(iter(data_set.data))
+        bare = data_set.measurement(directory, "brushed_steel_bare.pulse", "time").values[1]
+        sample = data_set.measurement(directory, "brushed_steel_Si525um.pulse", "time").values[1]
+        limits = pl.define_thz_pulses(bare)
+        return pl.find_delayed_pulse(bare, sample, limits[1] - limits[0], number_of_pulses=2)
+    return run, (), 2
+
+
+# the transmission workflow on a stack of synthetic traces, each windowed around its own pulse.
+def transmission_batch(size, workdir):
+    traces = gen.make_traces(_n_traces(size), N_SAMPLES, pulse_samples=200)
+
+    def run():
+        left_limits, right_limits, _ = pl.define_thz_pulses_batch(traces)
+        windowed = pl.window(traces, np.column_stack((left_limits, right_limits)))
+        fs, spectra = ph.fft(windowed, gen.SAMPLE_RATE, pad=PAD)
+        phases = ph.extrapolate_phase(fs, ph.compute_phase(spectra)[1], F_LIMITS)
+        return ph.compute_n_by_phase(fs, phases[0], phases[1:], DISTANCE)
+    return run, (), len(traces)
+
+
+CASES = {
+    "math.unwrap_angles": unwrap_angles,
+    "math.cross_correlate": cross_correlate,
+    "pulse.convolve": convolve,
+    "pulse.define_thz_pulses": define_thz_pulses,
+    "pulse.define_thz_pulses_batch": define_thz_pulses_batch,
+    "pulse.find_delayed_pulse": find_delayed_pulse,
+    "pulse.find_delayed_pulse_batch": find_delayed_pulse_batch,
+    "pulse.window": window,
+    "phase.fft": fft,
+    "phase.compute_phase": compute_phase,
+    "phase.extrapolate_phase": extrapolate_phase,
+    "phase.compute_n_by_phase": compute_n_by_phase,
+    "data.load": load,
+    "data.load_pulse_format": load_pulse_format,
+    "data.load_lazy": load_lazy,
+    "pipeline.transmission_example": transmission_example,
+    "pipeline.reflection_example": reflection_example,
+    "pipeline.transmission_batch": transmission_batch,
+}
+
+
+# run the cases matching any of the glob 'patterns' (all if None) and return {case: result}, see harness.measure.
+def run(patterns=None, quick=False, repeat=5, echo=print):
+    size = .1 if quick else 1.
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        for name, setup in CASES.items():
+            if patterns and not any(fnmatch.fnmatch(name, pattern) for pattern in patterns):
+                continue
+            func, args, items = setup(size, workdir)
+            result = harness.measure(func, *args, repeat=3 if quick else repeat, min_time=.01 if quick else .05)
+            result["items"] = items
+            results[name] = result
+            if echo is not None:
+                echo(harness.format_results({name: result}).splitlines()[1])
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="Run the thzsoftware benchmarks.")
+    parser.add_argument("--quick", action="store_true", help="smaller inputs and fewer repeats, for a smoke test")
+    parser.add_argument("--repeat", type=int, default=5, help="timing rounds per case")
+    parser.add_argument("--select", action="append", metavar="PATTERN",
+                        help="only run cases matching the glob pattern, e.g. 'phase.*' (repeatable)")
+    parser.add_argument("--output", metavar="JSON", help="write the results to this file")
+    parser.add_argument("--compare", metavar="JSON", help="compare against results written earlier")
+    parser.add_argument("--threshold", type=float, default=.1,
+                        help="relative slow-down flagged in the comparison (default .1)")
+    parser.add_argument("--list", action="store_true", help="list the cases and exit")
+    args = parser.parse_args(argv)
+
+    if args.list:
+        print("\n".join(CASES))
+        return 0
+    print(harness.format_results({}).splitlines()[0])
+    results = run(args.select, args.quick, args.repeat)
+    if args.output:
+        harness.save_results(results, args.output)
+    if args.compare:
+        baseline = harness.load_results(args.compare)
+        report = harness.format_results(results, baseline, args.threshold)
+        print("\n" + report)
+        return 1 if "SLOWER" in report else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,7 +1,10 @@
+import json
 import os
 import shutil
+import warnings
+import numpy as np
 import pandas as pd
-from thzsoftware.data import DataSet
+from thzsoftware.data import DataSet, Measurement, read_pulse_csv
 
 
 def test_dataset_obj_init():
@@ -65,3 +68,245 @@ def test_dataset_obj_save_to_csv():
         assert content in contents_output, AssertionError("Contents not present.")
 
     shutil.rmtree(output_path)  # remove temporary save
+
+
+def test_dataset_obj_lazy():
+    data_path = "./tests/test_dummy_data/dataDir/"
+    data_type = "dummy_type"
+    eager_set = DataSet(data_path, data_type)
+    test_set = DataSet(data_path, data_type, lazy=True, cache_bytes=0)
+
+    dir_key = "measurements_6th_september"
+    measurement_key = "dummy_file"
+    assert test_set.get_keys() == eager_set.get_keys(), ValueError("Lazy keys differ from eager keys.")
+    assert test_set.cache.misses == 0, ValueError("Files parsed before access.")
+
+    frame = test_set.data[dir_key][measurement_key][data_type]
+    pd.testing.assert_frame_equal(frame, eager_set.data[dir_key][measurement_key][data_type])
+    test_set.data[dir_key][measurement_key][data_type]
+    assert test_set.cache.misses == 1 and test_set.cache.hits == 1, ValueError("Parsed frame not cached.")
+
+    # evicted files are re-parsed on access, while added entries are held by the data set itself
+    test_set.add_entry("added_dir", "added_meas", "added_type", (("col1", [1, 2, 3]),))
+    test_set.cache.clear()
+    pd.testing.assert_frame_equal(test_set.data[dir_key][measurement_key][data_type], frame)
+    assert test_set.cache.misses == 2, ValueError("Evicted frame not reloaded.")
+    assert isinstance(test_set.data["added_dir"]["added_meas"]["added_type"], pd.core.frame.DataFrame), \
+        TypeError("Added entry lost.")
+
+
+def test_dataset_obj_parallel_load(tmp_path):
+    rng = np.random.default_rng(0)
+    for day in range(3):
+        os.makedirs(tmp_path / f"day_{day}")
+        for meas in range(5):
+            frame = pd.DataFrame({"Time_abs/ps": np.arange(20) * .05, " Signal 1/nA": rng.normal(size=20)})
+            frame.to_csv(tmp_path / f"day_{day}" / f"meas_{meas}.pulse.csv", index=False)
+    (tmp_path / "day_1" / "broken.pulse.csv").write_text("")  # empty files cannot be parsed
+
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always")
+        serial_set = DataSet(str(tmp_path), "time")
+    assert len(caught) == 1 and len(serial_set.load_errors) == 1, ValueError("Broken file not reported.")
+    assert "broken.pulse" not in serial_set.data["day_1"], ValueError("Broken file not skipped.")
+
+    for processes in (False, True):
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            parallel_set = DataSet(str(tmp_path), "time", workers=2, processes=processes)
+        assert parallel_set.get_keys() == serial_set.get_keys(), ValueError("Parallel load has different keys.")
+        assert [path for path, _ in parallel_set.load_errors] == [path for path, _ in serial_set.load_errors], \
+            ValueError("Parallel load reports different errors.")
+        for dir_key in serial_set.data:
+            for meas_key in serial_set.data[dir_key]:
+                pd.testing.assert_frame_equal(parallel_set.data[dir_key][meas_key]["time"],
+                                              serial_set.data[dir_key][meas_key]["time"])
+
+
+def test_dataset_obj_binary_roundtrip(tmp_path):
+    data_path = "./tests/test_dummy_data/dataDir/"
+    data_type = "dummy_type"
+    test_set = DataSet(data_path, data_type)
+    test_set.add_entry("added_dir", "added_meas", "added_type", (("col1", [1, 2, 3]), ("col2", ["a", "b", "c"])))
+    output_path = str(tmp_path / "binary")
+    test_set.save_to_binary(output_path)
+
+    reopened = DataSet.from_binary(output_path)
+    assert reopened.get_keys() == test_set.get_keys(), ValueError("Keys not restored.")
+    assert reopened.cache.misses == 0, ValueError("Entries read before access.")
+    for dir_key in test_set.data:
+        for meas_key in test_set.data[dir_key]:
+            for type_key in test_set.data[dir_key][meas_key]:
+                pd.testing.assert_frame_equal(reopened.data[dir_key][meas_key][type_key],
+                                              test_set.data[dir_key][meas_key][type_key], check_exact=True)
+
+    # reopened sets write back to the csv layout like any other
+    reopened.save_to_csv(str(tmp_path / "csv"))
+    assert sorted(os.listdir(tmp_path / "csv")) == sorted(test_set.data), ValueError("Contents not present.")
+
+
+def test_dataset_obj_from_binary_version_1(tmp_path):
+    # a store as written by the first binary format: one .npy file per column and no data set settings
+    entry_path = tmp_path / "binary" / "day" / "meas" / "time"
+    os.makedirs(entry_path)
+    np.save(entry_path / "0.npy", np.arange(3.))
+    np.save(entry_path / "1.npy", np.array([1, 2, 3]))
+    manifest = {"version": 1, "data_path": "./data", "entries": [
+        {"dir": "day", "measurement": "meas", "type": "time", "columns": ["t", "y"],
+         "index": {"name": None, "range": [0, 3, 1]}}]}
+    with open(tmp_path / "binary" / "manifest.json", "w") as manifest_file:
+        json.dump(manifest, manifest_file)
+
+    reopened = DataSet.from_binary(str(tmp_path / "binary"))
+    pd.testing.assert_frame_equal(reopened.data["day"]["meas"]["time"],
+                                  pd.DataFrame({"t": np.arange(3.), "y": np.array([1, 2, 3])}))
+    assert reopened.data_type is None and reopened.file_index == {}, ValueError("Wrong defaults for version 1.")
+
+
+def test_read_pulse_csv(tmp_path):
+    ts = 1878. + .05 * np.arange(200)
+    signal = np.sin(ts)
+    pulse_path = tmp_path / "day" / "meas.pulse.csv"
+    os.makedirs(tmp_path / "day")
+    np.savetxt(pulse_path, np.column_stack((ts, signal, -signal)), fmt=("%10.3f", "%12.6f", "%12.6f"),
+               delimiter=",", header="Time_abs/ps, Signal 1/nA, Signal 2/nA", comments="")
+
+    names, columns, time_step, sample_rate = read_pulse_csv(str(pulse_path), dtype=np.float32)
+    assert names == ["Time_abs/ps", " Signal 1/nA", " Signal 2/nA"], ValueError(f"Wrong column names {names}.")
+    assert columns.shape == (3, 200) and columns.dtype == np.float32 and columns.flags["C_CONTIGUOUS"], \
+        ValueError("Columns not returned as contiguous float32 block.")
+    assert abs(time_step - 5e-14) < 1e-20 and abs(sample_rate - 2e13) < 1, ValueError("Time step not in seconds.")
+
+    fast_set = DataSet(str(tmp_path), "time", file_format="pulse")
+    pandas_set = DataSet(str(tmp_path), "time")
+    pd.testing.assert_frame_equal(fast_set.data["day"]["meas.pulse"]["time"],
+                                  pandas_set.data["day"]["meas.pulse"]["time"], check_exact=True)
+
+    # files which do not validate as pulse files are left to pandas
+    pd.DataFrame({"name": ["a", "b"], "value": [1, 2]}).to_csv(tmp_path / "day" / "other.csv", index=False)
+    try:
+        read_pulse_csv(str(tmp_path / "day" / "other.csv"))
+        raise AssertionError("Non numeric file accepted as pulse file.")
+    except ValueError:
+        pass
+    fast_set = DataSet(str(tmp_path), "time", file_format="pulse", lazy=True)
+    assert list(fast_set.data["day"]["other"]["time"]["name"]) == ["a", "b"], ValueError("No fallback to pandas.")
+
+
+def test_dataset_obj_refresh(tmp_path):
+    data_path = tmp_path / "data"
+    os.makedirs(data_path / "day_0")
+    for meas in range(3):
+        pd.DataFrame({"t": np.arange(5), "y": np.full(5, meas)}).to_csv(data_path / "day_0" / f"m{meas}.csv",
+                                                                         index=False)
+
+    for lazy in (False, True):
+        index_path = str(tmp_path / f"index_{lazy}.json")
+        test_set = DataSet(str(data_path), "time", lazy=lazy, index_path=index_path)
+        test_set.add_entry("day_0", "m2", "spectrum", (("f", [1., 2.]),))
+        assert test_set.refresh() == {"added": [], "modified": [], "removed": [], "failed": []}, \
+            ValueError("Unchanged directory reported changes.")
+
+        stat = os.stat(data_path / "day_0" / "m0.csv")
+        os.utime(data_path / "day_0" / "m0.csv", ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))  # touch only
+        pd.DataFrame({"t": np.arange(5), "y": np.full(5, 10)}).to_csv(data_path / "day_0" / "m1.csv", index=False)
+        os.remove(data_path / "day_0" / "m2.csv")
+        os.makedirs(data_path / "day_1")
+        pd.DataFrame({"t": np.arange(5), "y": np.ones(5)}).to_csv(data_path / "day_1" / "m3.csv", index=False)
+
+        # lazy sets have not hashed m0 yet, so the touch cannot be told apart from a change
+        report = test_set.refresh()
+        modified = [("day_0", "m1"), ("day_0", "m0")] if lazy else [("day_0", "m1")]
+        assert report == {"added": [("day_1", "m3")], "modified": modified,
+                          "removed": [("day_0", "m2")], "failed": []}, ValueError(f"Wrong changes {report}.")
+        assert list(test_set.data["day_0"]["m1"]["time"]["y"]) == [10] * 5, ValueError("Modified file not reloaded.")
+        assert list(test_set.data["day_0"]["m2"]) == ["spectrum"], ValueError("Added entry not left alone.")
+        assert "m3" in test_set.keys["day_1"], ValueError("Keys not updated.")
+
+        reopened = DataSet(str(data_path), "time", index_path=index_path)
+        assert all(record["hash"] is not None for record in reopened.file_index.values()), \
+            ValueError("Hashes not restored from persisted index.")
+
+        # restore the original tree for the next mode
+        shutil.rmtree(data_path / "day_1")
+        for meas in range(3):
+            pd.DataFrame({"t": np.arange(5), "y": np.full(5, meas)}).to_csv(data_path / "day_0" / f"m{meas}.csv",
+                                                                             index=False)
+
+
+def test_dataset_obj_save_to_csv_incremental(tmp_path):
+    data_path = "./tests/test_dummy_data/dataDir/"
+    data_type = "dummy_type"
+    output_path = str(tmp_path / "saved")
+    dir_key, meas_key = "measurements_6th_september", "dummy_file"
+    file_path = "/".join((output_path, dir_key, meas_key, meas_key + "_" + data_type + ".csv"))
+
+    test_set = DataSet(data_path, data_type)
+    report = test_set.save_to_csv(output_path, workers=2)
+    assert report["written"] == [file_path], ValueError(f"Wrong files written {report}.")
+    assert test_set.save_to_csv(output_path)["unchanged"] == [file_path], ValueError("Unchanged entry rewritten.")
+
+    # in-place edits and added entries are written, the rest is left alone
+    test_set.data[dir_key][meas_key][data_type].iloc[0, 0] = -1
+    test_set.add_entry(dir_key, meas_key, "added_type", (("col1", [1, 2, 3]),))
+    report = test_set.save_to_csv(output_path)
+    assert len(report["written"]) == 2 and not report["unchanged"], ValueError(f"Edits not written {report}.")
+    assert pd.read_csv(file_path).iloc[0, 1] == -1, ValueError("Edited value not saved.")
+
+    # files written by someone else are subject to the overwrite policy
+    other_set = DataSet(data_path, data_type)
+    try:
+        other_set.save_to_csv(output_path)
+        raise AssertionError("Existing file overwritten without permission.")
+    except FileExistsError:
+        pass
+    assert other_set.save_to_csv(output_path, overwrite="skip")["skipped"] == [file_path]
+    assert other_set.save_to_csv(output_path, overwrite="overwrite")["written"] == [file_path]
+    assert pd.read_csv(file_path).iloc[0, 1] != -1, ValueError("File not overwritten.")
+
+    report = other_set.save_to_csv(output_path, compression="gzip")
+    pd.testing.assert_frame_equal(pd.read_csv(report["written"][0], index_col=0),
+                                  other_set.data[dir_key][meas_key][data_type])
+    assert not [file for file in os.listdir(os.path.dirname(file_path)) if file.endswith(".tmp")], \
+        ValueError("Temporary files left behind.")
+
+
+def test_measurement():
+    values = np.arange(12.).reshape(3, 4)
+    measurement = Measurement(["t", "a", "b"], values)
+    assert measurement.values.flags.c_contiguous and np.shares_memory(measurement.column("a"), measurement.values), \
+        ValueError("Columns not held as one contiguous array.")
+    np.testing.assert_array_equal(measurement.column(2), values[2])
+    fingerprint = measurement.fingerprint()
+
+    frame = measurement.frame()
+    assert np.shares_memory(frame.to_numpy(), measurement.values), ValueError("Frame is not a view.")
+    assert measurement.fingerprint() == fingerprint, ValueError("Building the frame changed the fingerprint.")
+    frame["c"] = 1.
+    assert measurement.frame() is frame and measurement.columns == ("t", "a", "b", "c"), \
+        ValueError("Edits of the frame lost.")
+    assert measurement.fingerprint() != fingerprint, ValueError("Edit not detected.")
+
+    mixed = Measurement.from_frame(pd.DataFrame({"a": [1, 2], "b": ["x", "y"]}))
+    assert list(mixed.frame().dtypes) == [np.int64, object], ValueError("Mixed dtypes not preserved.")
+
+
+def test_dataset_obj_entries():
+    test_set = DataSet("./tests/test_dummy_data/dataDir/", "dummy_type")
+    test_set.add_entry("measurements_6th_september", "dummy_file", "spectrum", (("f", [1., 2.]), ("a", [3., 4.])))
+    assert test_set.get_keys()["measurements_6th_september"]["dummy_file"] == ["dummy_type", "spectrum"], \
+        ValueError("Type level of the keys collapsed.")
+    keys = test_set.keys
+    keys.pop("measurements_6th_september")
+    keys = test_set.get_keys()
+    keys["measurements_6th_september"]["dummy_file"].append("other")
+    assert test_set.get_keys()["measurements_6th_september"]["dummy_file"] == ["dummy_type", "spectrum"], \
+        ValueError("Changes to returned keys reached the data set.")
+    spectra = test_set.entries[test_set.entries["type"] == "spectrum"]
+    assert len(spectra) == 1 and spectra[0]["measurement"] == "dummy_file", ValueError("Wrong structured index.")
+
+    (key, measurement), = test_set.measurements(type_key="spectrum")
+    assert key == ("measurements_6th_september", "dummy_file", "spectrum"), ValueError("Wrong key selected.")
+    np.testing.assert_array_equal(measurement.values, [[1., 2.], [3., 4.]])
+    del test_set.data["measurements_6th_september"]["dummy_file"]["spectrum"]
+    assert len(test_set.entries) == 1, ValueError("Index not updated after removal.")
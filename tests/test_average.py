@@ -0,0 +1,78 @@
+import numpy as np
+import pandas as pd
+from thzsoftware import helper as h
+from thzsoftware.tds import average as av
+from thzsoftware.tds import phase as ph
+
+SAMPLE_RATE = 2e13
+
+
+def _scans(n_scans, shifts=None, seed=0):
+    rng = np.random.default_rng(seed)
+    pulse = np.pad(h.create_mock_thz_pulse(200)[0], (200, 600))
+    scans = pulse + .05 * rng.normal(size=(n_scans, len(pulse)))
+    if shifts is not None:
+        scans = np.stack([np.roll(scan, shift) for scan, shift in zip(scans, shifts)])
+    return scans
+
+
+def test_scan_averager():
+    scans = _scans(25)
+    single = av.ScanAverager(SAMPLE_RATE, pad=100)
+    for scan in scans:
+        single.add(scan)
+    chunked = av.ScanAverager(SAMPLE_RATE, pad=100).add(scans[:7]).add(scans[7:20]).add(scans[20:])
+
+    _, spectra = ph.fft(scans, SAMPLE_RATE, pad=100)
+    for averager in (single, chunked):
+        assert averager.count == 25, ValueError("Scans not counted.")
+        assert np.allclose(averager.mean, scans.mean(axis=0)) and \
+            np.allclose(averager.variance, scans.var(axis=0, ddof=1)), ValueError("Wrong trace statistics.")
+        assert np.allclose(averager.spectrum_mean, spectra.mean(axis=0)) and \
+            np.allclose(averager.spectrum_variance, np.var(spectra, axis=0, ddof=1)), \
+            ValueError("Wrong spectrum statistics.")
+
+    fs, spectrum = ph.fft(single.mean, SAMPLE_RATE, pad=100)
+    assert np.array_equal(fs, single.frequencies) and np.allclose(spectrum, single.spectrum_mean), \
+        ValueError("Mean spectrum differs from the spectrum of the mean trace.")
+    assert np.isnan(av.ScanAverager().add(scans[0]).variance).all(), ValueError("Variance of one scan not nan.")
+
+
+def test_scan_averager_align():
+    shifts = [0, 3, -5, 12, -1, 7]
+    scans = _scans(len(shifts), shifts)
+    averager = av.ScanAverager(SAMPLE_RATE, align=True).add(scans[:2]).add(scans[2:])
+    assert list(averager.shifts) == shifts, ValueError(f"Drift not found. shifts = {averager.shifts}")
+    assert np.isclose(averager.shift_mean, np.mean(shifts)) and np.isclose(averager.shift_std, np.std(shifts, ddof=1)) \
+        and (averager.shift_min, averager.shift_max) == (-5, 12), ValueError("Wrong running shift statistics.")
+    recent = av.ScanAverager(align=True, shift_history=3).add(scans[:2]).add(scans[2:])
+    assert list(recent.shifts) == shifts[-3:] and np.isclose(recent.shift_mean, np.mean(shifts)), \
+        ValueError("Shift history not bounded.")
+    unaligned = av.ScanAverager(SAMPLE_RATE).add(scans)
+    assert np.max(np.abs(averager.mean)) > np.max(np.abs(unaligned.mean)), \
+        ValueError("Aligned average not sharper than the unaligned one.")
+
+    limited = av.ScanAverager(align=True, max_shift=4).add(scans)
+    assert np.all(np.abs(limited.shifts) <= 4), ValueError("'max_shift' exceeded.")
+
+    late = av.ScanAverager().add(scans[:2])
+    late.sample_rate = SAMPLE_RATE
+    try:
+        late.add(scans[2:])
+        raise AssertionError("Spectra started after the first scans.")
+    except AssertionError as error:
+        assert isinstance(error.args[0], ValueError), error
+
+
+def test_average_files(tmp_path):
+    scans = _scans(5)
+    paths = []
+    for i, scan in enumerate(scans):
+        path = str(tmp_path / f"scan_{i}.pulse.csv")
+        pd.DataFrame({"Time_abs/ps": np.arange(scan.size) * .05, " Signal 1/nA": scan}).to_csv(path, index=False)
+        paths.append(path)
+
+    averager = av.average_files(paths, chunk_size=2)
+    assert averager.count == 5 and np.isclose(averager.sample_rate, SAMPLE_RATE), ValueError("Files not read.")
+    assert np.allclose(averager.mean, scans.mean(axis=0)) and \
+        np.allclose(averager.std, scans.std(axis=0, ddof=1)), ValueError("Wrong statistics of the files.")
@@ -0,0 +1,69 @@
+import os
+import shutil
+import pandas as pd
+from click.testing import CliRunner
+from thzsoftware import cli
+
+EXAMPLE_DATA = "./examples/example data/"
+
+
+def _copy_example(tmp_path, kind):
+    data_path = str(tmp_path / kind)
+    shutil.copytree(EXAMPLE_DATA + kind, data_path)
+    return data_path
+
+
+def test_pair_files():
+    file_tree = {"day_1": {"air_1": "a1", "air_2": "a2", "air_1_sample": "s1", "air_2_sample": "s2"},
+                 "day_2": {"sample": "s3"}}
+    pairs, unpaired = cli.pair_files(file_tree, "air_?", "*")
+
+    assert [(pair[1], pair[2]) for pair in pairs] == [("air_1_sample", "a1"), ("air_2_sample", "a2")], \
+        ValueError("Samples paired with the wrong reference.")
+    assert unpaired == ["day_2"], ValueError("Directory without reference not reported.")
+
+
+def test_transmission(tmp_path):
+    data_path = _copy_example(tmp_path, "transmission")
+    output = str(tmp_path / "out")
+    runner = CliRunner()
+    result = runner.invoke(cli.main, ["transmission", data_path, "--thickness", "525e-6", "--output", output,
+                                      "--workers", "1"])
+    assert result.exit_code == 0, ValueError(result.output)
+    assert "1 pair(s) processed" in result.output, ValueError("Pair not processed.")
+
+    result_path = os.path.join(output, "data_26Jul2022", "Si.pulse_n.csv")
+    frame = pd.read_csv(result_path, index_col=0)
+    assert list(frame.columns[:2]) == ["frequencies [Hz]", "n"], ValueError("Unexpected result columns.")
+    assert (frame["n"].iloc[1:] >= 1).all(), ValueError("n below the reference.")
+
+    mtime = os.stat(result_path).st_mtime_ns
+    result = runner.invoke(cli.main, ["transmission", data_path, "--thickness", "525e-6", "--output", output,
+                                      "--resume"])
+    assert result.exit_code == 0 and "0 pair(s) processed, 1 skipped" in result.output, \
+        ValueError("Processed pair not skipped on resume.")
+    assert os.stat(result_path).st_mtime_ns == mtime, ValueError("Result rewritten on resume.")
+
+
+def test_reflection(tmp_path):
+    data_path = _copy_example(tmp_path, "reflection")
+    runner = CliRunner()
+    outputs = []
+    for workers in ("1", "2"):
+        output = str(tmp_path / f"out_{workers}")
+        result = runner.invoke(cli.main, ["reflection", data_path, "--thickness", "525e-6", "--output", output,
+                                          "--workers", workers])
+        assert result.exit_code == 0, ValueError(result.output)
+        outputs.append(pd.read_csv(os.path.join(output, "data 03Jun22", "brushed_steel_Si525um.pulse_n.csv")))
+    pd.testing.assert_frame_equal(outputs[0], outputs[1])
+
+
+def test_failed_pair(tmp_path):
+    data_path = _copy_example(tmp_path, "transmission")
+    with open(os.path.join(data_path, "data_26Jul2022", "broken.csv"), "w") as broken_file:
+        broken_file.write("not a pulse\n")
+    result = CliRunner().invoke(cli.main, ["transmission", data_path, "--thickness", "525e-6", "--output",
+                                           str(tmp_path / "out"), "--workers", "1"])
+    assert result.exit_code == 1, ValueError("Failure not reported in the exit code.")
+    assert "1 pair(s) processed" in result.output and "failed: data_26Jul2022/broken" in result.output, \
+        ValueError("Failed pair not reported.")
@@ -0,0 +1,37 @@
+import numpy as np
+import scipy.fft as ft
+from thzsoftware import helper as h
+from thzsoftware.tds import deconvolution as dc
+
+SAMPLE_RATE = 2e13
+BAND = (1e11, 4e12)
+
+
+def _delayed(trace, delay):  # delay in samples, fractions by a phase ramp
+    fs = ft.rfftfreq(len(trace))
+    return ft.irfft(ft.rfft(trace) * np.exp(-2j * np.pi * fs * delay), len(trace))
+
+
+def test_filter_kernel():
+    kernel = dc.filter_kernel(1000, SAMPLE_RATE, BAND)
+    fs = ft.rfftfreq(1000, 1 / SAMPLE_RATE)
+    assert kernel is dc.filter_kernel(1000, SAMPLE_RATE, list(BAND)) and not kernel.flags.writeable, \
+        ValueError("Kernel not cached.")
+    assert np.all(kernel[(fs >= BAND[0]) & (fs <= BAND[1])] == 1) and np.all(kernel[fs > 5e12] == 0) and \
+        np.all((kernel >= 0) & (kernel <= 1)), ValueError("Wrong band pass.")
+
+
+def test_deconvolve():
+    reference = np.pad(h.create_mock_thz_pulse(200)[0], (100, 1700))
+    echoes = [(100, .8, 260.5, -.4), (150.25, .5, 400, .3), (120, 1., 121, 0.)]
+    samples = np.stack([a * _delayed(reference, t_a) + b * _delayed(reference, t_b) for t_a, a, t_b, b in echoes])
+
+    delays, responses, table = dc.deconvolve(reference, samples, SAMPLE_RATE, BAND, threshold=.2)
+    assert responses.shape == (3, len(delays)) and np.all(np.diff(delays) > 0), ValueError("Wrong responses.")
+    for trace, (t_a, a, t_b, b) in enumerate(echoes[:2]):
+        rows = table[table["trace"] == trace]
+        assert np.allclose(rows["delay [s]"], np.array([t_a, t_b]) / SAMPLE_RATE, rtol=0, atol=.05 / SAMPLE_RATE) \
+            and np.allclose(rows["amplitude"], [a, b], atol=.02), ValueError(f"Wrong echoes of trace {trace}.")
+
+    # a single echo: its side lobes are not reported
+    assert len(table[table["trace"] == 2]) == 1, ValueError("Missing echo reported.")
@@ -0,0 +1,70 @@
+import os
+import numpy as np
+from thzsoftware import helper as h
+from thzsoftware.tds import imaging as im
+from thzsoftware.tds import phase as ph
+from thzsoftware.tds import pulse as pt
+
+SAMPLE_RATE = 2e13
+
+
+def _image(directory, nx=6, ny=5):
+    reference = np.pad(h.create_mock_thz_pulse(200)[0], (100, 700))
+    shifts = np.add.outer(np.arange(nx), 2 * np.arange(ny)) + 10
+    cube = im.ImageCube.create(directory, (nx, ny, len(reference)), SAMPLE_RATE)
+    for x in range(nx):
+        for y in range(ny):
+            cube.data[x, y] = (1 + .1 * x) * np.roll(reference, shifts[x, y])
+    cube.data[0, 0] = 0  # no pulse
+    cube.flush()
+    return reference, shifts
+
+
+def test_compute_maps(tmp_path):
+    reference, shifts = _image(str(tmp_path / "cube"))
+    thickness = 1e-3
+    maps = im.compute_maps(str(tmp_path / "cube"), str(tmp_path / "maps"), reference, band=(2e11, 2e12),
+                           thickness=thickness, frequencies=(1e12,), tile_size=(4, 2))
+    assert set(maps) == set(im.map_names((1e12,))) and maps["delay"].shape == (6, 5), \
+        ValueError("Maps missing or of wrong shape.")
+    assert maps["found"][0, 0] == 0 and np.isnan(maps["delay"][0, 0]), ValueError("Empty pixel not marked.")
+    delay = shifts / SAMPLE_RATE
+    assert np.allclose(maps["delay"].ravel()[1:], delay.ravel()[1:]), ValueError("Wrong delay map.")
+
+    def phase(trace):
+        fs, spectrum = ph.fft(pt.window(trace, pt.define_thz_pulses(trace)), SAMPLE_RATE)
+        return fs, ph.extrapolate_phase(fs, ph.compute_phase(spectrum)[1], (5e11, 3e12))
+    fs, reference_phase = phase(reference)
+    trace = im.ImageCube(str(tmp_path / "cube")).data[3, 2]
+    n = ph.compute_n_by_phase(fs, reference_phase, phase(trace)[1], thickness)
+    assert np.isclose(maps["n_1THz"][3, 2], np.interp(1e12, fs, n)), ValueError("Wrong n map.")
+    assert np.all(np.diff(maps["band_amplitude"][1:], axis=0) > 0), ValueError("Band amplitude not increasing.")
+
+    parallel = im.compute_maps(str(tmp_path / "cube"), str(tmp_path / "parallel"), reference, band=(2e11, 2e12),
+                               thickness=thickness, frequencies=(1e12,), tile_size=3, workers=2)
+    assert all(np.array_equal(maps[name], parallel[name], equal_nan=True) for name in maps), \
+        ValueError("Parallel maps differ.")
+
+
+def test_compute_maps_resume(tmp_path):
+    reference, _ = _image(str(tmp_path / "cube"))
+    arguments = (str(tmp_path / "cube"), str(tmp_path / "maps"), reference, (2e11, 2e12))
+    complete = {name: np.array(values) for name, values in im.compute_maps(*arguments, tile_size=2).items()}
+
+    # an interrupted run: two tiles not done
+    for tile in im.ImageCube(str(tmp_path / "cube")).tiles(2)[-2:]:
+        os.remove(im._tile_marker(str(tmp_path / "maps"), tile))
+        delay = np.load(str(tmp_path / "maps" / "delay.npy"), mmap_mode="r+")
+        delay[tile[0]:tile[1], tile[2]:tile[3]] = np.nan
+        delay.flush()
+    processed = []
+    resumed = im.compute_maps(*arguments, tile_size=2, resume=True, progress=processed.append)
+    assert len(processed) == 2, ValueError(f"Done tiles processed again. processed = {processed}")
+    assert all(np.array_equal(complete[name], resumed[name], equal_nan=True) for name in complete), \
+        ValueError("Resumed maps differ.")
+
+    try:
+        im.compute_maps(*arguments, tile_size=3, resume=True)
+        raise RuntimeError("Resumed with other settings.")
+    except AssertionError:
+        pass
@@ -0,0 +1,99 @@
+import asyncio
+import os
+import numpy as np
+from thzsoftware import live
+from thzsoftware.tds import phase as ph
+
+SAMPLE_RATE = 2e13
+
+
+class _Collector:  # stand-in for a StreamWriter
+    def __init__(self):
+        self.data = bytearray()
+
+    def write(self, data):
+        self.data += data
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def _stream(n_traces, n_samples=500):
+    collector = _Collector()
+    asyncio.run(live.simulate(collector, n_traces, n_samples, pulse_samples=100, jitter=3))
+    return bytes(collector.data)
+
+
+async def _feed(data, ingest):
+    reader = asyncio.StreamReader()
+    reader.feed_data(data)
+    reader.feed_eof()
+    return await ingest.run(reader)
+
+
+def test_ring_buffer():
+    traces = np.random.default_rng(0).normal(size=(10, 20))
+    buffer = live.RingBuffer(4, 20)
+    for i, trace in enumerate(traces):
+        buffer.push(trace)
+        assert np.allclose(buffer.mean(), traces[max(0, i - 3):i + 1].mean(axis=0)), \
+            ValueError(f"Wrong rolling mean after {i + 1} traces.")
+    assert len(buffer) == 4 and np.array_equal(buffer.ordered(), traces[-4:]), ValueError("Wrong order.")
+
+
+def test_live_ingest():
+    data = _stream(40)
+    ingest = live.LiveIngest(500, SAMPLE_RATE, capacity=8, queue_size=4, overflow="block", pad=100)
+    stats = asyncio.run(_feed(data, ingest))
+    assert stats["received"] == 40 and stats["dropped"] == 0 and ingest.buffer.count == 40, \
+        ValueError(f"Traces lost while blocking. stats = {stats}")
+    assert stats["updates"] >= 1 and len(ingest.latencies) == stats["updates"] and stats["latency_max"] >= 0, \
+        ValueError("Updates not reported.")
+    fs, spectrum = ph.fft(ingest.buffer.ordered().mean(axis=0), SAMPLE_RATE, pad=100)
+    assert np.array_equal(fs, ingest.frequencies) and np.allclose(spectrum, ingest.spectrum) and \
+        np.allclose(ingest.norm, np.abs(spectrum)), ValueError("Spectrum not of the rolling mean.")
+
+    # a burst into a short queue: traces are dropped and counted, the rest reaches the buffer
+    for overflow in ("drop_oldest", "drop_newest"):
+        ingest = live.LiveIngest(500, SAMPLE_RATE, capacity=8, queue_size=2, overflow=overflow)
+        stats = asyncio.run(_feed(data + live.encode_frame(np.zeros(3), 40), ingest))
+        assert stats["dropped"] > 0 and stats["received"] - stats["dropped"] == ingest.buffer.count and \
+            stats["rejected"] == 1, ValueError(f"Wrong counts for {overflow}. stats = {stats}")
+
+
+def test_live_ingest_corrupted():
+    data = _stream(10)
+    frame_size = len(data) // 10
+    oversized = live.FRAME_HEADER.pack(live.FRAME_MAGIC, 2 ** 32 - 1, 0)  # claims 32 GiB of samples
+    # the next magic inside the rejected header, cut off at its end, and behind it
+    for garbage in (b"garbage", b"x" * 13, b"x" * 100):
+        corrupted = data[:frame_size] + garbage + data[frame_size:3 * frame_size] + oversized + data[3 * frame_size:]
+        ingest = live.LiveIngest(500, SAMPLE_RATE, overflow="block")
+        stats = asyncio.run(_feed(corrupted, ingest))
+        assert stats["received"] == 10 and stats["rejected"] == 2, ValueError(f"Corrupted frames not skipped. "
+                                                                              f"stats = {stats}")
+
+
+def test_live_ingest_sources():
+    async def tcp():
+        server = await live.serve_simulator(n_traces=20, n_samples=500, pulse_samples=100, rate=2000)
+        try:
+            ingest = live.LiveIngest(500, SAMPLE_RATE, overflow="block", min_interval=.002)
+            return await ingest.run_tcp(*server.sockets[0].getsockname()[:2])
+        finally:
+            server.close()
+            await server.wait_closed()
+    stats = asyncio.run(tcp())
+    assert stats["received"] == 20 and 1 <= stats["updates"] <= 20, ValueError(f"TCP ingest failed. stats = {stats}")
+
+    async def pipe(data):
+        read_end, write_end = os.pipe()
+        os.write(write_end, data)
+        os.close(write_end)
+        with os.fdopen(read_end, "rb") as pipe_file:
+            return await live.LiveIngest(500, SAMPLE_RATE, overflow="block").run(await live.open_pipe(pipe_file))
+    stats = asyncio.run(pipe(_stream(5)))
+    assert stats["received"] == 5, ValueError(f"Pipe ingest failed. stats = {stats}")
@@ -37,6 +37,43 @@ def test_unwrap_angles():
         x0 = x
 
 
+def test_unwrap_angles_batch():
+    rng = np.random.default_rng(2)
+    wrapped = rng.uniform(-np.pi / 2, np.pi / 2, size=(60, 8))
+    original = wrapped.copy()
+
+    angles = mt.unwrap_angles(wrapped, axis=0)
+    assert np.all(wrapped == original), ValueError("Input modified without 'out'.")
+    for column in range(wrapped.shape[1]):
+        assert np.allclose(angles[:, column], mt.unwrap_angles(wrapped[:, column])), \
+            ValueError("Batch unwrapping differs from single unwrapping.")
+    assert np.all(np.diff(angles, axis=0) <= 0), ValueError("Angles not monotonically decreasing")
+
+    out = mt.unwrap_angles(wrapped, axis=0, out=wrapped)
+    assert out is wrapped and np.allclose(wrapped, angles), ValueError("In place unwrapping failed.")
+
+
+def test_cross_correlate():
+    rng = np.random.default_rng(0)
+    base = rng.normal(size=300)
+    mask = rng.normal(size=40)
+
+    for mode in ("full", "same", "valid"):
+        expected = np.correlate(base, mask, mode)
+        for method in ("fft", "direct"):
+            lags, corr = mt.cross_correlate(base, mask, mode=mode, method=method)
+            assert len(lags) == len(corr) == len(expected), ValueError(f"Wrong output length for mode = {mode}.")
+            assert np.allclose(corr, expected), ValueError(f"Correlation inaccurate for mode = {mode}, "
+                                                           f"method = {method}.")
+
+    # stacked traces are correlated row by row against the same mask
+    stack = np.stack((base, 2 * base, -base))
+    lags, corr = mt.cross_correlate(stack, mask)
+    assert corr.shape == (3, len(base) + len(mask) - 1), ValueError(f"Wrong batch shape. corr.shape = {corr.shape}")
+    assert np.allclose(corr[1], 2 * corr[0]) and np.allclose(corr[2], -corr[0]), ValueError("Batch rows mixed up.")
+    assert lags[0] == -(len(mask) - 1) and lags[-1] == len(base) - 1, ValueError("Lags displaced.")
+
+
 def test_zero_crossing():
     a = [1, 2, 1, 1, -3, -4, 7, 8, 9, 10]
     # test "before"
@@ -0,0 +1,86 @@
+import os
+import numpy as np
+from thzsoftware import data
+from thzsoftware import memo
+from thzsoftware import profiling
+from thzsoftware.tds import phase as ph
+from thzsoftware.tds import pulse as pt
+
+EXAMPLE_DATA = "./examples/example data/transmission/data_26Jul2022/"
+
+
+def test_memoize(tmp_path):
+    calls = []
+
+    @memo.memoize(ignore=("workers",))
+    def stage(array, scale=2., workers=None):
+        calls.append(scale)
+        return array * scale, int(array.size), None
+
+    @memo.memoize
+    def describe(settings):
+        calls.append(settings)
+        return np.zeros(1)
+
+    array = np.arange(5.)
+    stage(array)
+    assert len(calls) == 1, ValueError("Called through without a cache.")
+    with memo.cached(str(tmp_path)) as cache:
+        first = stage(array)
+        again = stage(array.copy(), scale=np.float64(2), workers=4)
+        stage(array, 3.)
+        describe({"a": 1})  # dicts are not keyed, the call is passed through
+        describe({"a": 1})
+    assert calls == [2., 2., 3., {"a": 1}, {"a": 1}], ValueError(f"Equal calls not served from the cache. "
+                                                                 f"calls = {calls}")
+    assert cache.hits == 1 and cache.misses == 2, ValueError(f"Wrong counts. {cache.stats()}")
+    assert np.array_equal(again[0], first[0]) and type(again[1]) is int and again[2] is None, \
+        ValueError("Cached result differs.")
+    assert memo.active_cache() is None, ValueError("Cache still active after the block.")
+
+    # a new session on the same directory
+    with memo.cached(str(tmp_path)) as cache:
+        stage(array)
+    assert len(calls) == 5 and cache.hits == 1, ValueError("Result not kept on disk.")
+
+
+def test_result_cache_eviction(tmp_path):
+    cache = memo.ResultCache(str(tmp_path))
+    for i, key in enumerate("abc"):
+        cache.put(key, np.zeros(100))
+        os.utime(tmp_path / f"{key}.npz", (i, i))
+    size = cache.n_bytes // 3
+    cache.get("a")  # now the most recently used
+    cache.max_bytes = 5 * size // 2  # evicted down to 90 % of it, which holds two results
+    cache.put("d", np.ones(100))
+    assert cache.get("b") is memo.MISS and cache.get("c") is memo.MISS, ValueError("Least recently used results "
+                                                                                  "not evicted.")
+    assert cache.get("a") is not memo.MISS and np.array_equal(cache.get("d"), np.ones(100)), \
+        ValueError("Recently used results evicted.")
+    assert cache.evictions == 2 and cache.n_bytes == 2 * size and len(os.listdir(tmp_path)) == 2, \
+        ValueError(f"Cache exceeds its size. {cache.stats()}")
+
+
+def test_memoize_pipeline(tmp_path):
+    def transmission():
+        phases = []
+        for file_name in ("air.pulse.csv", "Si.pulse.csv"):
+            _, columns, _, sample_rate = data.read_pulse_csv(EXAMPLE_DATA + file_name)
+            windowed = pt.window(columns[1], pt.define_thz_pulses(columns[1]))
+            fs, spectrum = ph.fft(windowed, sample_rate, pad=500)
+            phases.append(ph.extrapolate_phase(fs, ph.compute_phase(spectrum)[1], (5e11, 3e12)))
+        return ph.compute_n_by_phase(fs, phases[0], phases[1], 1e-3)
+
+    expected = transmission()
+    with memo.cached(str(tmp_path)) as cache:
+        cold = transmission()
+        with profiling.profile() as warm_profile:
+            warm = transmission()
+    assert np.array_equal(cold, expected) and np.array_equal(warm, expected), ValueError("Cached pipeline differs.")
+    assert cache.misses == 11 and cache.hits == 11, ValueError(f"Warm run not served from the cache. "
+                                                               f"{cache.stats()}")
+    # only the reading and the cached stages themselves run
+    assert set(warm_profile.stats()) == {"data.read_pulse_csv", "tds.pulse.window", "tds.pulse.define_thz_pulses",
+                                         "tds.phase.fft", "tds.phase.compute_phase", "tds.phase.extrapolate_phase",
+                                         "tds.phase.compute_n_by_phase"}, \
+        ValueError(f"Numeric work in the warm run: {set(warm_profile.stats())}")
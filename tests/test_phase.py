@@ -60,3 +60,62 @@ def test_compute_n_by_phase():
 
     for i in range(10):
         assert h.within_tolerance(out[i],expected_out,1e-5), ValueError("n inaccurate.")
+
+
+def test_batched_pipeline():
+    rng = np.random.default_rng(3)
+    pulse = h.create_mock_thz_pulse(400)[0]
+    traces = np.stack([np.roll(pulse, shift) for shift in rng.integers(-20, 20, 6)]) + rng.normal(0, .1, (6, 400))
+    sample_rate = 2e13
+
+    fs, spectra = pt.fft(traces, sample_rate, pad=100)
+    _, phases = pt.compute_phase(spectra)
+    f_limits = (fs[5], fs[40])
+    phases = pt.extrapolate_phase(fs, phases, f_limits)
+    ns = pt.compute_n_by_phase(fs, phases[0], phases, 1e-3)
+
+    # same stack along the first axis
+    _, spectra_t = pt.fft(traces.T, sample_rate, pad=100, axis=0)
+    _, phases_t = pt.compute_phase(spectra_t, axis=0)
+    phases_t = pt.extrapolate_phase(fs, phases_t, f_limits, axis=0)
+    assert np.array_equal(phases_t.T, phases), ValueError("Batch along axis 0 differs from axis -1.")
+    assert np.array_equal(pt.compute_n_by_phase(fs, phases[0], phases_t, 1e-3, axis=0).T, ns), \
+        ValueError("Single reference not broadcast along axis 0.")
+
+    for i, trace in enumerate(traces):
+        fs_single, spectrum = pt.fft(trace, sample_rate, pad=100)
+        _, phase = pt.compute_phase(spectrum)
+        phase = pt.extrapolate_phase(fs_single, phase, f_limits)
+        n = pt.compute_n_by_phase(fs_single, phases[0], phase, 1e-3)
+
+        assert np.array_equal(spectra[i], spectrum), ValueError("Batched fft differs from single trace.")
+        assert np.array_equal(phases[i], phase), ValueError("Batched phase differs from single trace.")
+        assert np.array_equal(ns[i], n), ValueError("Batched n differs from single trace.")
+
+
+def test_frequency_axis():
+    pt.frequency_axis.cache_clear()
+    fs, _ = pt.fft(np.ones(64), 10.)
+    fs_again, _ = pt.fft(np.zeros(64), 10.)
+    assert fs is fs_again and pt.frequency_axis.cache_info().hits == 1, ValueError("Frequency axis not cached.")
+    assert not fs.flags.writeable, ValueError("Cached frequency axis is writable.")
+    assert np.allclose(fs, np.arange(32) * 10. / 64), ValueError("Frequency axis inaccurate.")
+
+
+def test_fft_padding():
+    f_test = 7.3141
+    sample_rate = 50.
+    ys = np.sin(2 * np.pi * f_test * np.arange(500) / sample_rate)
+
+    for kwargs in (dict(pad=300), dict(resolution=.01), dict(pad=300, fast_length=True)):
+        fs, yf = pt.fft(ys, sample_rate, **kwargs)
+        assert len(fs) == len(yf) and np.allclose(np.diff(fs), sample_rate / (2 * len(fs)), rtol=1e-2), \
+            ValueError(f"Frequency axis does not match the padded transform for {kwargs}.")
+        assert h.within_tolerance(fs[np.argmax(np.abs(yf))], f_test, fs[1] - fs[0]), \
+            ValueError(f"Frequency component != f_test = {f_test} for {kwargs}.")
+
+    fs, yf = pt.fft(ys, sample_rate, resolution=.01)
+    assert fs[1] - fs[0] <= .01, ValueError("Target resolution not reached.")
+    _, yf_single = pt.fft(ys, sample_rate, single_precision=True)
+    assert yf_single.dtype == np.complex64, TypeError(f"Single precision transform has dtype {yf_single.dtype}.")
+    assert np.allclose(yf_single, pt.fft(ys, sample_rate)[1], atol=1e-3), ValueError("Single precision inaccurate.")
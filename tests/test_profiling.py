@@ -0,0 +1,70 @@
+import json
+import os
+import subprocess
+import sys
+import numpy as np
+from thzsoftware import profiling as pf
+from thzsoftware import helper as h
+from thzsoftware.tds import pulse as pl
+
+EXAMPLE_FILE = "./examples/example data/transmission/data_26Jul2022/air.pulse.csv"
+
+
+def test_profile():
+    ys, _ = h.create_mock_thz_pulse(200)
+    pl.define_thz_pulses(ys)  # not recorded
+
+    with pf.profile(memory=True) as prof:
+        pl.define_thz_pulses(ys)
+        pl.define_thz_pulses(ys)
+    stats = prof.stats()
+    pl.define_thz_pulses(ys)  # not recorded
+
+    assert stats["tds.pulse.define_thz_pulses"]["calls"] == 2, ValueError("Calls not counted.")
+    assert stats["tds.pulse.find_peaks"]["calls"] == 2, ValueError("Nested calls not recorded.")
+    assert stats["tds.pulse.define_thz_pulses"]["input_bytes"] == 2 * ys.nbytes, ValueError("Wrong input size.")
+    entry = stats["tds.pulse.define_thz_pulses"]
+    assert entry["self"] < entry["total"] <= prof.wall_time, ValueError("Nested time not excluded from self time.")
+    assert entry["peak_bytes"] >= stats["tds.pulse.find_peaks"]["peak_bytes"] > 0, \
+        ValueError("Allocation peak of nested call not carried to the caller.")
+    assert "tds.pulse.define_thz_pulses" in prof.summary(), ValueError("Function missing in summary.")
+
+    # without tracemalloc.reset_peak (Python < 3.9)
+    reset_peak, pf._reset_peak = pf._reset_peak, None
+    try:
+        with pf.profile(memory=True) as prof:
+            pl.define_thz_pulses(ys)
+    finally:
+        pf._reset_peak = reset_peak
+    stats = prof.stats()
+    assert stats["tds.pulse.define_thz_pulses"]["peak_bytes"] >= stats["tds.pulse.find_peaks"]["peak_bytes"] > 0, \
+        ValueError("Allocation peaks not recorded without reset_peak.")
+
+
+def test_chrome_trace(tmp_path):
+    with pf.profile() as prof:
+        pl.window(np.ones(100), (10, 90))
+    path = str(tmp_path / "trace.json")
+    prof.save_chrome_trace(path)
+    with open(path) as trace_file:
+        events = json.load(trace_file)["traceEvents"]
+
+    assert [event["name"] for event in events] == ["tds.pulse.window_shape", "tds.pulse.window"], \
+        ValueError("Events missing or out of order.")
+    assert all(event["ph"] == "X" and event["dur"] >= 0 for event in events), ValueError("Not complete events.")
+    assert events[1]["ts"] <= events[0]["ts"] and events[0]["ts"] + events[0]["dur"] <= \
+        events[1]["ts"] + events[1]["dur"], ValueError("Nested event outside its caller.")
+    assert "peak_bytes" not in events[1]["args"], ValueError("Allocations recorded without memory tracing.")
+
+
+def test_profile_session(tmp_path):
+    trace_path = str(tmp_path / "session.json")
+    code = ("import os; from thzsoftware import profiling; from thzsoftware.data import read_pulse_csv; "
+            f"read_pulse_csv({EXAMPLE_FILE!r}); print(os.environ.get(profiling.ENVIRONMENT_VARIABLE))")
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                            env={**os.environ, pf.ENVIRONMENT_VARIABLE: trace_path})
+    assert result.stdout.strip() == trace_path, ValueError("Environment variable changed by the import.")
+    with open(trace_path) as trace_file:
+        event, = json.load(trace_file)["traceEvents"]
+    assert event["name"] == "data.read_pulse_csv" and event["args"]["input_bytes"] == os.path.getsize(EXAMPLE_FILE), \
+        ValueError(f"Session not profiled or file size not counted. event = {event}")
@@ -1,4 +1,5 @@
 import numpy as np
+from scipy import signal
 from thzsoftware.tds import pulse as pt
 from thzsoftware import math as mt
 from thzsoftware import helper as h
@@ -17,6 +18,20 @@ def test_convolve():
     assert np.min(xs) == -length and np.max(xs) == length - 1
 
 
+def test_convolve_batch():
+    length = 300
+    rng = np.random.default_rng(1)
+    mask = rng.normal(size=length)
+    traces = rng.normal(size=(4, length))
+
+    xs, conv = pt.convolve(traces, mask, dx=.5)
+    assert conv.shape == (4, 2 * length) and xs.shape == (2 * length,), ValueError("Wrong batch shape.")
+    for trace, row in zip(traces, conv):
+        xs_single, conv_single = pt.convolve(trace, mask, dx=.5, method="direct")
+        assert np.all(xs == xs_single) and np.allclose(row, conv_single), ValueError("Batch convolution differs "
+                                                                                     "from single trace.")
+
+
 def test_define_thz_pulses():
     # test assumes noiseless signal (generated)
     n = 100
@@ -42,6 +57,24 @@ def test_define_thz_pulses():
     assert h.within_tolerance(coverage, 1, 5*1e-2), ValueError("Not enough pulse coverage.")
 
 
+def test_define_thz_pulses_batch():
+    rng = np.random.default_rng(0)
+    pulse = h.create_mock_thz_pulse(100)[0]
+    traces = np.stack([np.pad(pulse, (shift, 300 - shift)) + rng.normal(0, .05, 400) for shift in range(0, 300, 6)])
+    traces[1] *= -1
+    traces[2] = 0  # no field
+    traces[3] = np.abs(traces[3])  # no zero crossing
+
+    left_limits, right_limits, found = pt.define_thz_pulses_batch(traces)
+    assert not found[2] and not found[3] and left_limits[2] == right_limits[2] == 0, \
+        ValueError("Traces without pulse not masked.")
+    for trace, left_limit, right_limit, trace_found in zip(traces, left_limits, right_limits, found):
+        if trace_found:
+            assert pt.define_thz_pulses(trace) == (left_limit, right_limit), \
+                ValueError("Batch limits differ from define_thz_pulses.")
+    assert found.sum() == len(traces) - 2, ValueError("Valid traces masked.")
+
+
 def test_find_delayed_pulse():
     length = 50
     pulse = np.zeros(length)
@@ -53,6 +86,48 @@ def test_find_delayed_pulse():
     assert pulses[0] == length - 10 and pulses[1] == length + 5, "Pulse location inaccurate."
 
 
+def test_find_delayed_pulse_batch():
+    length = 200
+    pulse = np.zeros(length)
+    pulse[20:30] = np.hanning(10)
+    delays = np.array([[15, 60, 120], [100, 40, 5]])
+    amplitudes = np.array([1., .6, .3])
+    traces = np.zeros((2, length))
+    for row, row_delays in enumerate(delays):
+        for delay, amplitude in zip(row_delays, amplitudes):
+            traces[row] += amplitude * mt.shift_array(pulse, delay)
+
+    positions, magnitudes = pt.find_delayed_pulse(pulse, traces, 10, number_of_pulses=3, return_magnitudes=True)
+    assert positions.shape == (2, 3), ValueError("Batch shape not kept.")
+    assert np.array_equal(positions, length + delays), "Echoes missing or not ordered by strength."
+    assert np.all(np.diff(magnitudes, axis=-1) < 0), ValueError("Magnitudes not ordered.")
+    for row in range(2):
+        assert np.array_equal(pt.find_delayed_pulse(pulse, traces[row], 10, number_of_pulses=3), positions[row]), \
+            ValueError("Batch differs from single traces.")
+
+
+def test_find_echoes():
+    rng = np.random.default_rng(0)
+    correlation = rng.normal(0, 1, (20, 300))
+    min_distance, number_of_echoes = 7, 4
+    positions, magnitudes = pt.find_echoes(correlation, min_distance, number_of_echoes)
+
+    for row, values in enumerate(correlation):  # greedy suppression over all local maxima
+        maxima = [i for i in range(1, len(values) - 1) if values[i - 1] < values[i] >= values[i + 1] and values[i] > 0]
+        kept = []
+        for i in sorted(maxima, key=lambda i: -values[i]):
+            if len(kept) < number_of_echoes and all(abs(i - j) >= min_distance for j in kept):
+                kept.append(i)
+        assert list(positions[row]) == kept, ValueError("Echoes differ from exhaustive search.")
+        assert np.array_equal(magnitudes[row], values[kept]), ValueError("Wrong magnitudes.")
+
+    xs = np.arange(100)
+    peak = np.exp(-.5 * ((xs - 40.3) / 4) ** 2) + .5 * np.exp(-.5 * ((xs - 70.8) / 4) ** 2)
+    refined, _ = pt.find_echoes(peak, 10, 3, refine=True)
+    assert np.allclose(refined[:2], [40.3, 70.8], atol=.05) and np.isnan(refined[2]), \
+        ValueError("Sub-sample refinement inaccurate.")
+
+
 def test_find_peaks():
     length = 50
     pulse = np.zeros(length)
@@ -78,3 +153,32 @@ def test_window():
                                                                                              "has wrong shape.")
     assert h.within_tolerance(np.sum(tukey_window), 6.76604, 1e-5) and \
            tukey_window[24] == tukey_window[25] == 1, ValueError("Tukey window has wrong shape.")
+    assert np.array_equal(pt.window(ones, (20, 30)), tukey_window), ValueError("Default Tukey window changed.")
+
+
+def test_window_batch():
+    rng = np.random.default_rng(4)
+    traces = rng.normal(size=(20, 100))
+    lefts = rng.integers(0, 40, 20)
+    limits = np.column_stack((lefts, lefts + rng.choice((20, 30, 45), 20)))
+
+    for window_func in ("box_car", "cosine", "tukey"):
+        windowed = pt.window(traces, limits, window_func, tukey_alpha=.3)
+        for trace, trace_limits, row in zip(traces, limits, windowed):
+            assert np.array_equal(row, pt.window(trace, trace_limits, window_func, tukey_alpha=.3)), \
+                ValueError(f"Batched {window_func} window differs from single trace window.")
+
+    # a flat pair of limits is one window for every trace, also for a stack of two
+    pair = pt.window(traces[:2], (10, 40))
+    assert np.array_equal(pair, np.stack([pt.window(trace, (10, 40)) for trace in traces[:2]])), \
+        ValueError("Pair of limits taken as per-trace limits.")
+    for alpha in (.1, .5, 1.):
+        assert np.allclose(pt.window_shape("tukey", 45, alpha), signal.windows.tukey(45, alpha), rtol=0, atol=1e-15), \
+            ValueError(f"Tukey window with alpha {alpha} differs from scipy.")
+
+    # shapes are cached and shared, so they must not be writable
+    pt.window_shape.cache_clear()
+    shape = pt.window_shape("tukey", 30, .3)
+    assert pt.window_shape("tukey", 30, .3) is shape and pt.window_shape.cache_info().hits == 1, \
+        ValueError("Window shape not cached.")
+    assert not shape.flags.writeable, ValueError("Cached window shape is writable.")
@@ -0,0 +1,63 @@
+import os
+import numpy as np
+from thzsoftware import helper as h
+from thzsoftware import profiling
+from thzsoftware.tds import phase as ph
+from thzsoftware.tds import pulse as pt
+from thzsoftware.tds import reference as rf
+
+SAMPLE_RATE = 2e13
+
+
+def _trace(shift=0):
+    pulse = np.pad(h.create_mock_thz_pulse(200)[0], (100, 700))
+    return np.roll(pulse, shift)
+
+
+def test_reference_spectrum():
+    cache = rf.SpectrumCache()
+    trace = _trace()
+    fs, norm, phase = rf.reference_spectrum(trace, SAMPLE_RATE, pad=100, f_limits=(1e11, 1e12), cache=cache)
+
+    windowed = pt.window(trace, pt.define_thz_pulses(trace))
+    fs_direct, spectrum = ph.fft(windowed, SAMPLE_RATE, pad=100)
+    norm_direct, phase_direct = ph.compute_phase(spectrum)
+    phase_direct = ph.extrapolate_phase(fs_direct, phase_direct, (1e11, 1e12))
+    assert np.array_equal(fs, fs_direct) and np.array_equal(norm, norm_direct) and \
+        np.array_equal(phase, phase_direct), ValueError("Cached spectrum differs from the pipeline.")
+
+    with profiling.profile() as hit_profile:
+        again = rf.reference_spectrum(trace.copy(), SAMPLE_RATE, pad=100, f_limits=(1e11, 1e12), cache=cache)
+    assert cache.hits == 1 and cache.misses == 1 and \
+        all(np.array_equal(a, b) for a, b in zip(again, (fs, norm, phase))), \
+        ValueError("Equal trace not served from the cache.")
+    again[2][:] = 0
+    assert np.array_equal(rf.reference_spectrum(trace, SAMPLE_RATE, pad=100, f_limits=(1e11, 1e12), cache=cache)[2],
+                          phase), ValueError("Returned arrays share memory with the cache.")
+    assert set(hit_profile.stats()) == {"tds.reference.reference_spectrum"}, \
+        ValueError(f"Pulse search or processing run on a hit: {set(hit_profile.stats())}")
+
+    rf.reference_spectrum(trace, SAMPLE_RATE, pad=200, f_limits=(1e11, 1e12), cache=cache)
+    rf.reference_spectrum(_trace(1), SAMPLE_RATE, pad=100, f_limits=(1e11, 1e12), cache=cache)
+    assert cache.misses == 3, ValueError("Different parameters or trace served from the cache.")
+
+    uncached = rf.reference_spectrum(trace, SAMPLE_RATE, pad=100, f_limits=(1e11, 1e12))
+    assert np.array_equal(uncached[2], phase) and cache.hits == 2 and cache.misses == 3, \
+        ValueError("Spectrum cached without a cache.")
+
+
+def test_spectrum_cache_eviction_and_disk(tmp_path):
+    directory = str(tmp_path / "spectra")
+    cache = rf.SpectrumCache(max_bytes=2 * 8 * 100, directory=directory)
+    for i in range(3):
+        cache.get(str(i), lambda: (np.full(100, i),))
+    assert len(cache) == 2 and "0" not in cache._entries, ValueError("Least recently used entries not evicted.")
+    assert len(os.listdir(directory)) == 3, ValueError("Entries not persisted.")
+
+    restarted = rf.SpectrumCache(directory=directory)
+    value, = restarted.get("0", lambda: (np.zeros(1),))
+    assert restarted.disk_hits == 1 and restarted.misses == 0 and np.array_equal(value, np.full(100, 0)), \
+        ValueError("Persisted entry not reloaded.")
+    assert value.flags.writeable, ValueError("Reloaded array not returned as a copy.")
+    restarted.clear(disk=True)
+    assert len(restarted) == 0 and not os.listdir(directory), ValueError("Cache not cleared.")
@@ -0,0 +1,44 @@
+import os
+import numpy as np
+from thzsoftware import store
+
+
+def test_write_atomic(tmp_path):
+    path = str(tmp_path / "file.bin")
+    store.write_atomic(path, lambda file: file.write(b"data"))
+    open(tmp_path / "opened.bin", "w").close()
+    assert open(path, "rb").read() == b"data" and os.stat(path).st_mode == os.stat(tmp_path / "opened.bin").st_mode, \
+        ValueError("File not written with the mode of open().")
+
+    def fail(file):
+        file.write(b"partial")
+        raise RuntimeError
+    try:
+        store.write_atomic(path, fail)
+        raise AssertionError("Failure of write not raised.")
+    except RuntimeError:
+        pass
+    assert open(path, "rb").read() == b"data" and sorted(os.listdir(tmp_path)) == ["file.bin", "opened.bin"], \
+        ValueError("Failed write left a partial or temporary file.")
+
+
+def test_file_store(tmp_path):
+    file_store = store.FileStore(str(tmp_path), ".npy", max_bytes=10 * 928)  # .npy of 100 int64: 928 bytes
+    for i in range(10):
+        file_store.write(str(i), lambda file: np.save(file, np.full(100, i)))
+        os.utime(file_store.path(str(i)), (i, i))
+    assert file_store.evictions == 0 and len(file_store) == 10, ValueError("Evicted below max_bytes.")
+    assert np.array_equal(file_store.read("0", np.load), np.zeros(100)), ValueError("Wrong file read.")
+
+    file_store.write("10", lambda file: np.save(file, np.full(100, 10)))
+    assert file_store.evictions == 2 and not ("1" in file_store or "2" in file_store) and "0" in file_store and \
+        "10" in file_store, \
+        ValueError("Not evicted down to the low water mark in order of use.")
+    file_store.write("11", lambda file: np.save(file, np.full(100, 11)))
+    assert file_store.evictions == 2 and file_store.n_bytes == 10 * 928, ValueError("Evicted on every write.")
+
+    assert file_store.read("missing", np.load) is None, ValueError("Missing file read.")
+    reopened = store.FileStore(str(tmp_path), ".npy")
+    assert len(reopened) == 10 and reopened.n_bytes == file_store.n_bytes, ValueError("Files not indexed.")
+    reopened.clear()
+    assert not os.listdir(tmp_path), ValueError("Store not cleared.")
@@ -0,0 +1,46 @@
+import numpy as np
+from thzsoftware.tds import thickness as th
+from thzsoftware.tds import transfer as tr
+
+FS = np.linspace(0, 3e12, 1000)
+REFERENCE = np.exp(-(FS / 1.2e12) ** 2) * np.exp(-2j * np.pi * FS * 1e-11)
+GRID = np.linspace(4.5e-4, 5.5e-4, 21)
+
+
+def _sample(thickness, n=3.42):
+    n_complex = n + .05 * FS / 1e12 - 1j * (.01 + .02 * FS / 1e12)
+    return REFERENCE * tr.transfer_function(FS, n_complex, thickness, echoes=None)
+
+
+def test_optimize_thickness():
+    sample = _sample(5.03e-4)
+    for criterion, tolerance in (("smoothness", 1e-8), ("total_variation", 1e-6)):
+        thickness, costs = th.optimize_thickness(FS, REFERENCE, sample, GRID, (2e11, 2.5e12), criterion=criterion)
+        assert costs.shape == GRID.shape and abs(GRID[np.argmin(costs)] - 5.03e-4) < GRID[1] - GRID[0], \
+            ValueError(f"Cost curve of {criterion} not lowest next to the thickness.")
+        assert abs(thickness - 5.03e-4) < tolerance, ValueError(f"Thickness not refined by {criterion}. "
+                                                               f"thickness = {thickness}")
+
+    shuffled = np.random.default_rng(0).permutation(GRID)
+    thickness_shuffled, costs_shuffled = th.optimize_thickness(FS, REFERENCE, sample, shuffled, (2e11, 2.5e12),
+                                                               criterion="smoothness")
+    assert np.array_equal(costs_shuffled, th.thickness_cost(FS, REFERENCE, sample, shuffled, (2e11, 2.5e12),
+                                                            criterion="smoothness")) and \
+        abs(thickness_shuffled - 5.03e-4) < 1e-8, ValueError("Costs not in the order of an unsorted grid.")
+
+    costs = th.thickness_cost(FS, REFERENCE, sample, GRID, (2e11, 2.5e12))
+    assert np.array_equal(costs, [th.thickness_cost(FS, REFERENCE, sample, [thickness], (2e11, 2.5e12))[0]
+                                  for thickness in GRID]), ValueError("Grid cost differs from single thicknesses.")
+
+
+def test_optimize_thickness_batch():
+    samples = np.stack([_sample(thickness, n) for thickness, n in ((4.8e-4, 3.42), (5.2e-4, 2.), (5e-4, 1.6))])
+    thicknesses, costs = th.optimize_thickness_batch(FS, REFERENCE, samples, GRID, (2e11, 2.5e12),
+                                                     criterion="smoothness")
+    assert costs.shape == (3, len(GRID)) and np.allclose(thicknesses, [4.8e-4, 5.2e-4, 5e-4], rtol=0, atol=1e-8), \
+        ValueError(f"Wrong batch thicknesses. thicknesses = {thicknesses}")
+
+    parallel = th.optimize_thickness_batch(FS, REFERENCE, samples, GRID, (2e11, 2.5e12), criterion="smoothness",
+                                           workers=2)
+    assert np.array_equal(parallel[0], thicknesses) and np.array_equal(parallel[1], costs), \
+        ValueError("Parallel batch differs.")
@@ -0,0 +1,48 @@
+import numpy as np
+import scipy.fft as ft
+from thzsoftware import helper as h
+from thzsoftware.tds import phase as ph
+from thzsoftware.tds import transfer as tr
+
+SAMPLE_RATE = 2e13
+THICKNESS = 5e-4
+
+
+def test_solve_refractive_index():
+    fs = np.linspace(0, 3e12, 1000)
+    n_complex = np.array([[3.42], [2.1], [1.5]]) + .05 * fs / 1e12 - 1j * (.01 + .02 * fs / 1e12)
+    reference = np.exp(-(fs / 1e12) ** 2) * np.exp(-2j * np.pi * fs * 1e-11)
+    reference[500] = 0  # no signal at one frequency
+    for echoes in (0, 2, None):
+        sample = reference * tr.transfer_function(fs, n_complex, THICKNESS, echoes=echoes)
+        n, kappa, converged = tr.solve_refractive_index(fs, reference, sample, THICKNESS, echoes=echoes)
+        assert n.shape == kappa.shape == converged.shape == (3, 1000), ValueError("Batch shape not conserved.")
+        assert not converged[:, 0].any() and not converged[:, 500].any() and converged.sum() == 3 * 998, \
+            ValueError(f"Wrong convergence mask for echoes = {echoes}.")
+        assert np.allclose(n[converged], np.broadcast_to(n_complex.real, n.shape)[converged]) and \
+            np.allclose(kappa[converged], -np.broadcast_to(n_complex.imag, n.shape)[converged]), \
+            ValueError(f"Wrong refractive index for echoes = {echoes}.")
+
+    transposed = tr.solve_refractive_index(fs, reference, sample.T, THICKNESS, echoes=None, axis=0)
+    assert np.allclose(transposed[0].T, n, equal_nan=True), ValueError("'axis' not respected.")
+
+
+def test_solve_refractive_index_traces():
+    reference = np.pad(h.create_mock_thz_pulse(200)[0], (200, 1600))
+    n_complex = 3.42 - .01j
+    spectrum_fs = ft.rfftfreq(len(reference), 1 / SAMPLE_RATE)
+    sample = ft.irfft(ft.rfft(reference) * tr.transfer_function(spectrum_fs, n_complex, THICKNESS), len(reference))
+
+    fs, reference_spectrum = ph.fft(reference, SAMPLE_RATE)
+    _, sample_spectrum = ph.fft(sample, SAMPLE_RATE)
+    band = (fs > 2e11) & (fs < 2e12)
+    n, kappa, converged = tr.solve_refractive_index(fs, reference_spectrum, sample_spectrum, THICKNESS)
+    assert converged[band].all(), ValueError("Not converged in the band of the pulse.")
+    assert np.allclose(n[band], 3.42) and np.allclose(kappa[band], .01), ValueError("Wrong refractive index from "
+                                                                                    "traces.")
+
+    # the phase offset of the fit absorbs the small phase of the surface losses
+    n, kappa, converged = tr.solve_refractive_index(fs, reference_spectrum, sample_spectrum, THICKNESS,
+                                                    f_limits=(2e11, 1e12))
+    assert converged[band].all() and np.allclose(n[band], 3.42, atol=1e-3) and \
+        np.allclose(kappa[band], .01, atol=1e-3), ValueError("Wrong refractive index of the extrapolated phase.")
@@ -1,16 +1,237 @@
 """Console script for thzsoftware."""
+import fnmatch
+import os
 import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
 import click
+import numpy as np
+import pandas as pd
+
+from thzsoftware import data
+from thzsoftware.tds import phase as ph
+from thzsoftware.tds import pulse as pl
+from thzsoftware.tds import reference as rf
+
+WINDOW_FUNCTIONS = ("tukey", "cosine", "box_car")
+_reference_cache = rf.SpectrumCache()  # reference spectra of this (worker) process, see transmission_n
+
+
+# the pipeline settings shared by both commands, passed to the workers as a dict.
+def _settings(thickness, f_min, f_max, pad, channel, window, alpha, time_unit):
+    if thickness <= 0:
+        raise click.BadParameter(f"must be positive. thickness = {thickness}", param_hint="'--thickness'")
+    if not 0 <= f_min < f_max:
+        raise click.BadParameter(f"need 0 <= f-min < f-max. f_min = {f_min}, f_max = {f_max}",
+                                 param_hint="'--f-min' / '--f-max'")
+    return {"thickness": thickness, "f_limits": (f_min * 1e12, f_max * 1e12), "pad": pad, "channel": channel,
+            "window": window, "alpha": alpha, "time_unit": time_unit}
+
+
+# pair every sample with a reference of its directory, the one sharing the longest name prefix if there are
+# several. Returns [(dir_key, sample_key, reference_path, sample_path)] and the directories lacking a reference.
+def pair_files(file_tree, reference_pattern, sample_pattern):
+    pairs, unpaired = [], []
+    for dir_key, measurement_dict in sorted(file_tree.items()):
+        references = sorted(key for key in measurement_dict if fnmatch.fnmatch(key, reference_pattern))
+        samples = sorted(key for key in measurement_dict if fnmatch.fnmatch(key, sample_pattern)
+                         and key not in references)
+        if not references:
+            if samples:
+                unpaired.append(dir_key)
+            continue
+        for sample_key in samples:
+            reference_key = max(references, key=lambda key: len(os.path.commonprefix((key, sample_key))))
+            pairs.append((dir_key, sample_key, measurement_dict[reference_key], measurement_dict[sample_key]))
+    return pairs, unpaired
+
+
+def _output_path(output, dir_key, sample_key):
+    return os.path.join(output, dir_key, sample_key + "_n.csv")
+
+
+# signal column and sample rate [Hz] of a trace. Pulse files carry their time unit, other csv files are read with
+# the first column as time in 'time_unit'.
+def _read_trace(file_path, channel, time_unit):
+    try:
+        _, columns, _, sample_rate = data.read_pulse_csv(file_path)
+    except ValueError:
+        columns = data.Measurement.from_frame(pd.read_csv(file_path)).values
+        sample_rate = 1 / ((columns[0, 1] - columns[0, 0]) * data.TIME_UNITS[time_unit])
+    assert channel < len(columns), ValueError(f"{file_path} has no signal column {channel}.")
+    return columns[channel], sample_rate
+
+
+# windowed trace -> spectrum norm and extrapolated phase.
+def _spectrum(trace, limits, sample_rate, settings):
+    windowed = pl.window(trace, limits, window_func=settings["window"], tukey_alpha=settings["alpha"])
+    fs, spectrum = ph.fft(windowed, sample_rate, pad=settings["pad"])
+    norm, phase = ph.compute_phase(spectrum)
+    return fs, norm, ph.extrapolate_phase(fs, phase, settings["f_limits"])
+
+
+# n of the sample from the phase delay against the reference (air) pulse, each windowed around its own pulse. The
+# reference spectrum is kept in the process' _reference_cache, as a reference is usually shared by many samples.
+def transmission_n(reference, sample, sample_rate, settings):
+    fs, reference_norm, reference_phase = rf.reference_spectrum(
+        reference, sample_rate, window_func=settings["window"], tukey_alpha=settings["alpha"], pad=settings["pad"],
+        f_limits=settings["f_limits"], cache=_reference_cache)
+    _, sample_norm, sample_phase = _spectrum(sample, pl.define_thz_pulses(sample), sample_rate, settings)
+    n = ph.compute_n_by_phase(fs, reference_phase, sample_phase, settings["thickness"])
+    return pd.DataFrame({"frequencies [Hz]": fs, "n": n, "Norm reference [a.u.]": reference_norm,
+                         "Norm sample [a.u.]": sample_norm})
+
+
+# n of a layer on a mirror from the phase delay between the reflections off its front and back surface. The echoes
+# are located by their overlap with the reference (bare mirror) pulse and windowed with the width of that pulse.
+# The back surface echo travels twice through the layer.
+def reflection_n(reference, sample, sample_rate, settings):
+    left, right = pl.define_thz_pulses(reference)
+    width = right - left
+    positions = np.sort(pl.find_delayed_pulse(reference, sample, width, number_of_pulses=2))
+    assert positions[0] > 0, ValueError("Fewer than two echoes found in the sample.")
+    length = len(sample)
+    spectra = []
+    for position in positions:
+        shift = position - length  # convolve index -> delay of the reference pulse in samples
+        limits = (int(np.clip(left + shift, 0, length - 2)), int(np.clip(right + shift, 1, length - 1)))
+        spectra.append(_spectrum(sample, limits, sample_rate, settings))
+    (fs, front_norm, front_phase), (_, back_norm, back_phase) = spectra
+    n = ph.compute_n_by_phase(fs, front_phase, back_phase, 2 * settings["thickness"], n0=0)
+    return pd.DataFrame({"frequencies [Hz]": fs, "n": n, "Norm front echo [a.u.]": front_norm,
+                         "Norm back echo [a.u.]": back_norm})
+
 
+PIPELINES = {"transmission": transmission_n, "reflection": reflection_n}
 
-@click.command()
+
+# one pair, run in a worker: read, process and write the result. Returns the bytes read.
+def process_pair(mode, reference_path, sample_path, output_path, settings):
+    reference, sample_rate = _read_trace(reference_path, settings["channel"], settings["time_unit"])
+    sample, sample_sample_rate = _read_trace(sample_path, settings["channel"], settings["time_unit"])
+    assert np.isclose(sample_rate, sample_sample_rate, rtol=1e-6) and len(reference) == len(sample), \
+        ValueError("Reference and sample are sampled differently.")
+    result = PIPELINES[mode](reference, sample, sample_rate, settings)
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    data._write_csv_atomic(result, output_path)
+    return os.path.getsize(reference_path) + os.path.getsize(sample_path)
+
+
+# run 'mode' for all pairs on a pool of 'workers' processes (in this process for workers=1), with at most
+# 2 * workers pairs in flight. Each result is written as soon as its pair is done, so an interrupted run can be
+# continued with resume=True, which skips pairs whose output exists.
+def run_batch(mode, data_directory, reference_pattern, sample_pattern, output, settings, workers=1, resume=False,
+              echo=click.echo):
+    pairs, unpaired = pair_files(data._index(data_directory), reference_pattern, sample_pattern)
+    for dir_key in unpaired:
+        echo(f"warning: no reference matching '{reference_pattern}' in {dir_key}, its samples are skipped.",
+             err=True)
+    jobs = [(dir_key, sample_key, reference_path, sample_path, _output_path(output, dir_key, sample_key))
+            for dir_key, sample_key, reference_path, sample_path in pairs]
+    skipped = [job for job in jobs if resume and os.path.exists(job[4])]
+    jobs = [job for job in jobs if not (resume and os.path.exists(job[4]))]
+    report = {"pairs": len(pairs), "processed": 0, "skipped": len(skipped), "failed": [], "bytes": 0, "seconds": 0.}
+    if skipped:
+        echo(f"resuming: {len(skipped)} of {len(pairs)} pairs already processed.")
+
+    start = time.perf_counter()
+    with click.progressbar(length=len(jobs), label=f"{mode} ({workers} worker{'s' * (workers > 1)})",
+                           file=sys.stderr, show_pos=True) as progress:
+        def collect(job, get_result):
+            try:
+                report["bytes"] += get_result()
+                report["processed"] += 1
+            except Exception as error:
+                report["failed"].append((job[0] + "/" + job[1], f"{type(error).__name__}: {error}"))
+            progress.update(1)
+
+        if workers == 1:
+            for job in jobs:
+                collect(job, lambda: process_pair(mode, job[2], job[3], job[4], settings))
+        else:
+            with ProcessPoolExecutor(workers) as process_pool:
+                pending = {}
+                for job in jobs:
+                    if len(pending) >= 2 * workers:
+                        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            collect(pending.pop(future), future.result)
+                    pending[process_pool.submit(process_pair, mode, job[2], job[3], job[4], settings)] = job
+                for future in list(pending):
+                    collect(pending.pop(future), future.result)
+    report["seconds"] = time.perf_counter() - start
+    return report
+
+
+def _print_report(report, output):
+    seconds = max(report["seconds"], 1e-9)
+    click.echo(f"{report['processed']} pair(s) processed, {report['skipped']} skipped, {len(report['failed'])} "
+               f"failed in {report['seconds']:.2f} s ({report['processed'] / seconds:.1f} pairs/s, "
+               f"{report['bytes'] / 2 ** 20 / seconds:.1f} MB/s read). Results in {output}")
+    for pair, error in report["failed"]:
+        click.echo(f"failed: {pair}: {error}", err=True)
+
+
+@click.group()
 def main(args=None):
-    """Console script for thzsoftware."""
-    click.echo("Replace this message by putting your code into "
-               "thzsoftware.cli.main")
-    click.echo("See click documentation at https://click.palletsprojects.com/")
+    """Batch processing of THz time domain spectroscopy measurements."""
     return 0
 
 
+def _batch_options(reference_default, sample_default):
+    def decorate(command):
+        for option in reversed((
+                click.argument("data_directory", type=click.Path(exists=True, file_okay=False)),
+                click.option("--reference", default=reference_default, show_default=True,
+                             help="Name pattern (glob) of the reference measurements."),
+                click.option("--sample", default=sample_default, show_default=True,
+                             help="Name pattern (glob) of the sample measurements. References are excluded."),
+                click.option("--thickness", type=float, required=True, help="Sample thickness in m."),
+                click.option("--output", type=click.Path(file_okay=False), default=None,
+                             help="Output directory. [default: DATA_DIRECTORY_n]"),
+                click.option("--f-min", type=float, default=.5, show_default=True,
+                             help="Lower limit of the phase fit in THz."),
+                click.option("--f-max", type=float, default=3., show_default=True,
+                             help="Upper limit of the phase fit in THz."),
+                click.option("--pad", type=int, default=500, show_default=True, help="Zero padding of the fft."),
+                click.option("--channel", type=int, default=1, show_default=True, help="Signal column of the files."),
+                click.option("--window", type=click.Choice(WINDOW_FUNCTIONS), default="tukey", show_default=True),
+                click.option("--alpha", type=float, default=.5, show_default=True, help="Tukey window shape."),
+                click.option("--time-unit", type=click.Choice(tuple(data.TIME_UNITS)), default="ps",
+                             show_default=True, help="Unit of the time column of files without a unit header."),
+                click.option("--workers", type=click.IntRange(min=1), default=os.cpu_count(), show_default=True,
+                             help="Worker processes."),
+                click.option("--resume", is_flag=True, help="Skip pairs whose result already exists."))):
+            command = option(command)
+        return command
+    return decorate
+
+
+def _run(mode, data_directory, reference, sample, thickness, output, f_min, f_max, pad, channel, window, alpha,
+         time_unit, workers, resume):
+    data_directory = data_directory.rstrip("/")
+    output = data_directory + "_n" if output is None else output
+    settings = _settings(thickness, f_min, f_max, pad, channel, window, alpha, time_unit)
+    report = run_batch(mode, data_directory, reference, sample, output, settings, workers, resume)
+    _print_report(report, output)
+    return 1 if report["failed"] else 0
+
+
+@main.command()
+@_batch_options("air*", "*")
+def transmission(**kwargs):
+    """Refractive index of samples against air references, for every pair found in DATA_DIRECTORY."""
+    sys.exit(_run("transmission", **kwargs))
+
+
+@main.command()
+@_batch_options("*bare*", "*")
+def reflection(**kwargs):
+    """Refractive index of layers on a mirror against bare mirror references, for every pair found in
+    DATA_DIRECTORY."""
+    sys.exit(_run("reflection", **kwargs))
+
+
 if __name__ == "__main__":
     sys.exit(main())  # pragma: no cover
@@ -1,54 +1,659 @@
+import hashlib
+import json
 import os
-from time import sleep
+import warnings
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from itertools import repeat
 
 import numpy as np
 import pandas as pd
 
+from thzsoftware import store
+from thzsoftware.profiling import instrument
 
-def _load(data_directory, data_type):
+DEFAULT_CACHE_BYTES = 2 ** 30  # budget for parsed measurements held by a lazy DataSet
+FILE_FORMATS = (None, "pulse")
+TIME_UNITS = {"s": 1., "ms": 1e-3, "us": 1e-6, "ns": 1e-9, "ps": 1e-12, "fs": 1e-15}
+BINARY_MANIFEST = "manifest.json"
+BINARY_FORMAT_VERSION = 2  # 1: entries only (optionally data_type, file_format, file_index), 2: entry layouts
+INDEX_FORMAT_VERSION = 1
+OVERWRITE_POLICIES = ("error", "skip", "overwrite")
+COMPRESSION_EXTENSIONS = {None: "", "gzip": ".gz", "bz2": ".bz2", "xz": ".xz", "zip": ".zip"}
+
+
+# map the directory tree to {directory: {file_key: file_path}} without reading any file. Directory listings are
+# spread over 'executor' if one is given. Hidden entries (starting with '.') are ignored.
+@instrument
+def _index(data_directory, executor=None):
     path = data_directory
-    dirs = os.listdir(path)
-    dir_keys = []
+    dirs = [directory for directory in os.listdir(path) if not directory.startswith(".")]
+    dir_paths = [path + '/' + directory for directory in dirs]
+    listings = executor.map(os.listdir, dir_paths) if executor is not None else map(os.listdir, dir_paths)
     dir_dict = {}
 
     # start by searching through directories (intended to be e.g. measurement days)
-    for directory in dirs:
-        dir_keys.extend([directory])
-        dir_path = path + '/' + directory
-
-        measurement_files = os.listdir(dir_path)
-        measurement_keys = []
+    for directory, dir_path, measurement_files in zip(dirs, dir_paths, listings):
         measurement_dict = {}
 
         # go through data files
         for file in measurement_files:
-            measurement_keys.extend([file])
-            file_path = dir_path + '/' + file
-            data_frame = pd.read_csv(file_path)
-
+            if file.startswith("."):
+                continue
             file_key = os.path.splitext(file)[0]
-            measurement_dict[file_key] = {}
-            measurement_dict[file_key][data_type] = data_frame
+            measurement_dict[file_key] = dir_path + '/' + file
 
-        dir_dict[directory] = measurement_dict.copy()
+        dir_dict[directory] = measurement_dict
 
     return dir_dict
 
 
+# With workers set, directories are listed on a thread pool and files are parsed on a pool of as many threads, or
+# processes if processes=True (parsing is mostly CPU bound). The result is the same as the serial load.
+# If 'errors' is a list, files that fail to parse are skipped and recorded in it as (file_path, exception),
+# otherwise the first failure is raised. file_format is a hint passed on to _read_file.
+def _load(data_directory, data_type, workers=None, processes=False, errors=None, file_format=None):
+    if workers is None:
+        dir_dict = _index(data_directory)
+    else:
+        with ThreadPoolExecutor(workers) as thread_pool:
+            dir_dict = _index(data_directory, thread_pool)
+    return _parse(dir_dict, data_type, workers, processes, errors, file_format)
+
+
+# parse the files of a {directory: {file_key: file_path}} tree (see _index) into {directory: {file_key: {data_type:
+# Measurement}}}. Arguments as for _load.
+@instrument
+def _parse(dir_dict, data_type, workers=None, processes=False, errors=None, file_format=None):
+    assert file_format in FILE_FORMATS, ValueError("'file_format' option invalid. Use any of: "
+                                                   + ", ".join(map(str, FILE_FORMATS)))
+    assert workers is None or (isinstance(workers, (int, np.integer)) and workers > 0), \
+        ValueError(f"'workers' must be a positive integer or None. workers = {workers}")
+    assert isinstance(processes, bool), TypeError(f"'processes' must be boolean. type(processes) = {type(processes)}.")
+
+    file_paths = [file_path for measurement_dict in dir_dict.values() for file_path in measurement_dict.values()]
+    catch = errors is not None
+    if workers is None:
+        results = {file_path: _try_read(file_path, file_format, catch) for file_path in file_paths}
+    elif processes:
+        with ProcessPoolExecutor(workers) as process_pool:
+            parsed = process_pool.map(_try_read, file_paths, repeat(file_format), repeat(catch),
+                                      chunksize=max(1, len(file_paths) // (4 * workers)))
+            results = dict(zip(file_paths, parsed))
+    else:
+        with ThreadPoolExecutor(workers) as thread_pool:
+            results = dict(zip(file_paths, thread_pool.map(_try_read, file_paths, repeat(file_format),
+                                                           repeat(catch))))
+
+    out = {}
+    for directory, measurement_dict in dir_dict.items():
+        out[directory] = {}
+        for file_key, file_path in measurement_dict.items():
+            measurement = results[file_path]
+            if isinstance(measurement, Exception):
+                errors.append((file_path, measurement))
+            else:
+                out[directory][file_key] = {data_type: measurement}
+
+    return out
+
+
+# parse a single file, returning instead of raising the exception if catch is True. Module level so it can be
+# sent to worker processes.
+def _try_read(file_path, file_format=None, catch=False):
+    try:
+        return _read_file(file_path, file_format)
+    except Exception as error:
+        if not catch:
+            raise
+        return error
+
+
+# parse a single file into a Measurement. With file_format="pulse" the file is read by read_pulse_csv (straight
+# into the column array, without a data frame), falling back to pandas if it does not validate as a pulse file.
+@instrument
+def _read_file(file_path, file_format=None):
+    if file_format == "pulse":
+        try:
+            names, columns, _, _ = read_pulse_csv(file_path)
+        except ValueError:
+            return Measurement.from_frame(pd.read_csv(file_path))
+        return Measurement(names, columns)
+    return Measurement.from_frame(pd.read_csv(file_path))
+
+
+# fast reader for the instrument's pulse files: a header line like "Time_abs/ps, Signal 1/nA, Signal 2/nA" followed
+# by rows of comma separated floats with a uniformly sampled time in the first column.
+# Returns the column names (as pandas would read them), the values as a C-contiguous (n_columns, n_samples) array
+# of 'dtype', the time step and the sample rate. If the time unit in the header is known, time step and sample rate
+# are in s and Hz, otherwise in the units of the file.
+# Rows numpy.loadtxt cannot parse are handed to pandas, and the result is validated either way: ValueError is raised
+# for anything that does not match the layout.
+@instrument
+def read_pulse_csv(file_path, dtype=np.float64):
+    assert np.dtype(dtype).kind == "f", TypeError(f"'dtype' must be a float type. dtype = {dtype}")
+    with open(file_path) as pulse_file:
+        header = pulse_file.readline().rstrip("\r\n")
+        names = header.split(",")
+        if len(names) < 2 or any(name.strip() == "" or '"' in name for name in names):
+            raise ValueError(f"Unexpected header in pulse file {file_path}: {header!r}")
+        try:
+            values = np.loadtxt(pulse_file, delimiter=",", dtype=np.float64, ndmin=2)
+        except ValueError:
+            # unusual number formats, missing values, ...: let pandas decide and validate its result below.
+            pulse_file.seek(0)
+            frame = pd.read_csv(pulse_file)
+            if not all(np.issubdtype(column_dtype, np.number) for column_dtype in frame.dtypes):
+                raise ValueError(f"Non numeric columns in pulse file {file_path}.")
+            values = frame.to_numpy(dtype=np.float64)
+
+    if values.shape[1] != len(names) or values.shape[0] < 2 or not np.all(np.isfinite(values)):
+        raise ValueError(f"Pulse file {file_path} does not hold {len(names)} complete columns of finite values.")
+    steps = np.diff(values[:, 0])
+    time_step = (values[-1, 0] - values[0, 0]) / (len(values) - 1)
+    if time_step <= 0 or np.max(np.abs(steps - time_step)) > 1e-3 * time_step:
+        raise ValueError(f"Time axis of pulse file {file_path} is not uniformly sampled.")
+
+    unit = names[0].rpartition("/")[2].strip()
+    time_step *= TIME_UNITS.get(unit, 1)
+    columns = np.ascontiguousarray(values.T, dtype=dtype)
+    return names, columns, time_step, 1 / time_step
+
+
+# content hash of a frame (values, index and column names), used to detect in-place edits.
+def _fingerprint(frame):
+    digest = hashlib.sha1(pd.util.hash_pandas_object(frame, index=True).to_numpy().tobytes())
+    digest.update(repr(list(frame.columns)).encode())
+    return digest.hexdigest()
+
+
+# write a frame to file_path through a temporary file (store.write_atomic), so readers never see a partial file.
+@instrument
+def _write_csv_atomic(frame, file_path, compression=None):
+    if compression == "zip":  # name the archive member after the target, not the temporary file
+        compression = {"method": "zip", "archive_name": os.path.basename(file_path)[:-len(".zip")]}
+    store.write_atomic(file_path, lambda file: frame.to_csv(path_or_buf=file, compression=compression))
+
+
+# stat record of a data file, used by DataSet.refresh to find new and changed files.
+def _file_record(file_path, dir_key, meas_key, file_hash=None):
+    stat = os.stat(file_path)
+    return {"dir": dir_key, "measurement": meas_key, "mtime": stat.st_mtime_ns, "size": stat.st_size,
+            "hash": file_hash}
+
+
+@instrument
+def _file_hash(file_path):
+    digest = hashlib.sha1()
+    with open(file_path, "rb") as data_file:
+        for chunk in iter(lambda: data_file.read(2 ** 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# compact record of one data file or entry: the columns as a single C-contiguous (n_columns, n_samples) array, so
+# each column is a contiguous row, plus the column names and the index (None for the default range index).
+# A DataFrame sharing the same memory is only built on request by frame(). From then on that frame holds the data,
+# so edits made through it persist. Frames whose columns have different dtypes cannot share one array and are held
+# as they are.
+class Measurement:
+    __slots__ = ("_columns", "_values", "_index", "_frame")
+
+    def __init__(self, columns, values, index=None):
+        values = np.asarray(values)
+        assert values.ndim == 2, ValueError(f"'values' must be a (n_columns, n_samples) array. values.ndim = "
+                                            f"{values.ndim}")
+        assert len(columns) == len(values), ValueError(f"Got {len(columns)} column names for {len(values)} columns.")
+        assert index is None or len(index) == values.shape[1], ValueError("'index' does not match the number of "
+                                                                          "samples.")
+        self._columns = tuple(columns)
+        self._values = np.ascontiguousarray(values)
+        self._index = index
+        self._frame = None
+
+    # compact the columns of 'frame' into one array (a view where pandas already holds them as a single block).
+    # With keep_frame=True, or if the dtypes of the columns differ, the frame itself is kept and returned by frame().
+    @classmethod
+    def from_frame(cls, frame, keep_frame=False):
+        assert isinstance(frame, pd.DataFrame), TypeError(f"'frame' must be a DataFrame. type(frame) = {type(frame)}")
+        if keep_frame or not _is_compact(frame):
+            measurement = cls.__new__(cls)
+            measurement._columns = measurement._values = measurement._index = None
+            measurement._frame = frame
+            return measurement
+        return cls(frame.columns, frame.to_numpy().T, None if _is_default_index(frame.index) else frame.index)
+
+    @property
+    def columns(self):
+        return self._columns if self._frame is None else tuple(self._frame.columns)
+
+    # (n_columns, n_samples) array of the values. A copy once the frame holds mixed dtypes.
+    @property
+    def values(self):
+        if self._frame is None:
+            return self._values
+        return np.ascontiguousarray(self._frame.to_numpy().T)
+
+    @property
+    def index(self):
+        if self._frame is None:
+            return self._index
+        return None if _is_default_index(self._frame.index) else self._frame.index
+
+    # a single column by name or position, without building a frame.
+    def column(self, key):
+        if self._frame is not None:
+            return (self._frame.iloc[:, key] if isinstance(key, (int, np.integer)) else self._frame[key]).to_numpy()
+        return self._values[key if isinstance(key, (int, np.integer)) else self._columns.index(key)]
+
+    # the DataFrame of this measurement, built once and kept.
+    def frame(self):
+        if self._frame is None:
+            self._frame = self.to_frame()
+            self._columns = self._values = self._index = None
+        return self._frame
+
+    # a DataFrame on the same memory, without keeping it (see frame).
+    def to_frame(self):
+        if self._frame is not None:
+            return self._frame
+        return pd.DataFrame(self._values.T, columns=list(self._columns), index=self._index, copy=False)
+
+    @property
+    def nbytes(self):
+        if self._frame is not None:  # only object columns need the (slow) deep inspection
+            return int(self._frame.memory_usage(index=True, deep=any(self._frame.dtypes == object)).sum())
+        return self._values.nbytes + (0 if self._index is None else int(self._index.memory_usage()))
+
+    def __len__(self):
+        return self._values.shape[1] if self._frame is None else len(self._frame)
+
+    # content hash of values, index and column names, used to detect in-place edits. Equal for equal content
+    # whether or not the frame was built.
+    def fingerprint(self):
+        if self._frame is not None and not _is_compact(self._frame):
+            return _fingerprint(self._frame)
+        values, index = self.values, self.index
+        digest = hashlib.sha1(f"{values.dtype.str}{values.shape}{list(self.columns)}".encode())
+        digest.update(values.data if values.flags.c_contiguous else np.ascontiguousarray(values).data)
+        if index is not None:
+            digest.update(pd.util.hash_pandas_object(index).to_numpy().tobytes())
+        return digest.hexdigest()
+
+    def __repr__(self):
+        return f"{type(self).__name__}(columns={list(self.columns)}, n_samples={len(self)})"
+
+
+# whether all columns of a frame fit into one plain numpy array.
+def _is_compact(frame):
+    dtypes = set(frame.dtypes)
+    return frame.shape[1] > 0 and len(dtypes) == 1 and isinstance(frame.dtypes.iloc[0], np.dtype) and \
+        frame.dtypes.iloc[0].kind in "biufc"
+
+
+def _is_default_index(index):
+    return isinstance(index, pd.RangeIndex) and index.start == 0 and index.step == 1 and index.name is None
+
+
+# least recently used store of parsed files, bounded by the memory footprint of the measurements it holds. The most
+# recently used measurement is always kept, even if it alone exceeds the budget.
+class _FrameCache:
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES):
+        assert isinstance(max_bytes, (int, np.integer)) and max_bytes >= 0, \
+            ValueError(f"'max_bytes' must be a non-negative integer. max_bytes = {max_bytes}")
+        self.max_bytes = max_bytes
+        self.n_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._frames = OrderedDict()  # file_path -> (measurement, size in bytes)
+
+    def __len__(self):
+        return len(self._frames)
+
+    def __contains__(self, file_path):
+        return file_path in self._frames
+
+    def get(self, entry):
+        file_path = entry.file_path
+        if file_path in self._frames:
+            self.hits += 1
+            self._frames.move_to_end(file_path)
+            return self._frames[file_path][0]
+
+        self.misses += 1
+        measurement = entry.load()
+        size = measurement.nbytes
+        self._frames[file_path] = (measurement, size)
+        self.n_bytes += size
+        while self.n_bytes > self.max_bytes and len(self._frames) > 1:
+            _, (_, evicted_size) = self._frames.popitem(last=False)
+            self.n_bytes -= evicted_size
+        return measurement
+
+    def peek(self, entry):
+        measurement_and_size = self._frames.get(entry.file_path)
+        return None if measurement_and_size is None else measurement_and_size[0]
+
+    def discard(self, file_path):
+        if file_path in self._frames:
+            self.n_bytes -= self._frames.pop(file_path)[1]
+
+    def clear(self):
+        self._frames.clear()
+        self.n_bytes = 0
+
+
+# placeholder for a file which is parsed on first access.
+class _Unparsed:
+    __slots__ = ("file_path", "file_format")
+
+    def __init__(self, file_path, file_format=None):
+        self.file_path = file_path
+        self.file_format = file_format
+
+    def load(self):
+        return _read_file(self.file_path, self.file_format)
+
+
+# placeholder for an entry of a binary store (see DataSet.save_to_binary). Arrays are memory-mapped copy-on-write,
+# so only the entries accessed are paged in, and edits never reach the store. Entries stored as one block of
+# values become a Measurement on the mapped block without any copy.
+class _Stored(_Unparsed):
+    __slots__ = ("columns", "index", "layout")
+
+    def __init__(self, entry_path, columns, index, layout="columns"):
+        super().__init__(entry_path, "binary")
+        self.columns = columns
+        self.index = index
+        self.layout = layout
+
+    def load(self):
+        if "range" in self.index:
+            index = pd.RangeIndex(*self.index["range"], name=self.index["name"])
+        else:
+            index = pd.Index(_load_column(self.file_path + "/index.npy"), name=self.index["name"])
+        if self.layout == "block":
+            return Measurement(self.columns, _load_column(self.file_path + "/values.npy"),
+                               None if _is_default_index(index) else index)
+        arrays = {i: _load_column(self.file_path + f"/{i}.npy") for i in range(len(self.columns))}
+        frame = pd.DataFrame(arrays, index=index)
+        frame.columns = self.columns
+        return Measurement.from_frame(frame)
+
+
+def _save_column(file_path, array):
+    np.save(file_path, np.ascontiguousarray(array), allow_pickle=array.dtype.hasobject)
+
+
+def _load_column(file_path):
+    try:
+        return np.load(file_path, mmap_mode="c")
+    except ValueError:  # object columns are pickled and cannot be mapped
+        return np.load(file_path, allow_pickle=True)
+
+
+# one level of DataSet.data, a dict which reports added and removed keys to its data set (so the key index can be
+# cached between changes).
+class _Level(MutableMapping):
+    __slots__ = ("_items", "_on_change")
+
+    def __init__(self, on_change, items=None):
+        self._on_change = on_change
+        self._items = dict(items or {})
+
+    def __getitem__(self, key):
+        return self._items[key]
+
+    def __setitem__(self, key, value):
+        if key not in self._items:
+            self._on_change()
+        self._items[key] = value
+
+    def __delitem__(self, key):
+        del self._items[key]
+        self._on_change()
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def __len__(self):
+        return len(self._items)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({list(self._items)})"
+
+
+# type_key -> frame mapping of a single measurement. Entries are held as Measurements and their frames are built on
+# access. Entries backed by a file of a lazy DataSet are parsed through the shared cache when accessed, and
+# transparently re-parsed after eviction. Frames set directly are kept as they are and never evicted.
+class _Entries(_Level):
+    __slots__ = ("_cache",)
+
+    def __init__(self, on_change, cache=None, entries=None):
+        super().__init__(on_change, entries)
+        self._cache = cache
+
+    def __getitem__(self, type_key):
+        return self.measurement(type_key).frame()
+
+    def __setitem__(self, type_key, frame):
+        if isinstance(frame, pd.DataFrame):
+            frame = Measurement.from_frame(frame, keep_frame=True)
+        assert isinstance(frame, (Measurement, _Unparsed)), TypeError("Entries must be DataFrame or Measurement. "
+                                                                      f"type(entry) = {type(frame)}")
+        super().__setitem__(type_key, frame)
+
+    # the Measurement of an entry, parsing it if needed.
+    def measurement(self, type_key):
+        entry = self._items[type_key]
+        if isinstance(entry, _Unparsed):
+            return self._cache.get(entry)
+        return entry
+
+    # the Measurement of an entry if it is in memory, else None (without parsing).
+    def get_loaded(self, type_key):
+        entry = self._items[type_key]
+        if isinstance(entry, _Unparsed):
+            return self._cache.peek(entry)
+        return entry
+
+
+# With lazy=True only the directory tree is indexed on construction. Files are parsed on first access through
+# data[dir][meas][type] and kept in a least recently used cache of at most cache_bytes bytes.
+# workers (and processes) spread loading over a pool, see _load. Files that cannot be parsed are skipped with a
+# warning and listed in load_errors. file_format="pulse" reads the files with read_pulse_csv.
+# file_index records path, mtime, size and hash of every loaded file for refresh. If index_path is given, the index is
+# persisted there, eagerly loaded files are hashed on construction and hashes of unchanged files are carried over from
+# an earlier session. Without index_path (and for lazy sets) files are only hashed when refresh reloads them, so until
+# then a touched file counts as modified.
 class DataSet:
-    def __init__(self, data_directory, data_type):
+    @instrument
+    def __init__(self, data_directory, data_type, lazy=False, cache_bytes=DEFAULT_CACHE_BYTES, workers=None,
+                 processes=False, file_format=None, index_path=None):
         assert isinstance(data_directory, str), TypeError("'data_directory' must be string. type(data_directory) = "
                                                           f"{type(data_directory)}.")
         assert isinstance(data_type, str), TypeError("'data_type' must be string. This option indicates the nature of "
                                                      "the data contained in the directory. E.g. 'spectral' or 'time "
                                                      f"series'. type(data_type) = {type(data_type)}.")
+        assert isinstance(lazy, bool), TypeError(f"'lazy' must be boolean. type(lazy) = {type(lazy)}.")
+        assert file_format in FILE_FORMATS, ValueError("'file_format' option invalid. Use any of: "
+                                                       + ", ".join(map(str, FILE_FORMATS)))
+        assert isinstance(index_path, str) or index_path is None, TypeError("'index_path' must be str or None. "
+                                                                            f"type(index_path) = {type(index_path)}")
 
-        data = _load(data_directory, data_type)
+        if workers is None:
+            file_tree = _index(data_directory)
+        else:
+            with ThreadPoolExecutor(workers) as thread_pool:
+                file_tree = _index(data_directory, thread_pool)
+
+        self._keys = None
+        self._entries = None
+        load_errors = []
+        if lazy:
+            cache = _FrameCache(cache_bytes)
+            parsed = {directory: {file_key: {data_type: _Unparsed(file_path, file_format)}
+                                  for file_key, file_path in measurement_dict.items()}
+                      for directory, measurement_dict in file_tree.items()}
+        else:
+            cache = None
+            parsed = _parse(file_tree, data_type, workers, processes, load_errors, file_format)
+        data = self._tree(parsed, cache)
+        if load_errors:
+            warnings.warn(f"{len(load_errors)} file(s) could not be loaded and were skipped, see "
+                          f"DataSet.load_errors. First failure: {load_errors[0][0]}: {load_errors[0][1]}")
+
+        # hashes are only needed to tell a touched file from a changed one, so they are computed right away only for a
+        # persisted index of an eager set, otherwise refresh computes them when it reloads a file
+        hash_now = index_path is not None and not lazy
+        failed = {file_path for file_path, _ in load_errors}
+        file_index = {}
+        for directory, measurement_dict in file_tree.items():
+            for file_key, file_path in measurement_dict.items():
+                if file_path not in failed:
+                    file_index[directory + "/" + os.path.basename(file_path)] = _file_record(
+                        file_path, directory, file_key, _file_hash(file_path) if hash_now else None)
 
         self.data = data
+        self.lazy = lazy
+        self.cache = cache
+        self.load_errors = load_errors
         self.data_path = data_directory
-        self.keys = self.get_keys()
+        self.data_type = data_type
+        self.file_format = file_format
+        self.file_index = file_index
+        self.index_path = index_path
+        self._dirty = set()
+        self._written = {}  # absolute output path -> {(dir, meas, type): fingerprint when written}
+
+        if index_path is not None:
+            if os.path.exists(index_path):
+                with open(index_path) as index_file:
+                    persisted = json.load(index_file)["files"]
+                for relative_path, record in file_index.items():
+                    old_record = persisted.get(relative_path)
+                    if old_record is not None and (old_record["mtime"], old_record["size"]) == \
+                            (record["mtime"], record["size"]):
+                        record["hash"] = record["hash"] or old_record["hash"]
+            self.save_index()
+
+    # write the file index to 'path' (default: index_path) as JSON.
+    @instrument
+    def save_index(self, path=None):
+        path = self.index_path if path is None else path
+        assert isinstance(path, str), TypeError(f"Index path must be str. type(path) = {type(path)}")
+        index = {"version": INDEX_FORMAT_VERSION, "data_path": self.data_path, "data_type": self.data_type,
+                 "files": self.file_index}
+        with open(path, "w") as index_file:
+            json.dump(index, index_file, indent=1)
+
+    # bring the data set up to date with its directory: parse new files and files whose size, mtime and content hash
+    # changed, and drop the entries of deleted files. Only the data_type entries backed by files are touched, entries
+    # added with add_entry are left alone. Returns the changes as
+    # {"added": [...], "modified": [...], "removed": [...], "failed": [...]} lists of (dir_key, meas_key).
+    # Files that fail to parse are listed under "failed" and in load_errors, and retried on the next refresh.
+    @instrument
+    def refresh(self, workers=None, processes=False):
+        report = {"added": [], "modified": [], "removed": [], "failed": []}
+        file_tree = _index(self.data_path)
 
+        changed_tree = {}
+        changes = {}  # file_path -> (status, relative path, new index record)
+        on_disk = set()
+        for directory, measurement_dict in file_tree.items():
+            for file_key, file_path in measurement_dict.items():
+                relative_path = directory + "/" + os.path.basename(file_path)
+                on_disk.add(relative_path)
+                old_record = self.file_index.get(relative_path)
+                record = _file_record(file_path, directory, file_key)
+                if old_record is not None:
+                    if (record["mtime"], record["size"]) == (old_record["mtime"], old_record["size"]):
+                        continue
+                    record["hash"] = _file_hash(file_path)
+                    if record["hash"] == old_record["hash"]:  # touched, but unchanged
+                        self.file_index[relative_path] = record
+                        continue
+                else:
+                    record["hash"] = _file_hash(file_path)
+                changed_tree.setdefault(directory, {})[file_key] = file_path
+                changes[file_path] = ("added" if old_record is None else "modified", relative_path, record)
+
+        for relative_path in [path for path in self.file_index if path not in on_disk]:
+            record = self.file_index.pop(relative_path)
+            self._drop_file_entry(record["dir"], record["measurement"], self.data_path + "/" + relative_path)
+            report["removed"].append((record["dir"], record["measurement"]))
+
+        errors = []
+        if self.lazy:
+            for file_path in changes:
+                self.cache.discard(file_path)
+            parsed = {directory: {file_key: {self.data_type: _Unparsed(file_path, self.file_format)}
+                                  for file_key, file_path in measurement_dict.items()}
+                      for directory, measurement_dict in changed_tree.items()}
+        else:
+            parsed = _parse(changed_tree, self.data_type, workers, processes, errors, self.file_format)
+
+        failed = {file_path for file_path, _ in errors}
+        for directory, measurement_dict in changed_tree.items():
+            for file_key, file_path in measurement_dict.items():
+                status, relative_path, record = changes[file_path]
+                if file_path in failed:
+                    self.file_index.pop(relative_path, None)
+                    report["failed"].append((directory, file_key))
+                    continue
+                self._entries_of(directory, file_key)[self.data_type] = parsed[directory][file_key][self.data_type]
+                self._dirty.add((directory, file_key, self.data_type))
+                self.file_index[relative_path] = record
+                report[status].append((directory, file_key))
+
+        if errors:
+            self.load_errors.extend(errors)
+            warnings.warn(f"{len(errors)} file(s) could not be loaded during refresh, see DataSet.load_errors.")
+        if self.index_path is not None:
+            self.save_index()
+        return report
+
+    def _drop_file_entry(self, dir_key, meas_key, file_path):
+        self._dirty.discard((dir_key, meas_key, self.data_type))
+        if self.cache is not None:
+            self.cache.discard(file_path)
+        entries = self.data.get(dir_key, {}).get(meas_key)
+        if entries is None:
+            return
+        if self.data_type in entries:  # not pop, which would parse a lazy entry first
+            del entries[self.data_type]
+        if not entries:
+            del self.data[dir_key][meas_key]
+            if not self.data[dir_key]:
+                del self.data[dir_key]
+
+    # the entry mapping of a measurement, created (with its directory) if missing.
+    def _entries_of(self, dir_key, meas_key):
+        if dir_key not in self.data:
+            self.data[dir_key] = _Level(self._invalidate_keys)
+        if meas_key not in self.data[dir_key]:
+            self.data[dir_key][meas_key] = _Entries(self._invalidate_keys, self.cache)
+        return self.data[dir_key][meas_key]
+
+    # wrap a {dir: {meas: {type: entry}}} dict into the levels of DataSet.data.
+    def _tree(self, nested, cache):
+        return _Level(self._invalidate_keys,
+                      {dir_key: _Level(self._invalidate_keys,
+                                       {meas_key: _Entries(self._invalidate_keys, cache, entries)
+                                        for meas_key, entries in measurements.items()})
+                       for dir_key, measurements in nested.items()})
+
+    def _invalidate_keys(self):
+        self._keys = None
+        self._entries = None
+
+    # add an entry from a tuple of (column title, column array) pairs. Columns of one numeric dtype are stored as a
+    # single array, others as a frame.
+    @instrument
     def add_entry(self, dir_key, meas_key, type_key, data_packet):
         assert isinstance(data_packet, tuple), TypeError("data_packet should have type tuple."
                                                          f" type(data_packet) = {type(data_packet)}")
@@ -60,60 +665,206 @@ class DataSet:
                                                                                f" type(col_array) = {type(col_array)}")
             df_dict[col_title] = col_array
 
-        df = pd.DataFrame(df_dict)
+        arrays = [np.asarray(col_array) for col_array in df_dict.values()]
+        if arrays and all(array.ndim == 1 and array.shape == arrays[0].shape and array.dtype == arrays[0].dtype
+                          for array in arrays) and arrays[0].dtype.kind in "biufc":
+            measurement = Measurement(list(df_dict), np.stack(arrays))
+        else:
+            measurement = Measurement.from_frame(pd.DataFrame(df_dict))
 
-        if dir_key not in self.data.keys():
-            self.data[dir_key] = {}
-        if meas_key not in self.data[dir_key].keys():
-            self.data[dir_key][meas_key] = {}
-        if type_key not in self.data[dir_key][meas_key].keys():
-            self.data[dir_key][meas_key][type_key] = {}
+        self._entries_of(dir_key, meas_key)[type_key] = measurement
+        self._dirty.add((dir_key, meas_key, type_key))
 
-        self.data[dir_key][meas_key][type_key] = df
+    # write every entry under path/dir/meas/type/ as one values.npy array, or one .npy file per column for entries
+    # with mixed column dtypes, described by a JSON manifest holding the key hierarchy, column names and index of
+    # each entry. Reopen with DataSet.from_binary.
+    @instrument
+    def save_to_binary(self, path=None):
+        assert isinstance(path, str) or path is None, TypeError(f"Target path must be str or None. type(path) = {type(path)}")
+        if path is None:
+            path = self.data_path + "_binary"
+            print(f"Target output set to {path}")
 
-    def get_keys(self):
-        out = {}
+        entries = []
         for dir_key in self.data:
-            out[dir_key] = {}
-            for measurement_key in self.data[dir_key]:
-                out[dir_key][measurement_key] = {}
-                for type_key in self.data[dir_key][measurement_key]:
-                    out[dir_key][measurement_key] = type_key
+            for meas_key in self.data[dir_key]:
+                for type_key in self.data[dir_key][meas_key]:
+                    measurement = self.data[dir_key][meas_key].measurement(type_key)
+                    entry_path = "/".join((path, dir_key, meas_key, type_key))
+                    os.makedirs(entry_path, exist_ok=True)
 
-        return out
+                    frame = measurement.to_frame()
+                    if _is_compact(frame):
+                        layout = "block"
+                        _save_column(entry_path + "/values.npy", measurement.values)
+                    else:
+                        layout = "columns"
+                        for i in range(frame.shape[1]):
+                            _save_column(entry_path + f"/{i}.npy", frame.iloc[:, i].to_numpy())
+                    if isinstance(frame.index, pd.RangeIndex):
+                        index = {"name": frame.index.name,
+                                 "range": [frame.index.start, frame.index.stop, frame.index.step]}
+                    else:
+                        index = {"name": frame.index.name}
+                        _save_column(entry_path + "/index.npy", frame.index.to_numpy())
 
-    def save_to_csv(self, path=None):
+                    entries.append({"dir": dir_key, "measurement": meas_key, "type": type_key,
+                                    "columns": list(frame.columns), "index": index, "layout": layout})
+
+        manifest = {"version": BINARY_FORMAT_VERSION, "data_path": self.data_path, "data_type": self.data_type,
+                    "file_format": self.file_format, "file_index": self.file_index, "entries": entries}
+        with open(path + "/" + BINARY_MANIFEST, "w") as manifest_file:
+            json.dump(manifest, manifest_file, indent=1)
+
+    # open a store written by save_to_binary. The result is a lazy DataSet: entries are read from their memory-mapped
+    # columns on first access and cached like parsed files. The file index is restored, so refresh picks up files
+    # added to the original directory since the store was written.
+    @classmethod
+    @instrument
+    def from_binary(cls, path, cache_bytes=DEFAULT_CACHE_BYTES):
+        assert isinstance(path, str), TypeError(f"'path' must be string. type(path) = {type(path)}.")
+        with open(path + "/" + BINARY_MANIFEST) as manifest_file:
+            manifest = json.load(manifest_file)
+        assert manifest["version"] in range(1, BINARY_FORMAT_VERSION + 1), \
+            ValueError(f"Unsupported binary format version {manifest['version']}.")
+
+        cache = _FrameCache(cache_bytes)
+        data = {}
+        for entry in manifest["entries"]:  # version 1 stores have no layout and always store columns
+            dir_key, meas_key, type_key = entry["dir"], entry["measurement"], entry["type"]
+            entry_path = "/".join((path, dir_key, meas_key, type_key))
+            data.setdefault(dir_key, {}).setdefault(meas_key, {})[type_key] = \
+                _Stored(entry_path, entry["columns"], entry["index"], entry.get("layout", "columns"))
+
+        data_set = cls.__new__(cls)
+        data_set._keys = None
+        data_set._entries = None
+        data_set.data = data_set._tree(data, cache)
+        data_set.lazy = True
+        data_set.cache = cache
+        data_set.load_errors = []
+        data_set.data_path = manifest["data_path"]
+        data_set.data_type = manifest.get("data_type")  # not recorded by early version 1 stores
+        data_set.file_format = manifest.get("file_format")
+        data_set.file_index = manifest.get("file_index", {})
+        data_set.index_path = None
+        data_set._dirty = set()
+        data_set._written = {}
+        return data_set
+
+    # {dir_key: {meas_key: [type_key, ...]}}. The tree walk is kept until keys are added or removed, callers get a
+    # copy of it to modify as they like.
+    def get_keys(self):
+        if self._keys is None:
+            self._keys = {dir_key: {meas_key: tuple(entries) for meas_key, entries in measurements.items()}
+                          for dir_key, measurements in self.data.items()}
+        return {dir_key: {meas_key: list(type_keys) for meas_key, type_keys in measurements.items()}
+                for dir_key, measurements in self._keys.items()}
+
+    @property
+    def keys(self):
+        return self.get_keys()
+
+    # structured array of all (dir, measurement, type) keys, for selecting entries by vectorised comparison, e.g.
+    # data_set.entries[data_set.entries["type"] == "time"]. Kept until keys are added or removed, hence read-only.
+    @property
+    def entries(self):
+        if self._entries is None:
+            keys = [(dir_key, meas_key, type_key) for dir_key, measurements in self.get_keys().items()
+                    for meas_key, type_keys in measurements.items() for type_key in type_keys]
+            width = max((len(key) for row in keys for key in row), default=1)
+            self._entries = np.array(keys, dtype=[("dir", f"U{width}"), ("measurement", f"U{width}"),
+                                                  ("type", f"U{width}")])
+            self._entries.flags.writeable = False
+        return self._entries
+
+    # the Measurement of an entry, without building its frame.
+    def measurement(self, dir_key, meas_key, type_key):
+        return self.data[dir_key][meas_key].measurement(type_key)
+
+    # iterate ((dir_key, meas_key, type_key), Measurement) over the entries matching the given keys (None matches
+    # any), in the order of the data set.
+    def measurements(self, dir_key=None, meas_key=None, type_key=None):
+        selected = self.entries
+        for field, key in (("dir", dir_key), ("measurement", meas_key), ("type", type_key)):
+            if key is not None:
+                selected = selected[selected[field] == key]
+        for row in selected:
+            key = tuple(str(value) for value in row)
+            yield key, self.measurement(*key)
+
+    # mark an entry as changed, so the next incremental save_to_csv writes it. add_entry and refresh mark their
+    # entries, in-place edits of frames are detected by save_to_csv itself.
+    def mark_dirty(self, dir_key, meas_key, type_key):
+        assert type_key in self.data[dir_key][meas_key], KeyError(f"No entry {dir_key}/{meas_key}/{type_key}.")
+        self._dirty.add((dir_key, meas_key, type_key))
+
+    # write every entry to path/dir/meas/meas_type.csv. Files are written atomically (temporary file and rename) on
+    # a pool of 'workers' threads, optionally compressed with compression="gzip", "bz2", "xz" or "zip" (the extension
+    # is appended to ".csv").
+    # With incremental=True, entries this data set wrote to the same path before are only written again if they were
+    # marked dirty or their content changed since. 'overwrite' decides what happens to other files which already
+    # exist: "error" raises FileExistsError before anything is written, "skip" keeps them and "overwrite" replaces
+    # them. Returns {"written": [...], "skipped": [...], "unchanged": [...]} lists of file paths.
+    @instrument
+    def save_to_csv(self, path=None, overwrite="error", incremental=True, workers=None, compression=None):
         assert isinstance(path, str) or path is None, TypeError(f"Target path must be str or None. type(path) = {type(path)}")
+        assert overwrite in OVERWRITE_POLICIES, ValueError("'overwrite' option invalid. Use any of: "
+                                                           + ", ".join(OVERWRITE_POLICIES))
+        assert compression in COMPRESSION_EXTENSIONS, ValueError("'compression' option invalid. Use any of: "
+                                                                 + ", ".join(map(str, COMPRESSION_EXTENSIONS)))
+        assert workers is None or (isinstance(workers, (int, np.integer)) and workers > 0), \
+            ValueError(f"'workers' must be a positive integer or None. workers = {workers}")
         if path is None:
             path = self.data_path + "_output"
             print(f"Target output set to {path}")
 
-        data = self.data
-        if not os.path.exists(path):
-            os.makedirs(path)
+        written = self._written.setdefault(os.path.abspath(path), {})
+        report = {"written": [], "skipped": [], "unchanged": []}
+        jobs = []
+        for directory in self.data:
+            for data_set in self.data[directory]:
+                entries = self.data[directory][data_set]
+                for data_type in entries:
+                    key = (directory, data_set, data_type)
+                    file_path = "/".join((path, directory, data_set, data_set + '_' + data_type + ".csv"
+                                          + COMPRESSION_EXTENSIONS[compression]))
+                    if key in written and incremental and key not in self._dirty and os.path.exists(file_path):
+                        # entries which are not in memory cannot have been edited since they were written
+                        measurement = entries.get_loaded(data_type)
+                        if measurement is None or measurement.fingerprint() == written[key]:
+                            report["unchanged"].append(file_path)
+                            continue
+                    elif key not in written and os.path.exists(file_path):
+                        if overwrite == "error":
+                            raise FileExistsError(f"{file_path} exists. Use overwrite='overwrite' or 'skip'.")
+                        if overwrite == "skip":
+                            report["skipped"].append(file_path)
+                            continue
+                    jobs.append((key, file_path))
+
+        def write(measurement, file_path):
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            _write_csv_atomic(measurement.to_frame(), file_path, compression)
+            return measurement.fingerprint()
+
+        if workers is None:
+            fingerprints = [write(self.measurement(*key), file_path) for key, file_path in jobs]
         else:
-            if len(os.listdir(path)) > 0:
-                user_input = None
-                print("Target directory is non-empty. Continuing risks overwriting data in "
-                      "directories of the same name.")
-                sleep(0.01)
-                while user_input not in ("y", "n"):
-                    user_input = input("Continue? (y/n):  ").lower()
-                if user_input == 'n':
-                    sleep(0.01)
-                    print("Canceled. No data saved.")
-                    return
-
-        for directory in data:
-            dir_path = path + '/' + directory
-            if not os.path.exists(dir_path):
-                os.makedirs(dir_path)
-
-            for data_set in data[directory]:
-                data_path = dir_path + '/' + data_set
-                if not os.path.exists(data_path):
-                    os.makedirs(data_path)
-
-                for data_type in data[directory][data_set]:
-                    file_path = data_path + '/' + data_set + '_' + data_type + ".csv"
-                    data[directory][data_set][data_type].to_csv(path_or_buf=file_path)
+            # measurements are fetched on this thread (the lazy cache is not thread safe), with at most 2 * workers
+            # measurements in flight to respect the cache budget of lazy data sets.
+            with ThreadPoolExecutor(workers) as thread_pool:
+                futures, pending = [], set()
+                for key, file_path in jobs:
+                    if len(pending) >= 2 * workers:
+                        _, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    future = thread_pool.submit(write, self.measurement(*key), file_path)
+                    futures.append(future)
+                    pending.add(future)
+                fingerprints = [future.result() for future in futures]
+
+        for fingerprint, (key, file_path) in zip(fingerprints, jobs):
+            written[key] = fingerprint
+            self._dirty.discard(key)
+            report["written"].append(file_path)
+        return report
@@ -5,11 +5,17 @@ import numpy as np
 def linear_fit(xs, ys):
     # solving the linear model: Y = a0 + a1*X + epsilon,
     # where epsilon in (x in R, x > 0)
+    # ys may hold several series along its last axis, sharing xs. Each series is fitted independently, and the
+    # sums below are taken per row, so a batched fit gives exactly the same parameters as fitting row by row.
+    xs = np.asarray(xs)
+    ys = np.ascontiguousarray(ys)
     X = np.vstack((np.ones(len(xs)), xs)).T
 
     # using X^T @ X @ beta = X^T @ y
     XT = np.matrix.transpose(X)
     XT_X = np.matmul(XT, X)
-    XT_ys = np.matmul(XT, ys)
-    b, a = np.matmul(np.linalg.inv(XT_X), XT_ys)
+    XT_ys = (np.sum(ys, axis=-1), np.sum(xs * ys, axis=-1))
+    XT_X_inv = np.linalg.inv(XT_X)
+    b = XT_X_inv[0, 0] * XT_ys[0] + XT_X_inv[0, 1] * XT_ys[1]
+    a = XT_X_inv[1, 0] * XT_ys[0] + XT_X_inv[1, 1] * XT_ys[1]
     return a, b
@@ -0,0 +1,258 @@
+import asyncio
+import struct
+import time
+from collections import deque
+
+import numpy as np
+
+from thzsoftware import helper as h
+from thzsoftware.tds import phase as ph
+
+# a trace on the wire: magic, number of samples (uint32) and sequence number (uint64), then the samples as
+# little-endian float64.
+FRAME_MAGIC = b"THZ1"
+FRAME_HEADER = struct.Struct("<4sIQ")
+OVERFLOW_POLICIES = ("drop_oldest", "drop_newest", "block")
+
+
+class FrameError(ValueError):
+    pass
+
+
+# the next frame of 'reader' as (sequence, trace), from 'header' if it was read already. A header with the wrong magic
+# or more than max_samples samples raises FrameError before any payload is read, the stream is then out of step
+# until resync.
+async def read_frame(reader, max_samples=None, header=None):
+    header = await reader.readexactly(FRAME_HEADER.size) if header is None else header
+    magic, n_samples, sequence = FRAME_HEADER.unpack(header)
+    if magic != FRAME_MAGIC:
+        raise FrameError(f"Not a trace frame. magic = {magic!r}")
+    if max_samples is not None and n_samples > max_samples:
+        raise FrameError(f"Frame of {n_samples} samples exceeds {max_samples}.")
+    payload = await reader.readexactly(8 * n_samples)
+    return sequence, np.frombuffer(payload, dtype="<f8")
+
+
+# skip 'reader' to the next FRAME_MAGIC and return the header starting there. 'rejected' is the rejected header, whose
+# bytes after the first are searched as well. Nothing behind the new header is read. Raises
+# asyncio.IncompleteReadError if the stream ends first.
+async def resync(reader, rejected=b""):
+    window = rejected[1:]
+    while True:
+        start = window.find(FRAME_MAGIC)
+        if start >= 0:
+            return window[start:] + await reader.readexactly(FRAME_HEADER.size - len(window) + start)
+        # a magic cut off at the end of the window is completed byte-exactly, so no payload is read past it
+        partial = next((k for k in range(len(FRAME_MAGIC) - 1, 0, -1) if window.endswith(FRAME_MAGIC[:k])), 0)
+        if not partial:
+            break
+        window = window[-partial:] + await reader.readexactly(len(FRAME_MAGIC) - partial)
+    while True:
+        try:
+            await reader.readuntil(FRAME_MAGIC)
+            break
+        except asyncio.LimitOverrunError as error:  # no magic in the buffered bytes, drop them and read on
+            await reader.readexactly(error.consumed)
+    return FRAME_MAGIC + await reader.readexactly(FRAME_HEADER.size - len(FRAME_MAGIC))
+
+
+def encode_frame(trace, sequence):
+    trace = np.ascontiguousarray(trace, dtype="<f8")
+    return FRAME_HEADER.pack(FRAME_MAGIC, len(trace), sequence) + trace.tobytes()
+
+
+# the last 'capacity' traces in a preallocated (capacity, n_samples) array, with their running sum, so the mean
+# costs O(n_samples) per trace. The sum is recomputed exactly once per wrap against the rounding drift.
+class RingBuffer:
+    def __init__(self, capacity, n_samples):
+        assert isinstance(capacity, int) and capacity > 0, ValueError(f"'capacity' must be a positive int. "
+                                                                      f"capacity = {capacity}")
+        self.traces = np.zeros((capacity, n_samples))
+        self.count = 0  # traces pushed in total
+        self._sum = np.zeros(n_samples)
+
+    @property
+    def capacity(self):
+        return len(self.traces)
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def push(self, trace):
+        slot = self.count % self.capacity
+        self._sum += trace
+        self._sum -= self.traces[slot]
+        self.traces[slot] = trace
+        self.count += 1
+        if slot == self.capacity - 1:
+            np.sum(self.traces, axis=0, out=self._sum)
+
+    def mean(self):
+        return self._sum / max(len(self), 1)
+
+    # the traces held, oldest first.
+    def ordered(self):
+        if self.count <= self.capacity:
+            return self.traces[:self.count]
+        return np.roll(self.traces, -(self.count % self.capacity), axis=0)
+
+
+# asyncio ingest of live traces: a receiver reads frames from a stream into a queue of 'queue_size' traces, and an
+# updater moves everything queued into a RingBuffer of the last 'capacity' traces and recomputes the rolling mean, its
+# spectrum (phase.fft with 'pad') and phase.compute_phase of it, at most once per 'min_interval' seconds.
+# Backpressure: with overflow="block" the receiver stops reading while the queue is full, which throttles the sender
+# through the transport. "drop_oldest" and "drop_newest" keep reading and drop traces, counted in 'dropped'.
+# Frames of another length are counted in 'rejected', as are corrupted headers (wrong magic or more than n_samples
+# samples), after which the stream is skipped to the next frame.
+# The latency of an update is the time from the arrival of the oldest trace it includes to the end of the update.
+# on_update(ingest) is called after every update.
+class LiveIngest:
+    def __init__(self, n_samples, sample_rate, capacity=64, queue_size=16, overflow="drop_oldest", pad=None,
+                 min_interval=0., on_update=None, latency_history=1000):
+        assert overflow in OVERFLOW_POLICIES, ValueError("'overflow' option invalid. Use any of: "
+                                                         + ", ".join(OVERFLOW_POLICIES))
+        assert isinstance(queue_size, int) and queue_size > 0, ValueError(f"'queue_size' must be a positive int. "
+                                                                          f"queue_size = {queue_size}")
+        self.n_samples = n_samples
+        self.sample_rate = sample_rate
+        self.overflow = overflow
+        self.pad = pad
+        self.min_interval = min_interval
+        self.on_update = on_update
+        self.buffer = RingBuffer(capacity, n_samples)
+        self.queue_size = queue_size
+        self.received = 0
+        self.dropped = 0
+        self.rejected = 0  # frames of the wrong length or with a corrupted header
+        self.updates = 0
+        self.latencies = deque(maxlen=latency_history)
+        self.mean = None
+        self.frequencies = None
+        self.spectrum = None
+        self.norm = None
+        self.phase = None
+        self._queue = None
+
+    # ingest from 'reader' until it ends; returns stats().
+    async def run(self, reader):
+        self._queue = asyncio.Queue(self.queue_size)
+        updater = asyncio.ensure_future(self._update_loop())
+        try:
+            await self._receive(reader)
+            await self._queue.put(None)
+            await updater
+        finally:
+            updater.cancel()
+        return self.stats()
+
+    # ingest from the instrument (or serve_simulator) at host:port until it closes the connection.
+    async def run_tcp(self, host, port):
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            return await self.run(reader)
+        finally:
+            writer.close()
+
+    async def _receive(self, reader):
+        header = None
+        while True:
+            try:
+                header = await reader.readexactly(FRAME_HEADER.size) if header is None else header
+                _, trace = await read_frame(reader, self.n_samples, header)
+                header = None
+            except FrameError:
+                self.rejected += 1
+                try:
+                    header = await resync(reader, header)
+                except asyncio.IncompleteReadError:
+                    return
+                continue
+            except asyncio.IncompleteReadError:
+                return
+            if len(trace) != self.n_samples:
+                self.rejected += 1
+                continue
+            self.received += 1
+            item = (time.perf_counter(), trace)
+            if self.overflow == "block":
+                await self._queue.put(item)
+            elif not self._queue.full():
+                self._queue.put_nowait(item)
+            elif self.overflow == "drop_newest":
+                self.dropped += 1
+            else:
+                self._queue.get_nowait()
+                self._queue.put_nowait(item)
+                self.dropped += 1
+
+    async def _update_loop(self):
+        last_update = -np.inf
+        finished = False
+        while not finished:
+            item = await self._queue.get()
+            wait = last_update + self.min_interval - time.perf_counter()
+            if wait > 0 and item is not None:
+                await asyncio.sleep(wait)  # traces arriving meanwhile join this update
+            first_arrival = None
+            while True:  # everything queued goes into one update
+                if item is None:
+                    finished = True
+                else:
+                    first_arrival = item[0] if first_arrival is None else first_arrival
+                    self.buffer.push(item[1])
+                if finished or self._queue.empty():
+                    break
+                item = self._queue.get_nowait()
+            if first_arrival is not None:
+                self.update()
+                last_update = time.perf_counter()
+                self.latencies.append(last_update - first_arrival)
+                if self.on_update is not None:
+                    self.on_update(self)
+            await asyncio.sleep(0)  # give the receiver a turn
+
+    # rolling mean and spectrum of the buffer.
+    def update(self):
+        self.mean = self.buffer.mean()
+        self.frequencies, self.spectrum = ph.fft(self.mean, self.sample_rate, pad=self.pad)
+        self.norm, self.phase = ph.compute_phase(self.spectrum)
+        self.updates += 1
+
+    def stats(self):
+        latencies = np.array(self.latencies)
+        return {"received": self.received, "dropped": self.dropped, "rejected": self.rejected,
+                "updates": self.updates, "buffered": len(self.buffer),
+                "latency_mean": float(latencies.mean()) if len(latencies) else None,
+                "latency_max": float(latencies.max()) if len(latencies) else None}
+
+
+# a StreamReader of a pipe (or any file object), e.g. sys.stdin.buffer or the read end of os.pipe().
+async def open_pipe(pipe):
+    reader = asyncio.StreamReader()
+    await asyncio.get_running_loop().connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), pipe)
+    return reader
+
+
+# stand-in for the instrument: writes n_traces traces of helper.create_mock_thz_pulse to 'writer', each with noise
+# and a random shift of up to 'jitter' samples, 'rate' traces per second (as fast as the transport takes them if None).
+async def simulate(writer, n_traces, n_samples=1000, pulse_samples=200, rate=None, noise=.05, jitter=0, seed=0):
+    assert n_samples >= pulse_samples, ValueError("The pulse must fit into the trace.")
+    rng = np.random.default_rng(seed)
+    pulse = np.zeros(n_samples)
+    pulse[:pulse_samples] = h.create_mock_thz_pulse(pulse_samples)[0]
+    pulse = np.roll(pulse, (n_samples - pulse_samples) // 2)
+    start = time.perf_counter()
+    for sequence in range(n_traces):
+        trace = np.roll(pulse, rng.integers(-jitter, jitter + 1)) + noise * rng.normal(size=n_samples)
+        writer.write(encode_frame(trace, sequence))
+        await writer.drain()
+        if rate is not None:
+            await asyncio.sleep(max(0., start + (sequence + 1) / rate - time.perf_counter()))
+    writer.close()
+
+
+# serve the simulator on host:port, every client gets its own series of traces. Returns the asyncio server.
+async def serve_simulator(host="127.0.0.1", port=0, **kwargs):
+    async def handle(_, writer):
+        await simulate(writer, **kwargs)
+    return await asyncio.start_server(handle, host, port)
@@ -1,7 +1,13 @@
 import numpy as np
+import scipy.fft as ft
+from thzsoftware.profiling import instrument
+
+# below this many multiply-adds (len(base) * len(mask)) the direct sum beats the FFT round trip.
+_DIRECT_CORRELATION_LIMIT = 4096
 
 
 # shift array by num and fill with zeros
+@instrument
 def shift_array(array, shift, fill_value=0):
     assert isinstance(array, np.ndarray), TypeError("Input 'array' must be type numpy.ndarray."
                                                     f" type(array) = {type(array)}")
@@ -24,6 +30,7 @@ def shift_array(array, shift, fill_value=0):
 
 
 # polar form of complex vector:
+@instrument
 def carthesian_to_polar(complex_array, tolerance=1e-16):
     assert isinstance(complex_array, np.ndarray), TypeError("'complex_array' must be numpy.array.")
     assert isinstance(tolerance, (int, float)), TypeError("'tolerance' kwarg must be int of float. type(tolerance) = "
@@ -42,21 +49,90 @@ def carthesian_to_polar(complex_array, tolerance=1e-16):
     return r, phi
 
 
-def unwrap_angles(angles):  # by convention, we assume decreasing phase
+# by convention, we assume decreasing phase. Every angle is lowered by the smallest multiple of 2 pi that puts it at
+# or below its (unwrapped) predecessor, after the whole array is lowered by 2 pi if it starts positive. An angle that
+# has to be lowered lands exactly (angles[i - 1] - angles[i]) mod 2 pi below its predecessor, so with the cumulative
+# sum D of these drops the unwrapped phase is minimum.accumulate(angles + D) - D, which needs no loop.
+# Works along 'axis' of an N-D array. The result is written to 'out' if given (out=angles unwraps in place),
+# otherwise a new array is returned and the input is left untouched.
+@instrument
+def unwrap_angles(angles, axis=-1, out=None):
     assert isinstance(angles, (list, tuple, np.ndarray)), TypeError("Input must be array-like. type(angles) "
                                                                     f"= {type(angles)}")
-    if angles.dtype == np.int32 or angles.dtype == np.int64:
+    assert out is None or isinstance(out, np.ndarray), TypeError("'out' kwarg must be numpy.ndarray or None."
+                                                                 f" type(out) = {type(out)}")
+    angles = np.asarray(angles)
+    if not np.issubdtype(angles.dtype, np.floating):
         angles = angles.astype(np.float64)
+    if out is None:
+        out = np.empty_like(angles)
+    assert out.shape == angles.shape, ValueError(f"'out' must match input shape. out.shape = {out.shape}, "
+                                                 f"angles.shape = {angles.shape}.")
+
+    angles = np.moveaxis(angles, axis, -1)
+    drops = np.zeros(angles.shape)
+    drops[..., 1:] = np.mod(-np.diff(angles, axis=-1), 2 * np.pi)
+    np.cumsum(drops, axis=-1, out=drops)
+
+    bounds = angles + drops
+    bounds -= 2 * np.pi * (angles[..., :1] > 0)
+    np.minimum.accumulate(bounds, axis=-1, out=bounds)
+    np.subtract(bounds, drops, out=np.moveaxis(out, axis, -1))
+    return out
+
 
-    if angles[0] > 0:
-        angles -= 2 * np.pi
+# cross-correlation of base and mask along the last axis: corr[lag] = sum_j base[j] * mask[j - lag].
+# base may be a stack of traces (..., n), mask either a single trace (m,) or a stack broadcastable against base.
+# mode follows numpy.correlate: "full" returns all lags -(m - 1) .. n - 1, "same" the len(base) lags centered
+# on full and "valid" only the lags of complete overlap. method "fft" is O(n log n), "direct" sums explicitly and
+# "auto" picks direct for tiny inputs.
+@instrument
+def cross_correlate(base, mask, mode="full", method="auto"):
+    modes = ("full", "same", "valid")
+    methods = ("auto", "fft", "direct")
+    assert isinstance(base, (list, tuple, np.ndarray)), TypeError("Input 'base' must be array-like."
+                                                                  f" type(base) = {type(base)}")
+    assert isinstance(mask, (list, tuple, np.ndarray)), TypeError("Input 'mask' must be array-like."
+                                                                  f" type(mask) = {type(mask)}")
+    assert mode in modes, ValueError("'mode' option invalid. Use any of: " + ", ".join(modes))
+    assert method in methods, ValueError("'method' option invalid. Use any of: " + ", ".join(methods))
+
+    base = np.asarray(base, dtype=np.float64)
+    mask = np.asarray(mask, dtype=np.float64)
+    assert base.ndim >= 1 and mask.ndim >= 1, ValueError("Inputs must have at least one dimension.")
+    n, m = base.shape[-1], mask.shape[-1]
+    assert n > 0 and m > 0, ValueError("Inputs must be non-empty.")
+
+    if method == "auto":
+        method = "direct" if n * m <= _DIRECT_CORRELATION_LIMIT else "fft"
+
+    if method == "fft":
+        length = ft.next_fast_len(n + m - 1, real=True)
+        spectrum = ft.rfft(base, length, axis=-1) * np.conj(ft.rfft(mask, length, axis=-1))
+        circular = ft.irfft(spectrum, length, axis=-1)
+        # negative lags wrap around to the end of the circular correlation.
+        full = np.concatenate((circular[..., length - (m - 1):], circular[..., :n]), axis=-1)
+    else:
+        leading = np.broadcast_shapes(base.shape[:-1], mask.shape[:-1])
+        base_rows = np.broadcast_to(base, leading + (n,)).reshape(-1, n)
+        mask_rows = np.broadcast_to(mask, leading + (m,)).reshape(-1, m)
+        full = np.empty((base_rows.shape[0], n + m - 1))
+        for i in range(base_rows.shape[0]):
+            # numpy swaps its inputs when the second is longer; pad so the lag convention stays fixed.
+            full[i] = np.correlate(np.pad(base_rows[i], (0, max(0, m - n))), mask_rows[i], "full")[:n + m - 1]
+        full = full.reshape(leading + (n + m - 1,))
 
-    for i in range(1, len(angles)):
-        while angles[i] > angles[i - 1]:
-            angles[i] -= 2 * np.pi
-    return angles
+    lags = np.arange(-(m - 1), n)
+    if mode == "same":
+        start = (m - 1) // 2
+        return lags[start:start + n], full[..., start:start + n]
+    if mode == "valid":
+        start, stop = min(n, m) - 1, max(n, m)
+        return lags[start:stop], full[..., start:stop]
+    return lags, full
 
 
+@instrument
 def zero_crossings(input_array, find_index="before"):
     find_index = find_index.lower()
     options = ("before", "after")
@@ -0,0 +1,209 @@
+import functools
+import hashlib
+import inspect
+import os
+
+import numpy as np
+import thzsoftware
+from thzsoftware import store
+
+# set to a directory to cache the results of the memoized functions there for the whole session, optionally capped
+# by the second variable (bytes, default DEFAULT_MAX_BYTES).
+ENVIRONMENT_VARIABLE = "THZSOFTWARE_CACHE"
+MAX_BYTES_ENVIRONMENT_VARIABLE = "THZSOFTWARE_CACHE_MAX_BYTES"
+DEFAULT_MAX_BYTES = 2 ** 30
+
+_cache = None  # the active ResultCache, memoized functions only call through while it is None
+
+_SCALARS = {"int": int, "float": float, "bool": bool, "complex": complex}
+MISS = object()  # returned by ResultCache.get for results not stored
+
+
+class _Unhashable(Exception):
+    pass
+
+
+# results of function calls stored in 'directory' by the hash of the call, one .npz file per result holding every
+# returned array or scalar and their types, kept in a store.FileStore: written atomically, so concurrent processes
+# sharing the directory never read a partial result, and the least recently used results are removed once they
+# exceed max_bytes.
+class ResultCache:
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        assert isinstance(directory, str), TypeError(f"'directory' must be str. type(directory) = {type(directory)}")
+        assert isinstance(max_bytes, (int, np.integer)) and max_bytes >= 0, \
+            ValueError(f"'max_bytes' must be a non-negative integer. max_bytes = {max_bytes}")
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+        self._store = store.FileStore(directory, ".npz", int(max_bytes))
+
+    @property
+    def max_bytes(self):
+        return self._store.max_bytes
+
+    @max_bytes.setter
+    def max_bytes(self, max_bytes):
+        self._store.max_bytes = max_bytes
+
+    @property
+    def n_bytes(self):
+        return self._store.n_bytes
+
+    @property
+    def evictions(self):
+        return self._store.evictions
+
+    # the stored result of 'key', or MISS.
+    def get(self, key):
+        stored = self._store.read(key, _load_result)
+        if stored is None:
+            self.misses += 1
+            return MISS
+        self.hits += 1
+        types, single, values = stored
+        values = [_SCALARS[kind](value) if kind in _SCALARS else value[()] if kind == "scalar" else
+                  None if kind == "none" else value for kind, value in zip(types, values)]
+        return values[0] if single else tuple(values)
+
+    # store 'result' (an array, a scalar, None or a tuple of them) under 'key'. Other results are not stored.
+    def put(self, key, result):
+        single = not isinstance(result, tuple)
+        values = (result,) if single else result
+        types = [_kind(value) for value in values]
+        if None in types:
+            return False
+        arrays = [np.asarray(0 if value is None else value) for value in values]
+        self._store.write(key, lambda file: np.savez(file, *arrays, types=np.array(types, dtype=str),
+                                                     single=single))
+        return True
+
+    # remove least recently used results until the directory holds at most store.LOW_WATER * max_bytes.
+    def evict(self):
+        self._store.evict()
+
+    def clear(self):
+        self._store.clear()
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "bytes": self.n_bytes,
+                "entries": len(self._store)}
+
+
+# (types, single, values) of a stored result, read completely before the file is closed.
+def _load_result(path):
+    with np.load(path, allow_pickle=False) as stored:
+        types = [str(kind) for kind in stored["types"]]
+        return types, bool(stored["single"]), [stored[f"arr_{i}"] for i in range(len(types))]
+
+
+def _kind(value):
+    if value is None:
+        return "none"
+    if isinstance(value, np.ndarray):
+        return "array" if not value.dtype.hasobject else None
+    for name, scalar_type in _SCALARS.items():
+        if type(value) is scalar_type:
+            return name
+    return "scalar" if isinstance(value, np.generic) and not isinstance(value, np.object_) else None
+
+
+# feed a canonical form of 'value' to the digest: arrays by dtype, shape and bytes, containers element by element.
+def _digest_value(digest, value):
+    if isinstance(value, np.ndarray):
+        if value.dtype.hasobject:
+            raise _Unhashable
+        value = np.ascontiguousarray(value)
+        digest.update(f"array{value.dtype.str}{value.shape}".encode())
+        digest.update(value.data)
+    elif isinstance(value, (list, tuple)):
+        digest.update(f"{type(value).__name__}{len(value)}(".encode())
+        for element in value:
+            _digest_value(digest, element)
+        digest.update(b")")
+    elif value is None or isinstance(value, (bool, str, np.bool_)):
+        digest.update(f"{type(value).__name__}:{value!r};".encode())
+    elif isinstance(value, (int, np.integer)):
+        digest.update(f"int:{int(value)};".encode())
+    elif isinstance(value, (float, np.floating)):
+        digest.update(f"float:{float(value)!r};".encode())
+    elif isinstance(value, (complex, np.complexfloating)):
+        digest.update(f"complex:{complex(value)!r};".encode())
+    else:
+        raise _Unhashable
+
+
+# key of a call: the library version, the function and its bound arguments (defaults included, so positional and
+# keyword calls share results). Raises _Unhashable for arguments of other types than arrays, numbers, strings, None
+# and lists or tuples of them.
+def call_key(name, signature, args, kwargs, ignore=()):
+    bound = signature.bind(*args, **kwargs)
+    bound.apply_defaults()
+    digest = hashlib.sha1(f"{thzsoftware.__version__}:{name}".encode())
+    for parameter, value in bound.arguments.items():
+        if parameter not in ignore:
+            digest.update(f"{parameter}=".encode())
+            _digest_value(digest, value)
+    return digest.hexdigest()
+
+
+# cache the results of func in the active ResultCache (see enable). Without one, the wrapper only checks a global
+# before calling func. Arguments named in 'ignore' (e.g. worker counts) do not distinguish results. Use as @memoize
+# or @memoize(ignore=("workers",)); below @instrument, so cached calls still show up in profiles.
+def memoize(func=None, ignore=()):
+    if func is None:
+        return functools.partial(memoize, ignore=tuple(ignore))
+    name = func.__module__ + "." + func.__qualname__
+    signature = inspect.signature(func)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        cache = _cache
+        if cache is None:
+            return func(*args, **kwargs)
+        try:
+            key = call_key(name, signature, args, kwargs, ignore)
+        except _Unhashable:
+            return func(*args, **kwargs)
+        result = cache.get(key)
+        if result is MISS:
+            result = func(*args, **kwargs)
+            cache.put(key, result)
+        return result
+
+    return wrapper
+
+
+# cache the memoized functions in 'directory' from now on. Returns the ResultCache.
+def enable(directory, max_bytes=DEFAULT_MAX_BYTES):
+    global _cache
+    _cache = ResultCache(directory, max_bytes)
+    return _cache
+
+
+def disable():
+    global _cache
+    _cache = None
+
+
+def active_cache():
+    return _cache
+
+
+# cache the memoized functions in 'directory' within the block: with memo.cached(path) as cache: ...
+class cached:
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._previous = None
+
+    def __enter__(self):
+        self._previous = _cache
+        return enable(self.directory, self.max_bytes)
+
+    def __exit__(self, *exc_info):
+        global _cache
+        _cache = self._previous
+
+
+if os.environ.get(ENVIRONMENT_VARIABLE):
+    enable(os.environ[ENVIRONMENT_VARIABLE], int(os.environ.get(MAX_BYTES_ENVIRONMENT_VARIABLE, DEFAULT_MAX_BYTES)))
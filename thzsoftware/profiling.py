@@ -0,0 +1,215 @@
+import atexit
+import functools
+import inspect
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+import numpy as np
+
+# set to a file name to profile the whole session: a summary is printed to stderr at exit, and the events are
+# written to the file as a Chrome trace if it ends with .json. Any other non-empty value only prints the summary.
+ENVIRONMENT_VARIABLE = "THZSOFTWARE_PROFILE"
+MEMORY_ENVIRONMENT_VARIABLE = "THZSOFTWARE_PROFILE_MEMORY"  # set to 1 to also trace allocations
+
+_profiles = []  # active profiles, every instrumented call is recorded in each of them
+# tracemalloc.reset_peak is new in Python 3.9. Without it the peak of the whole trace is kept, so a call only sees its
+# own peak if it rises above the earlier ones, otherwise its traced memory at the end is taken as a lower bound.
+_reset_peak = getattr(tracemalloc, "reset_peak", None)
+_stacks = threading.local()  # per thread stack of open calls, for self time and nested allocation peaks
+
+
+# record call count, wall time, input size and allocation peak of 'func' in the active profiles. With no profile
+# active the wrapper only checks an empty list before calling func.
+def instrument(func):
+    name = func.__module__.replace("thzsoftware.", "", 1) + "." + func.__qualname__
+    # file path parameters by name and position, the size of the file they name counts as input
+    parameters = list(inspect.signature(func).parameters)
+    path_parameters = {parameter: i for i, parameter in enumerate(parameters) if parameter == "path"
+                       or parameter.endswith("_path")}
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _profiles:
+            return func(*args, **kwargs)
+        return _record(name, func, args, kwargs, path_parameters)
+
+    return wrapper
+
+
+# one call of func with the profiles active. Allocation peaks of nested calls are carried to their caller, as each
+# call resets the tracemalloc peak.
+def _record(name, func, args, kwargs, path_parameters):
+    stack = getattr(_stacks, "calls", None)
+    if stack is None:
+        stack = _stacks.calls = []
+    tracing = tracemalloc.is_tracing()
+    baseline_peak = None
+    if tracing:
+        if stack:
+            stack[-1][2] = max(stack[-1][2], _peak(stack[-1][3]))
+        if _reset_peak is not None:
+            _reset_peak()
+        current, peak = tracemalloc.get_traced_memory()
+        baseline_peak = peak if _reset_peak is None else None
+    else:
+        current = 0
+    # time spent in nested calls, traced memory at the start, peak carried, trace peak at the start (Python < 3.9)
+    call = [0, current, current, baseline_peak]
+    stack.append(call)
+    input_bytes = _input_bytes(args, kwargs, path_parameters)
+    start = time.perf_counter_ns()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        duration = time.perf_counter_ns() - start
+        stack.pop()
+        peak_bytes = None
+        if tracing and tracemalloc.is_tracing():
+            peak = max(_peak(call[3]), call[2])
+            peak_bytes = peak - call[1]
+            if stack:
+                stack[-1][2] = max(stack[-1][2], peak)
+        if stack:
+            stack[-1][0] += duration
+        event = (name, start, duration, duration - call[0], threading.get_ident(), input_bytes, peak_bytes)
+        for profile in _profiles:
+            profile.events.append(event)
+
+
+# traced memory peak since the last reset_peak, or since the trace peak was 'baseline_peak' (see _reset_peak).
+def _peak(baseline_peak):
+    current, peak = tracemalloc.get_traced_memory()
+    return peak if baseline_peak is None or peak > baseline_peak else current
+
+
+# bytes of the array-like arguments, and the size of the files named by the path parameters.
+def _input_bytes(args, kwargs, path_parameters):
+    n_bytes = 0
+    for argument in (*args, *kwargs.values()):
+        if isinstance(argument, np.ndarray):
+            n_bytes += argument.nbytes
+        elif isinstance(argument, (list, tuple)) and argument and isinstance(argument[0], (int, float)):
+            n_bytes += 8 * len(argument)
+        elif hasattr(argument, "memory_usage"):  # data frames
+            n_bytes += int(np.sum(argument.memory_usage(deep=False)))
+    for parameter, position in path_parameters.items():
+        path = args[position] if position < len(args) else kwargs.get(parameter)
+        if isinstance(path, str) and os.path.isfile(path):
+            n_bytes += os.path.getsize(path)
+    return n_bytes
+
+
+# events of the instrumented calls made while the profile is active, as tuples
+# (name, start [ns], duration [ns], self time [ns], thread id, input bytes, allocation peak in bytes or None).
+# Use as a context manager, or call start and stop. With memory=True allocations are traced by tracemalloc, which
+# slows python code down noticeably. Threads share the allocation counter, so peaks of concurrent calls overlap.
+# Calls executed in worker processes are not recorded.
+class Profile:
+    def __init__(self, memory=False):
+        self.memory = memory
+        self.events = []
+        self.wall_time = 0.
+        self._start = None
+        self._started_tracing = False
+
+    def start(self):
+        assert self not in _profiles, RuntimeError("Profile already active.")
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        self._start = time.perf_counter_ns()
+        _profiles.append(self)
+        return self
+
+    def stop(self):
+        _profiles.remove(self)
+        self.wall_time += (time.perf_counter_ns() - self._start) * 1e-9
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+        return self
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    # {name: {"calls", "total", "self", "mean", "max", "input_bytes", "peak_bytes"}}, times in seconds.
+    def stats(self):
+        out = {}
+        for name, _, duration, self_time, _, input_bytes, peak_bytes in self.events:
+            entry = out.setdefault(name, {"calls": 0, "total": 0., "self": 0., "max": 0., "input_bytes": 0,
+                                          "peak_bytes": None})
+            entry["calls"] += 1
+            entry["total"] += duration * 1e-9
+            entry["self"] += self_time * 1e-9
+            entry["max"] = max(entry["max"], duration * 1e-9)
+            entry["input_bytes"] += input_bytes
+            if peak_bytes is not None:
+                entry["peak_bytes"] = max(entry["peak_bytes"] or 0, peak_bytes)
+        for entry in out.values():
+            entry["mean"] = entry["total"] / entry["calls"]
+        return out
+
+    # table of the functions called, by self time (time not spent in other instrumented functions).
+    def summary(self, sort_by="self"):
+        stats = sorted(self.stats().items(), key=lambda item: item[1][sort_by], reverse=True)
+        wall_time = self.wall_time if self._start is None or self not in _profiles else \
+            self.wall_time + (time.perf_counter_ns() - self._start) * 1e-9
+        lines = [f"{'function':<36} {'calls':>7} {'total [s]':>10} {'self [s]':>10} {'self %':>7} {'mean [ms]':>10} "
+                 f"{'max [ms]':>10} {'input [MB]':>11} {'peak [MB]':>10}"]
+        for name, entry in stats:
+            peak = "-" if entry["peak_bytes"] is None else f"{entry['peak_bytes'] / 2 ** 20:.2f}"
+            lines.append(f"{name:<36} {entry['calls']:>7} {entry['total']:>10.4f} {entry['self']:>10.4f} "
+                         f"{100 * entry['self'] / max(wall_time, 1e-12):>7.1f} {1e3 * entry['mean']:>10.3f} "
+                         f"{1e3 * entry['max']:>10.3f} {entry['input_bytes'] / 2 ** 20:>11.2f} {peak:>10}")
+        lines.append(f"wall time {wall_time:.4f} s")
+        return "\n".join(lines)
+
+    # the events in the Chrome trace event format, viewable in chrome://tracing or https://ui.perfetto.dev.
+    def chrome_trace(self):
+        pid = os.getpid()
+        events = []
+        for name, start, duration, self_time, thread, input_bytes, peak_bytes in self.events:
+            event_args = {"input_bytes": input_bytes, "self_us": self_time / 1e3}
+            if peak_bytes is not None:
+                event_args["peak_bytes"] = peak_bytes
+            events.append({"name": name, "cat": name.rpartition(".")[0], "ph": "X", "ts": start / 1e3,
+                           "dur": duration / 1e3, "pid": pid, "tid": thread, "args": event_args})
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def save_chrome_trace(self, path):
+        with open(path, "w") as trace_file:
+            json.dump(self.chrome_trace(), trace_file)
+
+
+# profile the block: with profiling.profile() as prof: ...; print(prof.summary())
+def profile(memory=False):
+    return Profile(memory)
+
+
+# the session profile of the environment variable. The environment is left as it is, worker processes of
+# multiprocessing pools see the variable but do not profile (and report) themselves.
+def _profile_session(path):
+    if multiprocessing.current_process().name != "MainProcess":
+        return
+    session = Profile(memory=os.environ.get(MEMORY_ENVIRONMENT_VARIABLE, "") not in ("", "0")).start()
+
+    def report():
+        if session in _profiles:
+            session.stop()
+        print(session.summary(), file=sys.stderr)
+        if path.endswith(".json"):
+            session.save_chrome_trace(path)
+
+    atexit.register(report)
+
+
+if os.environ.get(ENVIRONMENT_VARIABLE):
+    _profile_session(os.environ[ENVIRONMENT_VARIABLE])
@@ -0,0 +1,107 @@
+import os
+from collections import OrderedDict
+
+LOW_WATER = .9  # a full FileStore evicts down to this fraction of its max_bytes
+
+
+# write 'path' through a temporary file in the same directory, so readers (also in other processes) never see a
+# partial file. write(file) gets the temporary file opened "wb". It is created like open() creates files, so the
+# process umask applies.
+def write_atomic(path, write):
+    temporary_path = f"{path}.{os.urandom(8).hex()}.tmp"
+    file_descriptor = os.open(temporary_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o666)
+    try:
+        with os.fdopen(file_descriptor, "wb") as temporary_file:
+            write(temporary_file)
+        os.replace(temporary_path, path)
+    except BaseException:
+        os.remove(temporary_path)
+        raise
+
+
+# directory of one file per key (key + suffix), which may be shared by several processes, with the least recently
+# used files removed once they exceed max_bytes (None: unbounded). The files are indexed in memory, ordered by use,
+# so reads and writes do not list the directory. Only eviction does, to pick up the files of other processes, and
+# it removes files down to LOW_WATER * max_bytes, so a full store lists the directory once per tenth of its budget
+# written rather than on every write. The most recently written file is always kept.
+class FileStore:
+    def __init__(self, directory, suffix, max_bytes=None):
+        assert isinstance(directory, str), TypeError(f"'directory' must be str. type(directory) = {type(directory)}")
+        assert max_bytes is None or (isinstance(max_bytes, int) and max_bytes >= 0), \
+            ValueError(f"'max_bytes' must be a non-negative integer or None. max_bytes = {max_bytes}")
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.suffix = suffix
+        self.max_bytes = max_bytes
+        self.evictions = 0
+        self._scan()
+
+    # rebuild the index from the directory, least recently used (oldest modification time) first.
+    def _scan(self):
+        files = []
+        for file_name in os.listdir(self.directory):
+            if file_name.endswith(self.suffix):
+                try:
+                    stat = os.stat(os.path.join(self.directory, file_name))
+                except FileNotFoundError:  # removed by another process meanwhile
+                    continue
+                files.append((stat.st_mtime_ns, file_name[:-len(self.suffix)], stat.st_size))
+        self._files = OrderedDict((key, size) for _, key, size in sorted(files))
+        self.n_bytes = sum(self._files.values())
+
+    def __len__(self):
+        return len(self._files)
+
+    def __contains__(self, key):
+        return os.path.exists(self.path(key))
+
+    def path(self, key):
+        return os.path.join(self.directory, key + self.suffix)
+
+    # load(path) of the file of 'key', or None if it is missing (e.g. evicted by another process) or load fails with
+    # OSError, ValueError or KeyError. A read marks the file as used, also for other processes (modification time).
+    def read(self, key, load):
+        try:
+            value = load(self.path(key))
+            os.utime(self.path(key))
+        except (OSError, ValueError, KeyError):
+            return None
+        if key in self._files:
+            self._files.move_to_end(key)
+        return value
+
+    # store the file of 'key' by write(file), see write_atomic.
+    def write(self, key, write):
+        write_atomic(self.path(key), write)
+        size = os.path.getsize(self.path(key))
+        self.n_bytes += size - self._files.pop(key, 0)
+        self._files[key] = size
+        if self.max_bytes is not None and self.n_bytes > self.max_bytes:
+            self.evict()
+
+    # remove least recently used files until the store holds at most LOW_WATER * max_bytes.
+    def evict(self):
+        if self.max_bytes is None:
+            return
+        newest = next(reversed(self._files), None)
+        self._scan()
+        if newest in self._files:  # written within the resolution of the modification time
+            self._files.move_to_end(newest)
+        while self.n_bytes > LOW_WATER * self.max_bytes and len(self._files) > 1:
+            key, size = self._files.popitem(last=False)
+            self._remove(key)
+            self.n_bytes -= size
+            self.evictions += 1
+
+    def _remove(self, key):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:  # removed by another process
+            pass
+
+    def clear(self):
+        self._scan()
+        for key in self._files:
+            self._remove(key)
+        self._files.clear()
+        self.n_bytes = 0
@@ -0,0 +1,177 @@
+from collections import deque
+
+import numpy as np
+
+from thzsoftware import data
+from thzsoftware import math as mt
+from thzsoftware.profiling import instrument
+from thzsoftware.tds import phase as ph
+
+
+# running mean and variance of repeated scans of equal length, updated with Welford's method (Chan's pairwise form
+# for chunks), so the memory held is O(n_samples) however many scans are added. With a sample_rate the complex
+# spectrum (phase.fft with 'pad') is accumulated alongside the trace, its variance being the mean squared distance
+# |z - mean|^2 from the mean spectrum. With align=True every scan is shifted by the integer number of samples that
+# maximises its cross correlation with the first scan (at most max_shift samples), before it is accumulated. The last
+# 'shift_history' shifts are kept in 'shifts', their running mean and spread over all scans in shift_mean, shift_std.
+# The sample_rate has to be set before the first scan is added, so the spectra cover every scan.
+# mean and spectrum_mean are plain arrays for phase.fft, phase.compute_phase, ... e.g.
+# norm, phase = ph.compute_phase(averager.spectrum_mean).
+class ScanAverager:
+    def __init__(self, sample_rate=None, pad=None, align=False, max_shift=None, shift_history=1000):
+        assert sample_rate is None or (isinstance(sample_rate, (int, float)) and sample_rate > 0), \
+            ValueError(f"'sample_rate' must be a positive number or None. sample_rate = {sample_rate}")
+        assert pad is None or isinstance(pad, int), TypeError("'pad' must be int or None.")
+        assert isinstance(align, bool), TypeError(f"'align' must be boolean. type(align) = {type(align)}")
+        assert max_shift is None or (isinstance(max_shift, (int, np.integer)) and max_shift >= 0), \
+            ValueError(f"'max_shift' must be a non-negative integer or None. max_shift = {max_shift}")
+        self.sample_rate = sample_rate
+        self.pad = pad
+        self.align = align
+        self.max_shift = max_shift
+        self.count = 0
+        self.shifts = deque(maxlen=shift_history)  # applied shifts of the last scans in samples, with align=True
+        self.shift_min = None
+        self.shift_max = None
+        self._shift_mean = None
+        self._shift_m2 = None
+        self.reference = None  # first scan, the target of the alignment
+        self.frequencies = None
+        self._mean = None
+        self._m2 = None  # sum of squared deviations from the mean
+        self._spectrum_mean = None
+        self._spectrum_m2 = None
+
+    @property
+    def n_samples(self):
+        return None if self.reference is None else len(self.reference)
+
+    # add one scan (n_samples,) or a chunk of scans (n_scans, n_samples).
+    @instrument
+    def add(self, traces):
+        traces = np.asarray(traces, dtype=np.float64)
+        assert traces.ndim in (1, 2), ValueError(f"'traces' must be a scan or a chunk of scans. shape = "
+                                                 f"{traces.shape}")
+        traces = np.atleast_2d(traces)
+        if len(traces) == 0:
+            return self
+        if self.reference is None:
+            assert traces.shape[1] > 1, ValueError("Scans must hold at least two samples.")
+            self.reference = traces[0].copy()
+        assert traces.shape[1] == self.n_samples, ValueError(f"Scans must hold {self.n_samples} samples. "
+                                                             f"shape = {traces.shape}")
+        assert self.sample_rate is None or self.count == 0 or self._spectrum_mean is not None, \
+            ValueError("'sample_rate' must be set before the first scan is added.")
+
+        n_previous = self.count
+        if self.align:
+            shifts = self._drift(traces)
+            traces = _shift_rows(traces, -shifts)
+            self.shifts.extend(shifts.tolist())
+            self._shift_mean, self._shift_m2 = _merge(self._shift_mean, self._shift_m2, n_previous,
+                                                      shifts.astype(np.float64))
+            self.shift_min = int(shifts.min()) if self.shift_min is None else min(self.shift_min, int(shifts.min()))
+            self.shift_max = int(shifts.max()) if self.shift_max is None else max(self.shift_max, int(shifts.max()))
+        self.count += len(traces)
+        self._mean, self._m2 = _merge(self._mean, self._m2, n_previous, traces)
+        if self.sample_rate is not None:
+            self.frequencies, spectra = ph.fft(traces, self.sample_rate, pad=self.pad)
+            self._spectrum_mean, self._spectrum_m2 = _merge(self._spectrum_mean, self._spectrum_m2, n_previous,
+                                                            spectra)
+        return self
+
+    # delay in samples of every scan against the first one, from the peak of their cross correlation.
+    def _drift(self, traces):
+        lags, correlation = mt.cross_correlate(traces, self.reference)
+        if self.max_shift is not None:
+            correlation = np.where(np.abs(lags) <= self.max_shift, correlation, -np.inf)
+        return lags[np.argmax(correlation, axis=-1)]
+
+    # add the signal column 'channel' of pulse files, read 'chunk_size' files at a time. The sample rate is taken
+    # from the first file if it was not given.
+    @instrument
+    def add_files(self, file_paths, channel=1, chunk_size=16):
+        assert isinstance(chunk_size, int) and chunk_size > 0, ValueError(f"'chunk_size' must be a positive "
+                                                                          f"integer. chunk_size = {chunk_size}")
+        file_paths = [file_paths] if isinstance(file_paths, str) else list(file_paths)
+        for start in range(0, len(file_paths), chunk_size):
+            chunk = []
+            for file_path in file_paths[start:start + chunk_size]:
+                _, columns, _, sample_rate = data.read_pulse_csv(file_path)
+                assert channel < len(columns), ValueError(f"{file_path} has no signal column {channel}.")
+                if self.sample_rate is None and self.count == 0 and not chunk:
+                    self.sample_rate = sample_rate
+                assert self.sample_rate is None or np.isclose(sample_rate, self.sample_rate, rtol=1e-6), \
+                    ValueError(f"{file_path} is sampled at {sample_rate} Hz, not {self.sample_rate} Hz.")
+                chunk.append(columns[channel])
+            self.add(np.stack(chunk))
+        return self
+
+    @property
+    def mean(self):
+        return self._mean
+
+    # unbiased sample variance, nan for fewer than two scans.
+    @property
+    def variance(self):
+        return _variance(self._m2, self.count)
+
+    @property
+    def std(self):
+        return None if self._m2 is None else np.sqrt(self.variance)
+
+    # standard deviation of the mean.
+    @property
+    def standard_error(self):
+        return None if self._m2 is None else np.sqrt(self.variance / self.count)
+
+    @property
+    def shift_mean(self):
+        return None if self._shift_mean is None else float(self._shift_mean)
+
+    @property
+    def shift_std(self):
+        return None if self._shift_m2 is None else float(np.sqrt(_variance(self._shift_m2, self.count)))
+
+    @property
+    def spectrum_mean(self):
+        return self._spectrum_mean
+
+    @property
+    def spectrum_variance(self):
+        return _variance(self._spectrum_m2, self.count)
+
+
+# Chan's update of (mean, m2) over 'count' values with a chunk of rows.
+def _merge(mean, m2, count, rows):
+    chunk_mean = rows.mean(axis=0)
+    chunk_m2 = np.sum(np.abs(rows - chunk_mean) ** 2, axis=0)
+    if mean is None:
+        return chunk_mean, chunk_m2
+    n_rows = len(rows)
+    delta = chunk_mean - mean
+    total = count + n_rows
+    mean = mean + delta * (n_rows / total)
+    m2 = m2 + chunk_m2 + np.abs(delta) ** 2 * (count * n_rows / total)
+    return mean, m2
+
+
+def _variance(m2, count):
+    if m2 is None:
+        return None
+    return m2 / (count - 1) if count > 1 else np.full_like(m2, np.nan)
+
+
+# shift every row by its number of samples, filling with zeros.
+def _shift_rows(rows, shifts):
+    n_samples = rows.shape[1]
+    source = np.arange(n_samples) - shifts[:, None]
+    valid = (source >= 0) & (source < n_samples)
+    shifted = np.take_along_axis(rows, np.clip(source, 0, n_samples - 1), axis=1)
+    return np.where(valid, shifted, 0.)
+
+
+# the average of pulse files, read in chunks.
+@instrument
+def average_files(file_paths, channel=1, pad=None, align=False, max_shift=None, chunk_size=16):
+    return ScanAverager(pad=pad, align=align, max_shift=max_shift).add_files(file_paths, channel, chunk_size)
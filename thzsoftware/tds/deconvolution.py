@@ -0,0 +1,94 @@
+import functools
+
+import numpy as np
+import pandas as pd
+import scipy.fft as ft
+from thzsoftware.profiling import instrument
+from thzsoftware.tds import pulse as pl
+
+KERNEL_CACHE_SIZE = 64
+
+
+# band pass filter over the rfft frequencies of 'length' samples: 1 within band [Hz], falling to 0 with a cosine
+# flank of taper * band width on either side. Read only, cached by length, sample rate, band and taper.
+def filter_kernel(length, sample_rate, band, taper=.25):
+    assert len(band) == 2 and 0 <= band[0] < band[1], ValueError(f"'band' must be (f_min, f_max). band = {band}")
+    assert taper >= 0, ValueError(f"'taper' must be non-negative. taper = {taper}")
+    return _filter_kernel(int(length), float(sample_rate), float(band[0]), float(band[1]), float(taper))
+
+
+@functools.lru_cache(maxsize=KERNEL_CACHE_SIZE)
+def _filter_kernel(length, sample_rate, f_min, f_max, taper):
+    fs = ft.rfftfreq(length, 1 / sample_rate)
+    flank = taper * (f_max - f_min)
+    # distance outside the band, in units of the flank width
+    outside = np.maximum(f_min - fs, fs - f_max) / flank if flank > 0 else np.where((fs < f_min) | (fs > f_max),
+                                                                                    np.inf, 0.)
+    kernel = np.where(outside <= 0, 1., .5 * (1 + np.cos(np.pi * np.clip(outside, 0, 1))))
+    kernel.flags.writeable = False
+    return kernel
+
+
+# impulse responses of samples (n_samples,) or (n_traces, n_samples) against a reference trace (or one per trace):
+# the sample spectrum divided by the reference spectrum with the regularised (Wiener) inverse
+# conj(R) / (|R|^2 + regularization * max|R|^2), band limited by filter_kernel. The traces are zero padded by 'pad'
+# samples (default: their length) against the circular wrap of late echoes. Returns the delays [s] from -T/2 to T/2
+# of the padded length T and the responses along them, whose peaks sit at the delays of the echoes against the
+# reference pulse, with the signed amplitude of the echo relative to the reference.
+@instrument
+def impulse_responses(reference, samples, sample_rate, band, regularization=1e-2, taper=.25, pad=None):
+    reference = np.asarray(reference, dtype=np.float64)
+    samples = np.asarray(samples, dtype=np.float64)
+    assert reference.shape[-1] == samples.shape[-1], ValueError(f"Reference and samples differ in length. "
+                                                                f"{reference.shape} != {samples.shape}")
+    assert regularization > 0, ValueError(f"'regularization' must be positive. regularization = {regularization}")
+    length = ft.next_fast_len(samples.shape[-1] + (samples.shape[-1] if pad is None else pad), real=True)
+
+    reference_spectrum = ft.rfft(reference, length, axis=-1)
+    power = np.abs(reference_spectrum) ** 2
+    inverse = np.conj(reference_spectrum) / (power + regularization * np.max(power, axis=-1, keepdims=True))
+    inverse *= filter_kernel(length, sample_rate, band, taper)
+    # scaled to the peak response of the reference itself, so an echo of the reference pulse has its amplitude
+    gain = ft.irfft(reference_spectrum * inverse, length, axis=-1)[..., :1]
+    responses = ft.fftshift(ft.irfft(ft.rfft(samples, length, axis=-1) * inverse, length, axis=-1) / gain, axes=-1)
+    delays = (np.arange(length) - length // 2) / sample_rate
+    return delays, responses
+
+
+# delays [s] and signed amplitudes of the number_of_echoes strongest echoes in impulse responses, strongest first,
+# each at least min_distance samples (default: one period of the band width) from a stronger one. Delays are refined
+# to fractions of a sample (see pulse.find_echoes). Echoes weaker than 'threshold' times the strongest one of their
+# trace, e.g. side lobes of the band limited response, count as missing. Missing echoes have nan delay and 0
+# amplitude.
+@instrument
+def find_echoes(delays, responses, number_of_echoes=2, min_distance=None, band=None, threshold=0.):
+    sample_period = delays[1] - delays[0]
+    if min_distance is None:
+        assert band is not None, ValueError("Either 'min_distance' or 'band' is needed.")
+        min_distance = int(np.ceil(1 / ((band[1] - band[0]) * sample_period)))
+    magnitude = np.abs(responses)
+    positions, peaks = pl.find_echoes(magnitude, min_distance, number_of_echoes, refine=True)
+    found = (peaks > 0) & (peaks >= threshold * peaks[..., :1])
+    index = np.round(np.where(found, positions, 0)).astype(np.int64)
+    signs = np.sign(np.take_along_axis(np.atleast_2d(responses), np.atleast_2d(index), -1)).reshape(index.shape)
+    return np.where(found, delays[0] + positions * sample_period, np.nan), np.where(found, signs * peaks, 0.)
+
+
+# long table of the echoes, one row per trace and echo: columns trace, echo (0 = strongest), delay [s], amplitude.
+def echo_table(echo_delays, echo_amplitudes):
+    echo_delays, echo_amplitudes = np.atleast_2d(echo_delays), np.atleast_2d(echo_amplitudes)
+    n_traces, n_echoes = echo_delays.shape
+    return pd.DataFrame({"trace": np.repeat(np.arange(n_traces), n_echoes), "echo": np.tile(np.arange(n_echoes),
+                                                                                            n_traces),
+                         "delay [s]": echo_delays.ravel(), "amplitude": echo_amplitudes.ravel()})
+
+
+# the whole stage for every trace in one call: impulse responses, and the table of their echoes sorted by trace and
+# delay. Returns (delays, responses, table).
+@instrument
+def deconvolve(reference, samples, sample_rate, band, number_of_echoes=2, regularization=1e-2, taper=.25, pad=None,
+               min_distance=None, threshold=0.):
+    delays, responses = impulse_responses(reference, samples, sample_rate, band, regularization, taper, pad)
+    echo_delays, echo_amplitudes = find_echoes(delays, responses, number_of_echoes, min_distance, band, threshold)
+    table = echo_table(echo_delays, echo_amplitudes).dropna().sort_values(["trace", "delay [s]"], ignore_index=True)
+    return delays, responses, table
@@ -0,0 +1,225 @@
+import json
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+
+from thzsoftware.profiling import instrument
+from thzsoftware.tds import phase as ph
+from thzsoftware.tds import pulse as pl
+from thzsoftware.tds import reference as rf
+
+CUBE_FILE = "cube.npy"
+METADATA_FILE = "cube.json"
+MAPS_FILE = "maps.json"
+DEFAULT_TILE_SIZE = (32, 32)
+
+
+# raster scan of (nx, ny) pixels with a trace of n_samples each, stored as a memory mapped .npy file in 'directory'
+# next to a json file holding the sample rate. Pixels are written as they are measured (cube.data[x, y] = trace), and
+# only the pages touched are held in memory.
+class ImageCube:
+    def __init__(self, directory, mode="r"):
+        assert mode in ("r", "r+", "c"), ValueError(f"'mode' must be 'r', 'r+' or 'c'. mode = {mode}")
+        with open(os.path.join(directory, METADATA_FILE)) as metadata_file:
+            metadata = json.load(metadata_file)
+        self.directory = directory
+        self.sample_rate = metadata["sample_rate"]
+        self.data = np.load(os.path.join(directory, CUBE_FILE), mmap_mode=mode)
+
+    # an empty cube, filled with zeros.
+    @classmethod
+    def create(cls, directory, shape, sample_rate, dtype=np.float64):
+        assert len(shape) == 3 and all(int(length) > 0 for length in shape), \
+            ValueError(f"'shape' must be (nx, ny, n_samples). shape = {shape}")
+        assert isinstance(sample_rate, (int, float)) and sample_rate > 0, \
+            ValueError(f"'sample_rate' must be a positive number. sample_rate = {sample_rate}")
+        os.makedirs(directory, exist_ok=True)
+        cube = np.lib.format.open_memmap(os.path.join(directory, CUBE_FILE), mode="w+", dtype=dtype,
+                                         shape=tuple(int(length) for length in shape))
+        del cube
+        with open(os.path.join(directory, METADATA_FILE), "w") as metadata_file:
+            json.dump({"sample_rate": float(sample_rate)}, metadata_file)
+        return cls(directory, mode="r+")
+
+    # a cube holding 'array', written in slices of x so it may be a memory map itself.
+    @classmethod
+    def from_array(cls, directory, array, sample_rate):
+        cube = cls.create(directory, array.shape, sample_rate, dtype=array.dtype)
+        for x in range(array.shape[0]):
+            cube.data[x] = array[x]
+        cube.flush()
+        return cube
+
+    @property
+    def shape(self):
+        return self.data.shape
+
+    def flush(self):
+        if isinstance(self.data, np.memmap) and self.data.mode != "r":
+            self.data.flush()
+
+    # (x0, x1, y0, y1) of the tiles covering the image, row by row.
+    def tiles(self, tile_size=DEFAULT_TILE_SIZE):
+        tile_x, tile_y = _tile_size(tile_size)
+        nx, ny = self.shape[:2]
+        return [(x0, min(x0 + tile_x, nx), y0, min(y0 + tile_y, ny))
+                for x0 in range(0, nx, tile_x) for y0 in range(0, ny, tile_y)]
+
+
+def _tile_size(tile_size):
+    tile_size = (tile_size, tile_size) if isinstance(tile_size, (int, np.integer)) else tuple(tile_size)
+    assert len(tile_size) == 2 and all(int(length) > 0 for length in tile_size), \
+        ValueError(f"'tile_size' must be a positive int or a pair of them. tile_size = {tile_size}")
+    return int(tile_size[0]), int(tile_size[1])
+
+
+# names of the maps computed with the given frequencies [Hz] for n.
+def map_names(frequencies=()):
+    return ["peak_amplitude", "delay", "band_amplitude", "found"] + [f"n_{f / 1e12:g}THz" for f in frequencies]
+
+
+# maps of the image in cube_directory, written to output_directory as (nx, ny) .npy files, tile by tile on a pool of
+# 'workers' processes. Each worker reads only its tile of the cube. Per pixel:
+#   peak_amplitude  largest absolute value of the trace,
+#   delay           time of that peak after the peak of the reference [s],
+#   band_amplitude  spectrum norm integrated over 'band' [Hz] (a.u. * Hz),
+#   found           1 if a pulse was found (define_thz_pulses_batch), 0 else. The other maps are nan where it is 0,
+#   n_<f>THz        compute_n_by_phase against the reference at each of 'frequencies' [Hz], if a thickness [m] is
+#                   given. The phases are extrapolated with the fit over 'f_limits'.
+# Every finished tile leaves a marker file, so an interrupted run continues with resume=True. The settings of the run
+# are kept in maps.json and must match on resume.
+@instrument
+def compute_maps(cube_directory, output_directory, reference, band, thickness=None, frequencies=(),
+                 f_limits=(5e11, 3e12), tile_size=DEFAULT_TILE_SIZE, pad=None, window_func="tukey", tukey_alpha=.5,
+                 workers=1, resume=False, progress=None):
+    cube = ImageCube(cube_directory)
+    reference = np.asarray(reference, dtype=np.float64)
+    assert reference.shape == cube.shape[2:], ValueError(f"The reference must hold {cube.shape[2]} samples. "
+                                                         f"reference.shape = {reference.shape}")
+    assert len(band) == 2 and band[0] < band[1], ValueError(f"'band' must be (f_min, f_max). band = {band}")
+    assert thickness is not None or not frequencies, ValueError("n maps need the sample 'thickness'.")
+    assert isinstance(workers, int) and workers > 0, ValueError(f"'workers' must be a positive int. workers = "
+                                                                f"{workers}")
+    frequencies = tuple(float(f) for f in frequencies)
+    settings = {"band": [float(f) for f in band], "thickness": thickness, "frequencies": list(frequencies),
+                "f_limits": [float(f) for f in f_limits], "tile_size": list(_tile_size(tile_size)), "pad": pad,
+                "window_func": window_func, "tukey_alpha": float(tukey_alpha), "shape": list(cube.shape[:2]),
+                "reference": rf.spectrum_key(reference, cube.sample_rate)}
+
+    names = map_names(frequencies)
+    tile_directory = os.path.join(output_directory, "tiles")
+    settings_path = os.path.join(output_directory, MAPS_FILE)
+    if resume and os.path.exists(settings_path):
+        with open(settings_path) as settings_file:
+            previous = json.load(settings_file)
+        assert previous == settings, ValueError(f"Cannot resume, the maps in {output_directory} were computed with "
+                                                f"other settings: {previous}")
+    else:
+        os.makedirs(tile_directory, exist_ok=True)
+        for file_name in os.listdir(tile_directory):
+            os.remove(os.path.join(tile_directory, file_name))
+        for name in names:
+            np.lib.format.open_memmap(os.path.join(output_directory, name + ".npy"), mode="w+", dtype=np.float64,
+                                      shape=cube.shape[:2])[:] = np.nan
+        with open(settings_path, "w") as settings_file:
+            json.dump(settings, settings_file)
+
+    fs, _, reference_phase = rf.reference_spectrum(reference, cube.sample_rate, window_func=window_func,
+                                                   tukey_alpha=tukey_alpha, pad=pad, f_limits=f_limits)
+    tile_settings = dict(settings, reference_peak=int(np.argmax(np.abs(reference))), reference_phase=reference_phase)
+    tiles = [tile for tile in cube.tiles(tile_size) if not os.path.exists(_tile_marker(output_directory, tile))]
+    del cube
+
+    if workers == 1:
+        for tile in tiles:
+            process_tile(cube_directory, output_directory, tile, tile_settings)
+            if progress is not None:
+                progress(tile)
+    else:
+        with ProcessPoolExecutor(workers) as process_pool:
+            pending = set()
+            for tile in tiles:
+                if len(pending) >= 2 * workers:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    _collect(done, progress)
+                pending.add(process_pool.submit(process_tile, cube_directory, output_directory, tile,
+                                                tile_settings))
+            _collect(pending, progress)
+    return load_maps(output_directory)
+
+
+def _collect(futures, progress):
+    for future in futures:
+        tile = future.result()
+        if progress is not None:
+            progress(tile)
+
+
+def _tile_marker(output_directory, tile):
+    return os.path.join(output_directory, "tiles", "{}_{}_{}_{}.done".format(*tile))
+
+
+# maps of one tile, run in a worker: the tile is read from the cube and written into the map files.
+def process_tile(cube_directory, output_directory, tile, settings):
+    x0, x1, y0, y1 = tile
+    cube = ImageCube(cube_directory)
+    traces = np.array(cube.data[x0:x1, y0:y1], dtype=np.float64).reshape(-1, cube.shape[2])
+    maps = tile_maps(traces, cube.sample_rate, settings)
+    for name, values in maps.items():
+        out = np.load(os.path.join(output_directory, name + ".npy"), mmap_mode="r+")
+        out[x0:x1, y0:y1] = values.reshape(x1 - x0, y1 - y0)
+        out.flush()
+        del out
+    open(_tile_marker(output_directory, tile), "w").close()
+    return tile
+
+
+# the maps (see compute_maps) of a stack of traces (n_pixels, n_samples), as {name: (n_pixels,) array}.
+def tile_maps(traces, sample_rate, settings):
+    left_limits, right_limits, found = pl.define_thz_pulses_batch(traces)
+    peaks = np.argmax(np.abs(traces), axis=-1)
+    maps = {"peak_amplitude": np.abs(traces[np.arange(len(traces)), peaks]),
+            "delay": (peaks - settings["reference_peak"]) / sample_rate}
+
+    maps["band_amplitude"] = np.full(len(traces), np.nan)
+    maps["found"] = found.astype(np.float64)
+    n_names = map_names(settings["frequencies"])[4:]
+    for name in n_names:
+        maps[name] = np.full(len(traces), np.nan)
+    maps["peak_amplitude"][~found] = np.nan
+    maps["delay"][~found] = np.nan
+    if not found.any():
+        return maps
+
+    # pixels without a pulse have no window, so only the others go through the spectral steps
+    windowed = pl.window(traces[found], np.column_stack((left_limits, right_limits))[found],
+                         window_func=settings["window_func"], tukey_alpha=settings["tukey_alpha"])
+    fs, spectra = ph.fft(windowed, sample_rate, pad=settings["pad"])
+    norm, phase = ph.compute_phase(spectra)
+    in_band = (fs >= settings["band"][0]) & (fs <= settings["band"][1])
+    if in_band.sum() > 1:
+        maps["band_amplitude"][found] = np.trapz(norm[:, in_band], fs[in_band], axis=-1)
+
+    if settings["frequencies"]:
+        phase = ph.extrapolate_phase(fs, phase, settings["f_limits"])
+        n = ph.compute_n_by_phase(fs, settings["reference_phase"], phase, settings["thickness"])
+        for name, f in zip(n_names, settings["frequencies"]):
+            maps[name][found] = _interpolate(fs, n, f)
+    return maps
+
+
+# rows of 'values' (n_rows, len(fs)) linearly interpolated at frequency f.
+def _interpolate(fs, values, f):
+    assert fs[0] <= f <= fs[-1], ValueError(f"Frequency {f} outside of the spectrum ({fs[0]} to {fs[-1]} Hz).")
+    right = int(np.clip(np.searchsorted(fs, f), 1, len(fs) - 1))
+    weight = (f - fs[right - 1]) / (fs[right] - fs[right - 1])
+    return (1 - weight) * values[:, right - 1] + weight * values[:, right]
+
+
+# {name: (nx, ny) read only memory map} of the maps in output_directory.
+def load_maps(output_directory):
+    with open(os.path.join(output_directory, MAPS_FILE)) as settings_file:
+        frequencies = json.load(settings_file)["frequencies"]
+    return {name: np.load(os.path.join(output_directory, name + ".npy"), mmap_mode="r")
+            for name in map_names(frequencies)}
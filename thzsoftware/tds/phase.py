@@ -1,30 +1,70 @@
+import functools
+
 import numpy as np
 import scipy.fft as ft
-import scipy.signal as signal
 from scipy.constants import c
 from thzsoftware import fitting as fit
 from thzsoftware import math as mt
+from thzsoftware.memo import memoize
+from thzsoftware.profiling import instrument
+from thzsoftware.tds import pulse as pl
+
+FREQUENCY_CACHE_SIZE = 64
 
 
 # fourier transform
-def fft(amplitude_array, sample_rate, pad=None):
+# amplitude_array may be a stack of traces, e.g. (n_traces, n_samples), transformed along 'axis'.
+# The transform length is the trace length plus 'pad' zeros, raised to at least sample_rate / resolution if a target
+# frequency resolution is given, and rounded up to the next length scipy transforms quickly if fast_length=True.
+# Real input goes through rfft. single_precision=True transforms in float32 / complex64, halving the memory of large
+# batches, and 'workers' is passed on to scipy.fft for multithreaded transforms of stacks.
+# Returns the first half of the spectrum (length // 2 bins) and its frequency axis.
+@instrument
+@memoize(ignore=("workers",))
+def fft(amplitude_array, sample_rate, pad=None, axis=-1, resolution=None, fast_length=False, single_precision=False,
+        workers=None):
     assert isinstance(amplitude_array, (list, tuple, np.ndarray)), TypeError("'amplitude_array' must be array like. ("
                                                                              "list, tuple or numpy.array).")
     assert isinstance(sample_rate, (int, float)), TypeError("'sample_rate' must be int or float.")
     assert pad is None or isinstance(pad, int), TypeError("'pad' kwarg must be int number of right side "
                                                           "padding zeros or or None.")
+    assert resolution is None or (isinstance(resolution, (int, float)) and resolution > 0), \
+        ValueError(f"'resolution' must be a positive frequency or None. resolution = {resolution}")
+    assert isinstance(fast_length, bool) and isinstance(single_precision, bool), \
+        TypeError("'fast_length' and 'single_precision' kwargs must be boolean.")
+
+    amplitude_array = np.asarray(amplitude_array)
+    is_complex = np.iscomplexobj(amplitude_array)
+    if single_precision:
+        amplitude_array = amplitude_array.astype(np.complex64 if is_complex else np.float32, copy=False)
+
+    length = amplitude_array.shape[axis] + (pad or 0)
+    if resolution is not None:
+        length = max(length, int(np.ceil(sample_rate / resolution)))
+    if fast_length:
+        length = ft.next_fast_len(length, real=not is_complex)
+
+    # zero padding is left to scipy through the transform length
+    transform = ft.fft if is_complex else ft.rfft
+    half = [slice(None)] * amplitude_array.ndim
+    half[axis] = slice(0, length // 2)
+    amplitude_transform = transform(amplitude_array, n=length, axis=axis, workers=workers)[tuple(half)]
+    argument_transform = frequency_axis(length, sample_rate)
 
-    n = len(amplitude_array)
-    if pad:
-        amplitude_array = np.pad(amplitude_array, (0, pad), mode="constant")
+    return argument_transform, amplitude_transform
 
-    amplitude_transform = ft.fft(amplitude_array)[:n // 2]
-    argument_transform = ft.fftfreq(n, sample_rate ** -1)[:n // 2]
 
-    return argument_transform, amplitude_transform
+# non-negative frequencies of an n point transform, cached by (n, sample_rate). The returned array is shared between
+# callers and therefore read-only. Cache statistics: frequency_axis.cache_info().
+@functools.lru_cache(maxsize=FREQUENCY_CACHE_SIZE)
+def frequency_axis(n, sample_rate):
+    frequencies = ft.fftfreq(n, sample_rate ** -1)[:n // 2]
+    frequencies.flags.writeable = False
+    return frequencies
 
 
 # inverse Fourier transform
+@instrument
 def ifft(amplitude_transform):
     assert isinstance(amplitude_transform, (list, tuple, np.ndarray)), TypeError("'amplitude_transform' must be array "
                                                                                  "like. ( "
@@ -34,19 +74,24 @@ def ifft(amplitude_transform):
 
 
 # Phase unraveling
-def compute_phase(zs, unwrap=True):  # takes in a complex array and returns modulus and unwrapped argument
+@instrument
+@memoize
+def compute_phase(zs, unwrap=True, axis=-1):  # takes in a complex array and returns modulus and unwrapped argument
     assert isinstance(unwrap, bool), TypeError(f"unwrap kwarg must be boolean. type(unwrap) = {type(unwrap)}.")
-    r, phi = mt.carthesian_to_polar(zs)
+    r, phi = mt.carthesian_to_polar(np.asarray(zs))
     if unwrap:
-        phi = mt.unwrap_angles(phi)
+        phi = mt.unwrap_angles(phi, axis=axis, out=phi)
 
     return r, phi
 
 
 # Phase extrapolation
-def extrapolate_phase(fs, phase, f_limits):
+@instrument
+@memoize
+def extrapolate_phase(fs, phase, f_limits, axis=-1):
     # This function cuts the data to satisfy the limits.
     # Then it fits the data, and forces the intersection to be 0.
+    # phase may be a stack of phases sharing the frequency axis fs along 'axis'. Every row gets its own linear fit.
     assert isinstance(fs, (list, tuple, np.ndarray)), TypeError(f"Input must be array-like. type(fs) = {type(fs)}")
     assert isinstance(phase, (list, tuple, np.ndarray)), TypeError("Input must be array-like."
                                                                    f" type(phase) = {type(phase)}")
@@ -58,41 +103,57 @@ def extrapolate_phase(fs, phase, f_limits):
     assert f_limits[0] < f_limits[1], ValueError("f_limits[0] must be lessen than f_limits[1]"
                                                  f"f_limits = {f_limits}.")
 
-    fs_limited = fs[(fs > f_limits[0]) & (fs < f_limits[1])]
-    phase_limited = phase[(fs > f_limits[0]) & (fs < f_limits[1])]
+    fs = np.asarray(fs)
+    phase = np.moveaxis(np.asarray(phase), axis, -1)
+    assert phase.shape[-1] == len(fs), ValueError(f"Phase and frequency length differ along axis {axis}. "
+                                                  f"len(fs) = {len(fs)}, phase.shape = {phase.shape}.")
+
+    in_limits = (fs > f_limits[0]) & (fs < f_limits[1])
+    fs_limited = fs[in_limits]
+    phase_limited = phase[..., in_limits]
 
     fs_capped = fs[fs < f_limits[1]]
     extrapolation_length = len(fs_capped) - len(fs_limited)
 
     a, b = fit.linear_fit(fs_limited, phase_limited)
+    a, b = np.expand_dims(a, -1), np.expand_dims(b, -1)
 
     # finally shift fs to the left.
-    out = np.append(a * fs_capped[:extrapolation_length], phase[extrapolation_length:] - b)
-    assert out.shape == fs.shape, f"Input shape not conserved. out.shape = {out.shape}, fs.shape = {fs.shape}."
-    return out
+    out = np.concatenate((a * fs_capped[:extrapolation_length], phase[..., extrapolation_length:] - b), axis=-1)
+    assert out.shape == phase.shape, f"Input shape not conserved. out.shape = {out.shape}, fs.shape = {fs.shape}."
+    return np.moveaxis(out, -1, axis)
 
 
 # apply Tukey window function
+@instrument
 def window_tukey(ts, ys, center_index, width, alpha=.2):
     dt = ts[1] - ts[0]
     points = int(max(1, width // dt))
 
-    assert points < len(ts), f"Too few data points {len(dt)} to represent pulse of length {width}."
+    assert points < len(ts), f"Too few data points {len(ts)} to represent pulse of length {width}."
     assert points / 2 < center_index < len(ts) - points / 2, f"Window out of bound, left limit = " \
                                                              f"{center_index - (points // 2)} "
 
     left_win_lim = int(center_index - points // 2 - points // 4)  # to shift window just behind max
     window = np.zeros(ts.shape)
-    window[left_win_lim:left_win_lim + points] = signal.tukey(points, alpha=alpha)
+    window[left_win_lim:left_win_lim + points] = pl.window_shape("tukey", points, alpha)
     return ys * window
 
 
-def compute_n_by_phase(frequency, phase_air, phase_sample, distance, n0=1, tolerance=1e-16):
+# phase_air and phase_sample may be stacks of phases, broadcast against each other, with frequency along 'axis'. A
+# single 1-D phase is used for every phase of the other stack.
+@instrument
+@memoize
+def compute_n_by_phase(frequency, phase_air, phase_sample, distance, n0=1, tolerance=1e-16, axis=-1):
     for name, candidate in (("frequency", frequency), ("phase_air", phase_air), ("phase_sample", phase_sample)):
         assert isinstance(candidate, (list, tuple, np.ndarray)), TypeError("Input must be array-like."
                                                                            f" type({name}) ="
                                                                            f" {type(candidate)}")
-    assert len(frequency) == len(phase_air) == len(phase_sample), ValueError("Input array must be same length.")
+    # frequency last, so a single (1-D) phase broadcasts against a stack along any axis
+    phase_air, phase_sample = (np.asarray(phase) if np.ndim(phase) == 1 else np.moveaxis(phase, axis, -1)
+                               for phase in (phase_air, phase_sample))
+    assert len(frequency) == phase_air.shape[-1] == phase_sample.shape[-1], \
+        ValueError("Input array must be same length.")
     assert isinstance(distance, (int, float, np.integer, np.floating)), TypeError("distance and n0 inputs must be int"
                                                                                   " or float. type(distance) ="
                                                                                   f" {type(distance)}, type(n0) ="
@@ -100,11 +161,11 @@ def compute_n_by_phase(frequency, phase_air, phase_sample, distance, n0=1, toler
     assert isinstance(tolerance, (int, float)), TypeError("'tolerance' kwarg must be int of float. type(tolerance) = "
                                                           f"{type(tolerance)}")
 
-    fs = frequency.copy()
-    poles = np.where(fs < tolerance)  # in case of f = 0, we return np.inf and avoid poles.
+    fs = np.array(frequency, dtype=np.float64)
+    poles = fs < tolerance  # in case of f = 0, we return np.inf and avoid poles.
     fs[poles] = 1.  # this will be replaced later.
 
     # source: J. Neu and C. A. Schmuttenmaer "Tutorial: An introduction to teraherty time domain spectroscopy (tds)"
     out = np.abs(phase_air - phase_sample) * c / (2 * np.pi * fs * distance) + n0
-    out[poles] = np.inf
-    return out
+    out[..., poles] = np.inf
+    return out if out.ndim == 1 else np.moveaxis(out, -1, axis)
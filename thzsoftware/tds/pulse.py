@@ -1,60 +1,116 @@
+import functools
+
 import numpy as np
 from scipy import signal
 from thzsoftware import math as mt
 from thzsoftware import fitting as fit
+from thzsoftware.memo import memoize
+from thzsoftware.profiling import instrument
+
+WINDOW_CACHE_SIZE = 256
+_PULSE_SEARCH_HALF_WIDTH = 256  # samples around the peak searched first by define_thz_pulses_batch
 
 
 # convolve mask array over base array
-def convolve(base, mask, dx=1):
-    assert len(base) == len(mask), "Length of input array must be equal."
-    base = base.astype(np.float64)
-    mask = mask.astype(np.float64)  # the 'base' is which ever array is held static, while the mask is
+@instrument
+def convolve(base, mask, dx=1, method="auto"):
+    base = np.asarray(base, dtype=np.float64)
+    mask = np.asarray(mask, dtype=np.float64)  # the 'base' is which ever array is held static, while the mask is
     # being shifted over it.  Typically, one would use a reference pulse as mask, shifting it over a sample base,
-    # to determine delay between two equally shaped pulses.
+    # to determine delay between two equally shaped pulses. 'base' may also be a stack of traces
+    # (n_traces, n_samples), in which case every row is correlated against the mask in a single call.
+    assert base.shape[-1] == mask.shape[-1], "Length of input array must be equal."
+    length = base.shape[-1]
 
-    xs = dx * np.array(range(-len(base), len(base)))[::-1]
-    conv = np.empty_like(xs).astype(np.float64)
-    counter = 0
+    xs = dx * np.array(range(-length, length))[::-1]
 
+    # conv[k] holds the overlap for the mask shifted by k - len(base). The shift by -len(base) never overlaps and
+    # is kept as a leading zero, the remaining shifts are exactly the 'full' cross-correlation.
     # For simplicity, we approximate the integral with rectangular columns.
-    for i in range(-len(base), len(base)):
-        mask_shifted = mt.shift_array(mask, i)
-        conv[counter] = np.sum(dx * base * mask_shifted)
-        counter += 1
+    _, correlation = mt.cross_correlate(base, mask, mode="full", method=method)
+    conv = np.zeros(correlation.shape[:-1] + (2 * length,))
+    conv[..., 1:] = dx * correlation
     return xs, conv
 
 
 # use convolution method to find the highest degrees of overlap between a pulse and a time trace. Multiple pulse can be
 # found, when e.g. looking for echos.
-def find_delayed_pulse(pulse, time_trace, pulse_width_indices, number_of_pulses=1):
+# Returns the positions in the convolve output (the delay of the pulse is position - len(time_trace)) of the
+# number_of_pulses strongest overlaps, strongest first, ignoring overlaps closer than pulse_width_indices // 2 to a
+# stronger one. Missing pulses are 0. time_trace may be a stack of traces (n_traces, n_samples), giving an
+# (n_traces, number_of_pulses) array. With refine=True the positions are refined to fractions of a sample, see
+# find_echoes. With return_magnitudes=True the overlaps at the positions are returned as well.
+@instrument
+def find_delayed_pulse(pulse, time_trace, pulse_width_indices, number_of_pulses=1, refine=False,
+                       return_magnitudes=False):
     _, conv = convolve(time_trace, pulse)
-    peaks, _ = find_peaks(conv)
-
-    out = [0] * number_of_pulses
-    out_magnitude = [0] * number_of_pulses
-
-    for i, peak in enumerate(peaks):
-        peak_magnitude = conv[peak]
-        if peak_magnitude > out_magnitude[-1]:  # if peak is greater than least pulse.
-            for j, observed_magnitude in enumerate(out_magnitude):
-                if out[j] - pulse_width_indices // 2 < peak < out[j] + pulse_width_indices // 2:  # guard against too
-                    # close peaks (of the same pulse)
-                    break
-
-                if observed_magnitude < peak_magnitude:
-                    out_magnitude[j] = peak_magnitude
-                    out[j] = peak
-                    break  # no point continue looping
-                    
-    return out, conv
-
-
+    positions, magnitudes = find_echoes(conv, pulse_width_indices // 2, number_of_pulses, refine)
+    return (positions, magnitudes) if return_magnitudes else positions
+
+
+# the 'number_of_echoes' largest positive local maxima along the last axis of 'correlation', strongest first (ties
+# by position), each at least 'min_distance' samples from every stronger one kept (greedy non-maximum suppression).
+# Returns positions and magnitudes of shape correlation.shape[:-1] + (number_of_echoes,), with position 0 and
+# magnitude 0 where fewer maxima are found (or nan positions with refine=True, which shifts every position to the
+# vertex of the parabola through the maximum and its neighbours).
+# Local maxima are at least 2 samples apart, so each kept echo suppresses at most max(1, min_distance) others and
+# the search is exact among the number_of_echoes * (min_distance + 1) strongest maxima, selected by argpartition.
+@instrument
+def find_echoes(correlation, min_distance, number_of_echoes=1, refine=False):
+    assert isinstance(number_of_echoes, (int, np.integer)) and number_of_echoes > 0, \
+        ValueError(f"'number_of_echoes' must be a positive integer. number_of_echoes = {number_of_echoes}")
+    assert isinstance(min_distance, (int, np.integer)) and min_distance >= 0, \
+        ValueError(f"'min_distance' must be a non-negative integer. min_distance = {min_distance}")
+    correlation = np.asarray(correlation, dtype=np.float64)
+    batch_shape, length = correlation.shape[:-1], correlation.shape[-1]
+    rows = correlation.reshape(-1, length)
+
+    candidates = np.full(rows.shape, -np.inf)
+    inner = rows[:, 1:-1]
+    is_maximum = (inner > rows[:, :-2]) & (inner >= rows[:, 2:]) & (inner > 0)
+    candidates[:, 1:-1][is_maximum] = inner[is_maximum]
+
+    n_candidates = min(length, number_of_echoes * (max(1, min_distance) + 1))
+    indices = np.argpartition(-candidates, n_candidates - 1, axis=-1)[:, :n_candidates]
+    indices.sort(axis=-1)  # ties are broken by position through the stable sort below
+    order = np.argsort(-np.take_along_axis(candidates, indices, -1), axis=-1, kind="stable")
+    indices = np.take_along_axis(indices, order, -1)
+    values = np.take_along_axis(candidates, indices, -1)
+
+    alive = np.isfinite(values)
+    positions = np.zeros((len(rows), number_of_echoes), dtype=np.int64)
+    magnitudes = np.zeros((len(rows), number_of_echoes))
+    row_index = np.arange(len(rows))
+    for echo in range(number_of_echoes):
+        first = np.argmax(alive, axis=-1)  # strongest candidate not suppressed yet
+        found = alive[row_index, first]
+        picked = indices[row_index, first]
+        positions[found, echo] = picked[found]
+        magnitudes[found, echo] = values[row_index, first][found]
+        alive &= ~(found[:, None] & (np.abs(indices - picked[:, None]) < max(1, min_distance)))
+
+    if refine:
+        found = magnitudes > 0
+        left = np.take_along_axis(rows, np.maximum(positions - 1, 0), -1)
+        right = np.take_along_axis(rows, np.minimum(positions + 1, length - 1), -1)
+        curvature = left - 2 * magnitudes + right
+        with np.errstate(divide="ignore", invalid="ignore"):
+            offset = np.where(curvature < 0, .5 * (left - right) / curvature, 0.)
+        positions = np.where(found, positions + np.clip(offset, -.5, .5), np.nan)
+
+    shape = batch_shape + (number_of_echoes,)
+    return positions.reshape(shape), magnitudes.reshape(shape)
+
+
+@instrument
 def find_peaks(pulse):
     # to be expanded. Would like some stability against noise.
     # output = (peaks, properties)
     return signal.find_peaks(pulse)
 
 
+@instrument
+@memoize
 def define_thz_pulses(ys, number_of_pulses=1):
     assert isinstance(number_of_pulses, (int, np.integer)), TypeError("number_of_pulses kwarg must be of type integer."
                                                                       " type(number_of_pulses) = "
@@ -113,39 +169,178 @@ def define_thz_pulses(ys, number_of_pulses=1):
     return left_limit, right_limit
 
 
+# define_thz_pulses for a stack of traces (n_traces, n_samples), with the same polarity flip and limit rules for the
+# dominant pulse of every trace. Returns the arrays left_limits, right_limits and found. Traces without a valid pulse
+# (all zero, not crossing zero, or lacking the zero crossings the limits are placed at) have found = False and
+# limits 0 instead of raising. Peaks are local maxima as in find_peaks, flat peaks counting at their middle sample.
+@instrument
+def define_thz_pulses_batch(ys):
+    ys = np.asarray(ys, dtype=np.float64)
+    assert ys.ndim == 2, ValueError(f"'ys' must be a (n_traces, n_samples) array. ys.ndim = {ys.ndim}")
+    n_traces, n_samples = ys.shape
+    if n_samples < 3:
+        return np.zeros(n_traces, dtype=np.int64), np.zeros(n_traces, dtype=np.int64), np.zeros(n_traces, bool)
+
+    # flip traces whose most extreme peak is negative, see define_thz_pulses
+    maxima, minima = np.max(ys, axis=-1), np.min(ys, axis=-1)
+    flip = maxima < -minima
+    found = ((maxima != 0) | (minima != 0)) & (np.where(flip, -maxima, minima) < 0)
+    ys = ys * np.where(flip, -1., 1.)[:, None]
+
+    # a unique maximum inside the trace is the highest local maximum, other traces need the full peak search
+    peaks = np.argmax(ys, axis=-1)
+    unique = (peaks == n_samples - 1 - np.argmax(ys[:, ::-1], axis=-1)) & (peaks > 0) & (peaks < n_samples - 1)
+    if not unique.all():
+        peaks[~unique], peak_found = _dominant_peaks(ys[~unique])
+        found[~unique] &= peak_found
+
+    # the limits only depend on the zero crossings next to the peak, so they are searched in a window around it
+    # first, and in the whole trace for the traces whose window was too short
+    offsets = np.arange(-_PULSE_SEARCH_HALF_WIDTH, _PULSE_SEARCH_HALF_WIDTH + 1)
+    starts = peaks - _PULSE_SEARCH_HALF_WIDTH
+    windows = ys[np.arange(n_traces)[:, None], np.clip(peaks[:, None] + offsets, 0, n_samples - 1)]
+    left_limits, right_limits, limits_found = _pulse_limits(windows, np.full(n_traces, _PULSE_SEARCH_HALF_WIDTH))
+    left_limits += starts
+    right_limits += starts
+    retry = ~limits_found & found & ((starts > 0) | (starts + len(offsets) < n_samples))
+    if retry.any():
+        left_limits[retry], right_limits[retry], limits_found[retry] = _pulse_limits(ys[retry], peaks[retry])
+    found &= limits_found
+
+    left_limits = np.where(found, np.maximum(left_limits, 0), 0)
+    right_limits = np.where(found, right_limits, 0)
+    return left_limits, right_limits, found
+
+
+# highest local maximum of every row (the last of equally high ones, as the sort in define_thz_pulses), and whether
+# the row has one. A local maximum is a rise, a (possibly empty) flat run and a fall, counted at the run's middle.
+def _dominant_peaks(ys):
+    n_traces, n_samples = ys.shape
+    positions = np.arange(n_samples - 1)
+    slopes = np.sign(np.diff(ys, axis=-1))
+    last_slope = np.maximum.accumulate(np.where(slopes != 0, positions, -1), axis=-1)
+    falling_rows, falling = np.nonzero(slopes[:, 1:] < 0)
+    run_start = last_slope[falling_rows, falling]  # last non-flat slope before the fall
+    is_peak = (run_start >= 0) & (slopes[falling_rows, np.maximum(run_start, 0)] > 0)
+    peak_rows = falling_rows[is_peak]
+    peak_positions = (run_start[is_peak] + 1 + falling[is_peak] + 1) // 2
+
+    peak_values = np.full(ys.shape, -np.inf)
+    peak_values[peak_rows, peak_positions] = ys[peak_rows, peak_positions]
+    peaks = n_samples - 1 - np.argmax(peak_values[:, ::-1], axis=-1)
+    return peaks, np.isfinite(peak_values[np.arange(n_traces), peaks])
+
+
+# limit rules of define_thz_pulses for the given peak of every row. Zero crossing i lies between samples i and i + 1
+# (see math.zero_crossings). Returns left and right limits (the left one not yet clipped at 0) and whether the
+# crossings they are placed at exist.
+def _pulse_limits(ys, peaks):
+    n_traces, n_samples = ys.shape
+    rows = np.arange(n_traces)
+    positions = np.arange(n_samples - 1)
+    crossings = np.diff(np.sign(ys), axis=-1) != 0
+    previous_crossing = np.maximum.accumulate(np.where(crossings, positions, -1), axis=-1)
+    next_crossing = np.minimum.accumulate(np.where(crossings, positions, n_samples)[:, ::-1], axis=-1)[:, ::-1]
+
+    def before(index):  # last crossing < index, -1 if none
+        return np.where(index >= 1, previous_crossing[rows, np.clip(index - 1, 0, n_samples - 2)], -1)
+
+    def after(index):  # first crossing > index, n_samples if none
+        return np.where(index + 1 <= n_samples - 2, next_crossing[rows, np.clip(index + 1, 0, n_samples - 2)],
+                        n_samples)
+
+    # left limit: the region before the peak extends twice as far as the minimum between the two last crossings
+    # before the peak, plus a quarter
+    left_crossing = before(peaks)
+    left_crossing_minus_1 = before(left_crossing)
+    in_range = (positions >= left_crossing_minus_1[:, None]) & (positions < left_crossing[:, None])
+    left_min = np.argmin(np.where(in_range, ys[:, :-1], np.inf), axis=-1)
+    dist_to_min = peaks - left_min
+    left_limits = peaks - 2 * dist_to_min - dist_to_min // 4
+
+    # right limit: the second zero crossing after the peak, at least 5 samples past the first one
+    right_limits = after(after(peaks) + 4)
+    return left_limits, right_limits, (left_crossing_minus_1 >= 0) & (right_limits < n_samples)
+
+
+# window shape of 'points' samples, cached by (window type, points, alpha). The returned array is shared between
+# callers and therefore read-only. Cache statistics: window_shape.cache_info().
+@instrument
+def window_shape(window_func, points, alpha=.5):
+    window_func = window_func.lower().replace("box_car", "boxcar")
+    assert window_func in ("boxcar", "tukey", "cosine"), ValueError("Window function not permitted. Permitted "
+                                                                    "functions are: boxcar, box_car, tukey, cosine")
+    # alpha only shapes the tukey window, so the other windows share one cache entry per length
+    return _window_shape(window_func, int(points), float(alpha) if window_func == "tukey" else None)
+
+
+@functools.lru_cache(maxsize=WINDOW_CACHE_SIZE)
+def _window_shape(window_func, points, alpha):
+    shape = _window_values(window_func, np.arange(points), points, alpha)
+    shape.flags.writeable = False
+    return shape
+
+
+# value of the window at sample n of a window of 'points' samples. n and points broadcast, so windows of different
+# lengths are evaluated in one pass. The formulas (and the order of operations) are those of scipy.signal.windows, a
+# Tukey window with alpha >= 1 being the Hann window.
+def _window_values(window_func, n, points, alpha):
+    if window_func == "boxcar" or (window_func == "tukey" and alpha <= 0):
+        return np.ones(np.broadcast(n, points).shape)
+    if window_func == "cosine":
+        return np.sin(np.pi / np.maximum(points, 1) * (n + .5))
+    alpha = min(alpha, 1.)
+    span = np.maximum(points - 1, 1)
+    width = np.floor(alpha * (points - 1) / 2.)
+    rising = n <= width
+    falling = n >= points - width - 1
+    taper = .5 * (1 + np.cos(np.pi * np.where(rising, -1 + 2. * n / alpha / span,
+                                              -2. / alpha + 1 + 2. * n / alpha / span)))
+    return np.where((rising | falling) & (points > 1), taper, 1.)
+
+
+window_shape.cache_info = _window_shape.cache_info
+window_shape.cache_clear = _window_shape.cache_clear
+
+
 # apply window function
-def window(ys, limits, window_func="tukey", tukey_alpha=.1):
+# ys may be a stack of traces (n_traces, n_samples). With a single pair of limits every trace gets the same window,
+# with limits of shape (n_traces, 2) every trace gets its own.
+@instrument
+@memoize
+def window(ys, limits, window_func="tukey", tukey_alpha=.5):
     assert isinstance(ys, (tuple, list, np.ndarray)), \
         TypeError("Input array must be array-like.", f" type(ys) = {type(ys)}")
-    assert isinstance(limits, (tuple, list, np.ndarray)) and len(limits) == 2, \
-        TypeError("Input limits must be array-like of length 2.", f" type(limits) = {type(limits)},"
-                                                                  f" len(limits) = {len(limits)}.")
-
-    if limits[0] > limits[1]:
-        limits = tuple(list(limits).sort())
-
-    assert limits[0] >= 0 and limits[1] < len(ys), ValueError(f"limits out of bound. limits = {limits} for array of "
-                                                              f"len(ys) = {len(ys)}.")
+    assert isinstance(limits, (tuple, list, np.ndarray)) and np.ndim(limits) in (1, 2) and \
+        np.shape(limits)[-1] == 2, TypeError("Input limits must be array-like of length 2, or of shape (n_traces, 2).",
+                                             f" type(limits) = {type(limits)}, shape = {np.shape(limits)}.")
     window_func = window_func.lower()
     permitted_windows = ("boxcar", "box_car", "tukey", "cosine")
     assert window_func in permitted_windows, ValueError("Window function not permitted. Permitted functions are:  "
                                                         " ".join(permitted_windows))
 
-    window_array = np.zeros(len(ys))
-
-    points = limits[1] - limits[0]
-
-    if window_func == "boxcar" or window_func == "box_car":
-        window_array[limits[0]:limits[1]] = 1
-        return ys * window_array
-
-    if window_func == "cosine":
-        window_array[limits[0]:limits[1]] = signal.cosine(points)
-        return ys * window_array
-
-    if window_func == "tukey":
-        window_array[limits[0]:limits[1]] = signal.tukey(points)
-        return ys * window_array
-
-    raise Exception("No switch statement triggerd. Something went terribly. "
-                    "Please contact your local medium or spiritual guide.")
+    ys = np.asarray(ys)
+    limits = np.sort(np.asarray(limits, dtype=int), axis=-1)
+    assert np.all(limits[..., 0] >= 0) and np.all(limits[..., 1] < ys.shape[-1]), \
+        ValueError(f"limits out of bound. limits = {limits} for array of len(ys) = {ys.shape[-1]}.")
+
+    if limits.ndim == 2:
+        return _window_batch(ys, limits, window_func, tukey_alpha)
+
+    # outside the limits the window is zero, so only the windowed slice is multiplied
+    out = np.zeros(ys.shape, dtype=np.result_type(ys, np.float64))
+    out[..., limits[0]:limits[1]] = ys[..., limits[0]:limits[1]] * window_shape(window_func, limits[1] - limits[0],
+                                                                                tukey_alpha)
+    return out
+
+
+# per-trace windows of a (n_traces, n_samples) stack, all evaluated at once on the sample positions relative to each
+# trace's left limit.
+def _window_batch(ys, limits, window_func, tukey_alpha):
+    assert ys.ndim == 2 and limits.shape == (len(ys), 2), \
+        ValueError(f"Per-trace limits must have shape (n_traces, 2). limits.shape = {limits.shape}, "
+                   f"ys.shape = {ys.shape}.")
+    points = limits[:, 1:] - limits[:, :1]
+    n = np.arange(ys.shape[-1]) - limits[:, :1]
+    inside = (n >= 0) & (n < points)
+    return np.where(inside, ys * _window_values(window_func.replace("box_car", "boxcar"), n, points, tukey_alpha), 0.)
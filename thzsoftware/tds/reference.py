@@ -0,0 +1,134 @@
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+import thzsoftware
+from thzsoftware import store
+from thzsoftware.profiling import instrument
+from thzsoftware.tds import phase as ph
+from thzsoftware.tds import pulse as pl
+
+DEFAULT_CACHE_BYTES = 2 ** 26  # budget for spectra held in memory by a SpectrumCache
+
+
+# least recently used store of processed spectra, bounded by the bytes of the arrays it holds, and optionally backed
+# by a directory of .npz files which outlives the process (e.g. notebook restarts), itself bounded by max_disk_bytes
+# (None: unbounded, see store.FileStore). Entries are held as tuples of read-only arrays and handed out as copies,
+# like memo results. The most recently used entry is always kept, even if it alone exceeds the budget.
+class SpectrumCache:
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES, directory=None, max_disk_bytes=None):
+        assert isinstance(max_bytes, (int, np.integer)) and max_bytes >= 0, \
+            ValueError(f"'max_bytes' must be a non-negative integer. max_bytes = {max_bytes}")
+        assert isinstance(directory, str) or directory is None, TypeError("'directory' must be str or None. "
+                                                                          f"type(directory) = {type(directory)}")
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.n_bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (arrays, size in bytes)
+        self._store = None if directory is None else store.FileStore(directory, ".npz", max_disk_bytes)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries or (self._store is not None and key in self._store)
+
+    # copies of the arrays stored under 'key', computed by compute() (returning a tuple of arrays) on a miss.
+    def get(self, key, compute):
+        if key in self._entries:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return tuple(np.array(array) for array in self._entries[key][0])
+
+        arrays = self._read(key)
+        if arrays is not None:
+            self.disk_hits += 1
+        else:
+            self.misses += 1
+            arrays = tuple(np.array(array) for array in compute())
+            self._write(key, arrays)
+        for array in arrays:
+            array.flags.writeable = False
+        self._insert(key, arrays)
+        return tuple(np.array(array) for array in arrays)
+
+    def _insert(self, key, arrays):
+        size = sum(array.nbytes for array in arrays)
+        self._entries[key] = (arrays, size)
+        self.n_bytes += size
+        while self.n_bytes > self.max_bytes and len(self._entries) > 1:
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self.n_bytes -= evicted_size
+
+    def _read(self, key):
+        if self._store is None:
+            return None
+        return self._store.read(key, _load_spectrum)  # unreadable (e.g. truncated) files are recomputed
+
+    def _write(self, key, arrays):
+        if self._store is not None:
+            self._store.write(key, lambda file: np.savez(file, *arrays))
+
+    # empty the memory, and with disk=True the directory as well.
+    def clear(self, disk=False):
+        self._entries.clear()
+        self.n_bytes = 0
+        if disk and self._store is not None:
+            self._store.clear()
+
+
+def _load_spectrum(path):
+    with np.load(path) as stored:
+        return tuple(stored[f"arr_{i}"] for i in range(len(stored.files)))
+
+
+# hash of the trace content (values, dtype and shape) and of everything else that shapes the spectrum, including the
+# library version so persisted spectra are recomputed after an update.
+def spectrum_key(trace, sample_rate, **parameters):
+    trace = np.ascontiguousarray(trace)
+    digest = hashlib.sha1(f"{thzsoftware.__version__}{trace.dtype.str}{trace.shape}{float(sample_rate)!r}".encode())
+    digest.update(trace.data)
+    for name in sorted(parameters):
+        value = parameters[name]
+        if isinstance(value, np.ndarray):
+            value = value.tolist()
+        digest.update(f"{name}={value!r};".encode())
+    return digest.hexdigest()
+
+
+# window -> fft -> unwrapped phase (-> extrapolated phase if f_limits are given) of a reference trace, as
+# (frequencies, norm, phase). With a SpectrumCache as 'cache' they are taken from it when the same trace was processed
+# with the same parameters before, without one (None) they are always computed. limits default to define_thz_pulses
+# of the trace. trace may be a stack of traces (n_traces, n_samples), with limits of shape (n_traces, 2) or default
+# limits of define_thz_pulses_batch.
+@instrument
+def reference_spectrum(trace, sample_rate, limits=None, window_func="tukey", tukey_alpha=.5, pad=None, f_limits=None,
+                       cache=None):
+    assert isinstance(cache, SpectrumCache) or cache is None, TypeError("'cache' must be a SpectrumCache or None. "
+                                                                        f"type(cache) = {type(cache)}")
+    trace = np.asarray(trace)
+    # omitted limits are keyed as None, so a hit skips the pulse search as well
+    limits = None if limits is None else np.asarray(limits, dtype=np.int64)
+    f_limits = None if f_limits is None else tuple(float(f_limit) for f_limit in f_limits)
+    key = spectrum_key(trace, sample_rate, limits=limits, window_func=window_func, tukey_alpha=float(tukey_alpha),
+                       pad=pad, f_limits=f_limits)
+
+    def compute():
+        window_limits = limits
+        if window_limits is None and trace.ndim == 1:
+            window_limits = pl.define_thz_pulses(trace)
+        elif window_limits is None:
+            left_limits, right_limits, found = pl.define_thz_pulses_batch(trace)
+            assert found.all(), ValueError(f"No pulse found in trace(s) {np.nonzero(~found)[0].tolist()}.")
+            window_limits = np.column_stack((left_limits, right_limits))
+        windowed = pl.window(trace, window_limits, window_func=window_func, tukey_alpha=tukey_alpha)
+        fs, spectrum = ph.fft(windowed, sample_rate, pad=pad)
+        norm, phase = ph.compute_phase(spectrum)
+        if f_limits is not None:
+            phase = ph.extrapolate_phase(fs, phase, f_limits)
+        return fs, norm, phase
+
+    return compute() if cache is None else cache.get(key, compute)
@@ -0,0 +1,85 @@
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import numpy as np
+import scipy.optimize as opt
+from scipy.constants import c
+from thzsoftware.profiling import instrument
+from thzsoftware.tds import transfer as tr
+
+CRITERIA = ("total_variation", "smoothness")
+
+
+# cost of each candidate thickness [m]: the roughness of n(f) and kappa(f) of transfer.solve_refractive_index within
+# 'band' [Hz], solved for the whole grid at once. A wrong thickness leaves the Fabry-Perot echoes in the sample trace
+# unexplained, which shows up as ripple in n and kappa. criterion "total_variation" is the mean absolute step
+# |dn| + |dkappa| between neighbouring frequencies, "smoothness" the mean squared second difference. Frequencies which
+# did not converge are left out, a thickness without any converged neighbours costs inf.
+@instrument
+def thickness_cost(fs, reference_spectrum, sample_spectrum, thicknesses, band, criterion="total_variation", n0=1.,
+                   echoes=None, f_limits=None, max_iterations=50, tolerance=1e-10):
+    assert criterion in CRITERIA, ValueError("'criterion' option invalid. Use any of: " + ", ".join(CRITERIA))
+    assert len(band) == 2 and band[0] < band[1], ValueError(f"'band' must be (f_min, f_max). band = {band}")
+    fs = np.asarray(fs, dtype=np.float64)
+    thicknesses = np.asarray(thicknesses, dtype=np.float64)
+    assert thicknesses.ndim == 1 and np.all(thicknesses > 0), ValueError("'thicknesses' must be a 1-D grid of "
+                                                                         "positive thicknesses.")
+    in_band = (fs >= band[0]) & (fs <= band[1])
+    assert in_band.sum() > 2, ValueError(f"Fewer than three frequencies in the band. band = {band}")
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        measured, valid = tr._measured_log_transfer(fs, np.asarray(reference_spectrum), np.asarray(sample_spectrum),
+                                                    f_limits)
+        phase_length = 2 * np.pi * fs[in_band] * thicknesses[:, None] / c
+        n_complex, converged = tr._solve(phase_length, measured[in_band], valid[in_band], n0, echoes,
+                                         max_iterations, tolerance)
+
+    n_complex = np.where(converged, n_complex, np.nan)
+    if criterion == "total_variation":
+        steps = np.abs(np.diff(n_complex.real, axis=-1)) + np.abs(np.diff(n_complex.imag, axis=-1))
+    else:
+        steps = np.diff(n_complex.real, 2, axis=-1) ** 2 + np.diff(n_complex.imag, 2, axis=-1) ** 2
+    counted = np.isfinite(steps)
+    return np.where(counted.any(axis=-1), np.nansum(steps, axis=-1) / np.maximum(counted.sum(axis=-1), 1), np.inf)
+
+
+# thickness [m] of a transmission sample which minimises thickness_cost: the best of the grid 'thicknesses', refined
+# by a bounded search between its neighbours in thickness to 'xatol' (default: 1e-3 of the grid step). Returns the
+# thickness and the cost curve over the grid in the order given, (thickness, costs).
+@instrument
+def optimize_thickness(fs, reference_spectrum, sample_spectrum, thicknesses, band, xatol=None, **kwargs):
+    thicknesses = np.asarray(thicknesses, dtype=np.float64)
+    costs = thickness_cost(fs, reference_spectrum, sample_spectrum, thicknesses, band, **kwargs)
+    best = int(np.argmin(costs))
+    if len(thicknesses) < 2 or not np.isfinite(costs[best]):
+        return thicknesses[best], costs
+
+    grid = np.sort(thicknesses)
+    position = int(np.searchsorted(grid, thicknesses[best]))
+    bounds = grid[max(position - 1, 0)], grid[min(position + 1, len(grid) - 1)]
+    xatol = 1e-3 * np.min(np.diff(grid)) if xatol is None else xatol
+    result = opt.minimize_scalar(
+        lambda thickness: thickness_cost(fs, reference_spectrum, sample_spectrum, [thickness], band, **kwargs)[0],
+        bounds=bounds, method="bounded", options={"xatol": xatol})
+    if result.fun < costs[best]:
+        return float(result.x), costs
+    return thicknesses[best], costs
+
+
+# optimize_thickness for a stack of samples (n_samples, n_frequencies), against one reference spectrum or one per
+# sample, spread over a pool of 'workers' processes. Returns the thicknesses (n_samples,) and the cost curves
+# (n_samples, n_thicknesses), in the order of the grid given.
+@instrument
+def optimize_thickness_batch(fs, reference_spectra, sample_spectra, thicknesses, band, workers=1, **kwargs):
+    assert isinstance(workers, int) and workers > 0, ValueError(f"'workers' must be a positive int. workers = "
+                                                                f"{workers}")
+    sample_spectra = np.atleast_2d(sample_spectra)
+    reference_spectra = np.broadcast_to(reference_spectra, sample_spectra.shape)
+    optimize = partial(optimize_thickness, fs, thicknesses=thicknesses, band=band, **kwargs)
+    if workers == 1:
+        results = list(map(optimize, reference_spectra, sample_spectra))
+    else:
+        with ProcessPoolExecutor(workers) as process_pool:
+            results = list(process_pool.map(optimize, reference_spectra, sample_spectra,
+                                            chunksize=max(1, len(sample_spectra) // (4 * workers))))
+    return np.array([thickness for thickness, _ in results]), np.array([costs for _, costs in results])
@@ -0,0 +1,111 @@
+import numpy as np
+from scipy.constants import c
+from thzsoftware.profiling import instrument
+from thzsoftware.tds import phase as ph
+
+# The complex refractive index is n_complex = n - 1j * kappa, with kappa > 0 for absorption, matching the sign of
+# the forward transform of phase.fft, where a delay t multiplies a spectrum by exp(-2j * pi * f * t).
+
+
+# transfer function sample / reference of a slab of n_complex and 'thickness' [m] in a medium of index n0 at normal
+# incidence: the Fresnel losses of both surfaces, the propagation against the medium, and with echoes != 0 the
+# Fabry-Perot term of the internal reflections. echoes=m counts the first m round trips, matching a time window which
+# holds m echoes, echoes=None all of them. n_complex broadcasts against fs along the last axis.
+def transfer_function(fs, n_complex, thickness, n0=1., echoes=0):
+    log_transfer, _ = _log_transfer(2 * np.pi * np.asarray(fs, dtype=np.float64) * thickness / c,
+                                    np.asarray(n_complex, dtype=np.complex128), n0, echoes)
+    return np.exp(log_transfer)
+
+
+# log of the transfer function and its derivative by n_complex, with phase_length = omega * thickness / c.
+def _log_transfer(phase_length, n_complex, n0, echoes):
+    n_sum = n_complex + n0
+    log_transfer = np.log(4 * n0 * n_complex / n_sum ** 2) - 1j * (n_complex - n0) * phase_length
+    derivative = 1 / n_complex - 2 / n_sum - 1j * phase_length
+    if echoes != 0:
+        reflection = (n_complex - n0) / n_sum
+        propagation = np.exp(-2j * n_complex * phase_length)
+        round_trip = reflection ** 2 * propagation
+        round_trip_derivative = 4 * n0 * reflection / n_sum ** 2 * propagation - 2j * phase_length * round_trip
+        log_transfer = log_transfer - np.log(1 - round_trip)
+        derivative = derivative + round_trip_derivative / (1 - round_trip)
+        if echoes is not None:  # the sum of the first echoes: (1 - q ** (m + 1)) / (1 - q)
+            echo_terms = round_trip ** echoes
+            log_transfer = log_transfer + np.log(1 - echo_terms * round_trip)
+            derivative = derivative - (echoes + 1) * echo_terms * round_trip_derivative / (1 - echo_terms * round_trip)
+    return log_transfer, derivative
+
+
+# n(f) and kappa(f) of a slab of 'thickness' [m] from the complex spectra of phase.fft of a reference and a sample
+# measurement, by a complex Newton iteration on log(model transfer) = log(sample / reference), run for all frequencies
+# (and for stacks of samples, frequencies along 'axis') at once. The measured phase is unwrapped from the lowest
+# frequency, or, with f_limits, extrapolated to zero by phase.extrapolate_phase with the fit over f_limits [Hz].
+# The iteration starts from n of the phase delay and kappa of the amplitude left after the surface losses. Returns n,
+# kappa and the mask of the frequencies which converged to 'tolerance' (relative step) in at most max_iterations,
+# instead of raising on single frequencies. n and kappa are nan where the transfer function is undefined (f = 0,
+# empty reference).
+@instrument
+def solve_refractive_index(fs, reference_spectrum, sample_spectrum, thickness, n0=1., echoes=0, f_limits=None,
+                           max_iterations=50, tolerance=1e-10, axis=-1):
+    assert isinstance(thickness, (int, float, np.integer, np.floating)) and thickness > 0, \
+        ValueError(f"'thickness' must be a positive number. thickness = {thickness}")
+    assert echoes is None or (isinstance(echoes, (int, np.integer)) and echoes >= 0), \
+        ValueError(f"'echoes' must be a non-negative int or None. echoes = {echoes}")
+    assert isinstance(max_iterations, int) and max_iterations > 0, \
+        ValueError(f"'max_iterations' must be a positive int. max_iterations = {max_iterations}")
+
+    fs = np.asarray(fs, dtype=np.float64)
+    reference_spectrum = np.moveaxis(np.asarray(reference_spectrum), axis, -1)
+    sample_spectrum = np.moveaxis(np.asarray(sample_spectrum), axis, -1)
+    assert reference_spectrum.shape[-1] == sample_spectrum.shape[-1] == len(fs), \
+        ValueError(f"Spectra and frequencies differ in length. len(fs) = {len(fs)}, reference_spectrum.shape = "
+                   f"{reference_spectrum.shape}, sample_spectrum.shape = {sample_spectrum.shape}")
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        measured, valid = _measured_log_transfer(fs, reference_spectrum, sample_spectrum, f_limits)
+        n_complex, converged = _solve(2 * np.pi * fs * thickness / c, measured, valid, n0, echoes, max_iterations,
+                                      tolerance)
+
+    return np.moveaxis(n_complex.real, -1, axis), np.moveaxis(-n_complex.imag, -1, axis), \
+        np.moveaxis(converged, -1, axis)
+
+
+# log(sample / reference) with the unwrapped (and extrapolated) phase, and the mask of the entries where it is defined.
+def _measured_log_transfer(fs, reference_spectrum, sample_spectrum, f_limits):
+    transfer = sample_spectrum / reference_spectrum
+    valid = np.isfinite(transfer) & (transfer != 0) & (fs > 0)
+    # undefined entries repeat the last defined one, so they do not add phase jumps to the unwrapping
+    last_valid = np.maximum.accumulate(np.where(valid, np.arange(len(fs)), 0), axis=-1)
+    phase = np.unwrap(np.angle(np.take_along_axis(np.where(valid, transfer, 1), last_valid, axis=-1)), axis=-1)
+    if f_limits is not None:
+        phase = ph.extrapolate_phase(fs, phase, f_limits)
+    return np.log(np.abs(transfer)) + 1j * phase, valid
+
+
+# n_complex and convergence mask for the measured log transfer, with phase_length = omega * thickness / c. Both may
+# broadcast, e.g. a grid of thicknesses phase_length (n_thicknesses, n_frequencies) against one measurement.
+def _solve(phase_length, measured, valid, n0, echoes, max_iterations, tolerance):
+    n = n0 - measured.imag / phase_length
+    kappa = (_log_transfer(phase_length, n + 0j, n0, echoes)[0].real - measured.real) / phase_length
+    n_complex = np.where(valid, n - 1j * kappa, np.nan)
+
+    # a truncated echo sum has spurious roots of gain (kappa < 0) next to the start values, so it starts from the
+    # solution with all echoes, which differs by the round trip to the power echoes + 1
+    if echoes not in (0, None):
+        n_complex, _ = _newton(phase_length, measured, n_complex, n0, None, ~valid, max_iterations, tolerance)
+    n_complex, converged = _newton(phase_length, measured, n_complex, n0, echoes, ~valid, max_iterations, tolerance)
+    return n_complex, converged & valid & np.isfinite(n_complex)
+
+
+# Newton iteration of n_complex on log(model transfer) = measured, for the entries not 'converged' yet.
+def _newton(phase_length, measured, n_complex, n0, echoes, converged, max_iterations, tolerance):
+    for _ in range(max_iterations):
+        log_transfer, derivative = _log_transfer(phase_length, n_complex, n0, echoes)
+        step = np.where(converged, 0, (log_transfer - measured) / derivative)
+        # damped where the step is large against the index, e.g. at low frequencies of poor start values
+        step *= np.minimum(1, .5 * np.abs(n_complex) / np.maximum(np.abs(step), 1e-300))
+        n_complex = n_complex - step
+        converged = converged | (np.abs(step) <= tolerance * np.abs(n_complex))
+        if converged.all():
+            break
+    return n_complex, converged